@@ -1,85 +1,131 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from datetime import datetime
+import gzip
+from enum import Enum
 from uuid import uuid4
-from collections import defaultdict
+import json
 import logging
-from typing import Optional, List, Annotated
+from typing import Optional, Annotated
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import SQLAlchemyError, NoResultFound
-from sqlalchemy.future import select
-from collections import defaultdict
-from sqlalchemy.orm import selectinload
-from app.core.database import get_async_session
-
-from app.models import (
-    Customer as CustomerModel,
-    Action as ActionModel,
-    BillingReport as BillingReportModel,
+from sqlalchemy.exc import SQLAlchemyError
+from app.core.database import get_async_session, async_session
+from app.core.instrumentation import REPORT_ITEMS
+
+from app.schemas import BillingReport as BillingReportSchema
+from app.crud.billing_engine import (
+    aggregate_billing_report,
+    billing_report_with_items,
+    has_actions,
+    stream_report_items,
+    empty_report_totals,
+    add_item_to_totals,
 )
-from app.crud.leads_service import calculate_action_value
-from app.schemas import (
-    BillingReport as BillingReportSchema,
-    BillingReportItem as BillingReportItemSchema,
+from app.crud.billing_rollup_service import (
+    closed_month_range,
+    rollup_billing_report,
 )
-from app.crud.billing_report_service import (
-    is_duplicate_action,
-    calculate_totals_by_product,
+from app.crud.reference_data_service import get_customer
+from app.crud.report_render_service import (
+    RENDERERS,
+    render_report,
+    report_render_context,
 )
-from app.shared import (
-    LEAD_TYPE_BASE_VALUES,
-    LEAD_ACTION_COSTS,
-    ENGAGEMENT_MULTIPLIERS,
-    BILLING_CAP,
+from app.crud.report_snapshot_service import (
+    find_report_snapshot,
+    read_report_snapshot,
+    report_fingerprint,
+    save_report_snapshot,
 )
+from app.shared import DedupWindows
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-def calculate_action_value(
-    lead_type: str, action_type: str, engagement_level: str
-) -> float:
-    base_value = LEAD_TYPE_BASE_VALUES.get(lead_type, 0)
-    action_value = LEAD_ACTION_COSTS.get(lead_type, {}).get(action_type, 0)
-    engagement_multiplier = ENGAGEMENT_MULTIPLIERS.get(engagement_level, 1)
-    return base_value + (action_value * engagement_multiplier)
-
-
-def format_report(
-    report: BillingReportSchema, customer_name: str, customer_email: str
-) -> str:
-    report_str = f"### **Detailed Billing Breakdown**\n\n"
-    report_str += f"#### **B2B Partner Company: `{customer_name}`**\n"
-    report_str += f"**End Customer Email:** `{customer_email}`\n\n"
-    report_str += "| **Customer Email** | **Associated Product** | **Lead Type**    | **Action Type**    | **Engagement Level** | **Amount (USD)** | **Duplicate**                 | **Status**                 |\n"
-    report_str += "|--------------------|------------------------|-------------------|--------------------|-----------------------|-------------------|-------------------------------|----------------------------|\n"
-
-    for item in report.items:
-        report_str += f"| `{item.customer_email}`   | `{item.associated_product}`          | {item.lead_type}     | {item.action_type}    | {item.engagement_level}                  | ${item.amount:.2f}            | {'Yes' if item.duplicate else 'No'}                            | {item.status}                     |\n"
-
-    report_str += "\n"
-    for product, subtotal in report.product_subtotals.items():
-        report_str += f"**Subtotal for `{product}`:** ${subtotal:.2f}  \n"
-
-    report_str += f"\n**Total Billed Amount:** ${report.total_billed_amount:.2f}  \n"
-    report_str += (
-        f"**Total Savings from Duplicates and Caps:** ${report.total_savings:.2f}\n\n"
-    )
-    report_str += "*Explanation: Duplicate actions have been detected and not billed again, resulting in significant savings."
-    if report.total_billed_amount == BILLING_CAP:
-        report_str += (
-            " The total billed amount has reached the billing cap of $100.00.*\n\n"
-        )
-    else:
-        report_str += (
-            " The total billed amount is below the billing cap of $100.00.*\n\n"
-        )
+class ReportFormats(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+    JSON_STREAM = "json-stream"
+
+
+class RenderFormats(str, Enum):
+    MARKDOWN = "md"
+    CSV = "csv"
+    HTML = "html"
+
 
-    return report_str
+async def stream_ndjson_report(
+    customer_id: str,
+    customer_email: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    dedup_window: DedupWindows,
+):
+    """One JSON line per report item, then a trailer line with the totals."""
+    totals = empty_report_totals()
+    # The request session is closed once the endpoint returns, so the cursor
+    # gets a session of its own that lives as long as the response body.
+    async with async_session() as session:
+        async for items in stream_report_items(
+            session, customer_id, customer_email, start_date, end_date, dedup_window
+        ):
+            lines = []
+            for item in items:
+                add_item_to_totals(totals, item)
+                lines.append(json.dumps(item))
+            yield "\n".join(lines) + "\n"
+
+    REPORT_ITEMS.labels(ReportFormats.NDJSON.value).observe(totals["action_count"])
+    yield json.dumps({"trailer": {"customer_id": customer_id, **totals}}) + "\n"
+
+
+async def stream_json_report(
+    customer_id: str,
+    customer_email: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    dedup_window: DedupWindows,
+):
+    """The regular report document, with items written out as they are read."""
+    totals = empty_report_totals()
+    header = json.dumps({"id": str(uuid4()), "customer_id": customer_id})
+    yield header[:-1] + ', "items": ['
+
+    separator = ""
+    async with async_session() as session:
+        async for items in stream_report_items(
+            session, customer_id, customer_email, start_date, end_date, dedup_window
+        ):
+            for item in items:
+                add_item_to_totals(totals, item)
+            yield separator + ", ".join(json.dumps(item) for item in items)
+            separator = ", "
+
+    REPORT_ITEMS.labels(ReportFormats.JSON_STREAM.value).observe(totals["action_count"])
+    yield "], " + json.dumps(totals)[1:]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def snapshot_response(request: Request, etag: str, data: bytes) -> Response:
+    """Serve a gzip report file as is to clients that accept gzip."""
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        data = gzip.decompress(data)
+    return Response(content=data, media_type="application/json", headers=headers)
 
 
 @router.get("/billingReports", response_model=BillingReportSchema)
 async def generate_billing_report(
+    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)],
     customer_id: str,
     start_date: Optional[datetime] = Query(
@@ -88,175 +134,160 @@ async def generate_billing_report(
     end_date: Optional[datetime] = Query(
         None, description="End date for the billing report"
     ),
+    include_items: bool = Query(
+        False, description="Include the priced line items in the report"
+    ),
+    dedup_window: DedupWindows = Query(
+        DedupWindows.REPORT,
+        description="Bill repeated actions once per report or once per month",
+    ),
+    format: ReportFormats = Query(
+        ReportFormats.JSON,
+        description="json, or ndjson/json-stream to stream line items",
+    ),
+    if_none_match: Optional[str] = Header(None),
 ):
     try:
-        # Fetch the customer details
-        customer_query = select(CustomerModel).where(CustomerModel.id == customer_id)
-        customer_result = await db.execute(customer_query)
-        customer = customer_result.unique().scalar_one_or_none()
+        customer = await get_customer(db, customer_id)
 
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
 
-        customer_name = customer.name
         customer_email = customer.email
 
-        query = select(ActionModel).where(ActionModel.customer_id == customer_id)
-        if start_date:
-            query = query.where(ActionModel.created_at >= start_date)
-        if end_date:
-            query = query.where(ActionModel.created_at <= end_date)
-
-        result = await db.execute(query)
-        actions = result.unique().scalars().all()
-
-        if not actions:
+        streamed = format in (ReportFormats.NDJSON, ReportFormats.JSON_STREAM)
+        # streams start with a 200, so an empty range is answered up front
+        if streamed and not await has_actions(db, customer_id, start_date, end_date):
             raise HTTPException(
                 status_code=404,
                 detail="No actions found for the given customer and date range",
             )
 
-        total_billed_amount = 0.0
-        total_savings = 0.0
-        report_items = []
-        product_subtotals = defaultdict(float)
-        seen_actions = set()
-
-        for action in actions:
-            lead_amount = LEAD_TYPE_BASE_VALUES.get(action.lead_type, 0)
+        if format == ReportFormats.NDJSON:
+            return StreamingResponse(
+                stream_ndjson_report(
+                    customer_id, customer_email, start_date, end_date, dedup_window
+                ),
+                media_type="application/x-ndjson",
+            )
+        if format == ReportFormats.JSON_STREAM:
+            return StreamingResponse(
+                stream_json_report(
+                    customer_id, customer_email, start_date, end_date, dedup_window
+                ),
+                media_type="application/json",
+            )
 
-            action_value = calculate_action_value(
-                action.lead_type, action.action_type, action.engagement_level
+        # Served from the stored report until actions land in its range.
+        snapshot = await find_report_snapshot(
+            db, customer_id, start_date, end_date, dedup_window, include_items
+        )
+        if snapshot is not None:
+            etag = f'"{snapshot.content_hash}"'
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            return snapshot_response(
+                request, etag, await read_report_snapshot(snapshot)
             )
-            lead_amount += action_value
-
-            total_billed_amount += lead_amount
-            report_items.append(
-                BillingReportItemSchema(
-                    id=str(uuid4()),
-                    lead_id=action.lead_id,
-                    product_id=action.product_id,
-                    customer_id=action.customer_id,
-                    lead_type=action.lead_type,
-                    total_billed_amount=total_billed_amount,
-                    customer_email=customer_email,
-                    associated_product=action.product.name if action.product else None,
-                    action_type=action.action_type,
-                    engagement_level=action.engagement_level,
-                    amount=action_value,
-                    duplicate=action.is_duplicate or False,
-                    status=action.status or "pending",
-                    actions=[
-                        {
-                            "action_type": action.action_type,
-                            "engagement_level": action.engagement_level,
-                            "value": calculate_action_value(
-                                action.lead_type,
-                                action.action_type,
-                                action.engagement_level,
-                            ),
-                        }
-                    ],
-                )
+        # read before computing, see save_report_snapshot
+        fingerprint = await report_fingerprint(db, customer_id, start_date, end_date)
+
+        report_items = None
+        if include_items:
+            # one read of the range gives both the items and their totals
+            totals, report_items = await billing_report_with_items(
+                db, customer_id, customer_email, start_date, end_date, dedup_window
             )
+            REPORT_ITEMS.labels(ReportFormats.JSON.value).observe(len(report_items))
+        else:
+            # Whole closed months never change; read them from the monthly
+            # rollups when their per-month dedup matches the requested window.
+            totals = None
+            months = closed_month_range(start_date, end_date)
+            if months and (
+                dedup_window == DedupWindows.MONTH or months[0] == months[1]
+            ):
+                totals = await rollup_billing_report(db, customer_id, *months)
+            if totals is None:
+                totals = await aggregate_billing_report(
+                    db, customer_id, start_date, end_date, dedup_window
+                )
 
-        # Calculate product subtotals
-        product_subtotals = defaultdict(float)
-        for item in report_items:
-            if item.associated_product:
-                product_subtotals[item.associated_product] += item.amount
+        if not totals["action_count"]:
+            raise HTTPException(
+                status_code=404,
+                detail="No actions found for the given customer and date range",
+            )
 
         billing_report = BillingReportSchema(
             id=str(uuid4()),
             customer_id=customer_id,
-            total_billed_amount=total_billed_amount,
+            total_billed_amount=totals["total_billed_amount"],
+            total_savings=totals["total_savings"],
             items=report_items,
-            product_subtotals=dict(product_subtotals),
+            product_subtotals=totals["product_subtotals"],
+        )
+        document = billing_report.model_dump_json().encode()
+        snapshot = await save_report_snapshot(
+            db,
+            billing_report.id,
+            customer_id,
+            start_date,
+            end_date,
+            dedup_window,
+            include_items,
+            totals,
+            fingerprint,
+            document,
         )
 
-        return billing_report
+        return Response(
+            content=document,
+            media_type="application/json",
+            headers={"ETag": f'"{snapshot.content_hash}"', "Vary": "Accept-Encoding"},
+        )
+
+    except HTTPException:
+        raise
 
     except SQLAlchemyError as e:
-        logging.error(f"Database query error: {str(e)}")
+        logger.error("Database query error: %s", e)
         raise HTTPException(status_code=500, detail="Database query error")
 
     except Exception as e:
-        logging.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail="Unexpected error")
 
-    report = dict()
-    # fetch customer record
-    # customer = (
-    #     db.query(models.Customers)
-    #     .filter(models.Customers.customer_id == customer_id)
-    #     .first()
-    # )
-    #  populate report with customer details
-    report["customer_id"] = customer.customer_id
-    report["customer_name"] = customer.name
-    report["customer_email"] = customer.email
-    # fetch customer actions
-    customer_actions = (
-        db.query(ActionModel).filter(ActionModel.customer_id == customer_id).all()
-    )
-    # populate report with empty actions list
-    report["actions"] = []  # all actions that have been processed
-    total_billed_amount = 0.0
-    billing_cap = 100.0
-    savings_amount = 0.0
-    product_id_actions_list_map = {}  # add all actions after checking if duped
-
-    # go through each action and...
-    for action in customer_actions:
-        # calculate + assign a value to cost_amount field
-        action.cost_amount = calculate_action_value(
-            action.lead_type, action.action_type
+
+@router.get("/billingReports/{report_id}/render")
+async def render_billing_report(
+    report_id: str,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    format: RenderFormats = Query(
+        RenderFormats.MARKDOWN, description="md, csv or html"
+    ),
+    subtotals: bool = Query(True, description="Include per product subtotals"),
+):
+    """A stored billing report's line items as a document, streamed row by row."""
+    try:
+        context = await report_render_context(db, report_id)
+        if context is None:
+            raise HTTPException(status_code=404, detail="Billing report not found")
+
+        filename = f"billing-report-{report_id}.{format.value}"
+        return StreamingResponse(
+            render_report(async_session, context, format.value, subtotals),
+            media_type=RENDERERS[format.value].media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
-        # if we've seen this product_id before, check for duplicates based on identical product_id, lead_type and action_type
-        if action.product_id in product_id_actions_list_map:
-            # if we have a duplicate:
-            if is_duplicate_action(
-                action, product_id_actions_list_map[action.product_id]
-            ):
-                # set duplicate fields to True
-                action = set_duplicate_fields(action, True)
-                # add cost_amount to savings_amount
-                savings_amount += action.cost_amount
-            else:
-                # else set duplicate field to False
-                action = set_duplicate_fields(action, False)
-                # add cost_amount to total_billed_amount
-                total_billed_amount += action.cost_amount
-
-            # add action to product_id_actions_list_map list
-            product_id_actions_list_map[action.product_id].append(action)
-        else:
-            # else set duplicate field to False
-            action = set_duplicate_fields(action, False)
-            # add cost_amount to total_billed_amount
-            total_billed_amount += action.cost_amount
-            # create list in product_id_actions_list_map with action
-            product_id_actions_list_map[action.product_id] = [action]
-
-        # add the action to the report
-        report["actions"].append(action)
-
-    # calculate totals by product + add to report
-    report["totals_by_product"] = BillingReportModel.totals_by_product(
-        calculate_totals_by_product(product_id_actions_list_map)
-    )
-    # add total amount with cap to report
-    if total_billed_amount > billing_cap:
-        report["total_billed_amount"] = billing_cap
-        savings_amount += total_billed_amount - billing_cap
-    else:
-        report["total_billed_amount"] = total_billed_amount
-    # add savings amount to report
-    report["savings_amount"] = savings_amount
-    # save the report to the database
-    db_report = BillingReportModel(**report)
-    db.add(db_report)
-    db.commit()
-    db.refresh(db_report)
-
-    return report.json()
+
+    except HTTPException:
+        raise
+
+    except SQLAlchemyError as e:
+        logger.error("Database query error: %s", e)
+        raise HTTPException(status_code=500, detail="Database query error")
+
+    except Exception as e:
+        logger.error("Unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail="Unexpected error")
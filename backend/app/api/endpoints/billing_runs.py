@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, Depends
+from typing import Annotated
+import logging
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app.core.database import get_async_session, async_session
+from app.models import BillingRun as BillingRunModel
+from app.schemas import (
+    BillingRunCreate,
+    BillingRun as BillingRunSchema,
+)
+from app.crud.billing_run_service import (
+    billing_run_progress,
+    create_billing_run,
+    get_billing_run_for_month,
+    retry_failed_customers,
+    start_billing_run,
+)
+from app.shared import BillingRunStatus
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+def month_already_billed(run: BillingRunModel) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=f"Month already billed by run {run.id}",
+        headers={"Location": f"/billingRuns/{run.id}"},
+    )
+
+
+@router.post("/billingRuns", response_model=BillingRunSchema, status_code=202)
+async def enqueue_billing_run(
+    run_data: BillingRunCreate,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+):
+    """Queue the month-end run of every customer and start billing in the background.
+
+    A month is billed by one run. Posting it again returns 409 while that run
+    is active or complete; a run that finished with failed customers is
+    resumed for those customers only, and only with the run's own
+    ``incremental``. An incremental run bills only actions not on a report
+    yet, late ones of earlier months included.
+    """
+    try:
+        run = await get_billing_run_for_month(db, run_data.month)
+        if run is not None and run.status != BillingRunStatus.FAILED:
+            raise month_already_billed(run)
+        if run is None:
+            try:
+                run = await create_billing_run(
+                    db, run_data.month, run_data.incremental
+                )
+            except IntegrityError:
+                await db.rollback()
+                run = await get_billing_run_for_month(db, run_data.month)
+                if run is None:
+                    raise
+                # a concurrent request created the month's run first
+                raise month_already_billed(run)
+        elif run.incremental != run_data.incremental:
+            raise HTTPException(
+                status_code=409,
+                detail=(
+                    f"Run {run.id} has incremental={run.incremental}; "
+                    "resume it with the same"
+                ),
+                headers={"Location": f"/billingRuns/{run.id}"},
+            )
+        else:
+            run = await retry_failed_customers(db, run)
+
+        start_billing_run(async_session, run.id)
+        return await billing_run_progress(db, run)
+
+    except HTTPException:
+        raise
+
+    except SQLAlchemyError as e:
+        logger.error("Database error while queueing billing run: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+
+
+@router.get("/billingRuns/{run_id}", response_model=BillingRunSchema)
+async def get_billing_run(
+    run_id: str, db: Annotated[AsyncSession, Depends(get_async_session)]
+):
+    try:
+        run = await db.get(BillingRunModel, run_id)
+        if run is None:
+            raise HTTPException(status_code=404, detail="Billing run not found")
+        return await billing_run_progress(db, run)
+
+    except HTTPException:
+        raise
+
+    except SQLAlchemyError as e:
+        logger.error("Database query error: %s", e)
+        raise HTTPException(status_code=500, detail="Database query error")
@@ -1,13 +1,15 @@
 from http.client import HTTPResponse
+from enum import Enum
 from typing import List, Optional, Union, Annotated
-from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
-from app.core.database import get_async_session
+from app.core.database import get_async_session, async_session
 from app.models import (
     Lead as LeadModel,
     Customer as CustomerModel,
@@ -17,58 +19,124 @@ from app.schemas import (
     CustomerCreate,
     Customer as CustomerSchema,
     LeadCreate,
+    LeadIngestResult,
+    LeadsQueued,
     Lead as LeadSchema,
+    LeadPage,
     ProductCreate,
     Product as ProductSchema,
     ActionCreate,
     Action as ActionSchema,
 )
-from app.crud import calculate_action_value
 from app.crud.leads_service import (
+    LEADS_PAGE_SIZE,
+    MAX_LEADS_PAGE_SIZE,
+    decode_lead_cursor,
+    get_leads_from_db,
     save_lead_in_database,
     save_action_in_database,
+    bulk_save_leads,
 )
+from app.core.ingestion_buffer import BufferFull
+from app.crud.ingestion_key_service import IdempotencyKeyReused
+from app.crud.lead_buffer_service import lead_buffer
+from app.crud.reference_data_service import invalidate_customers, invalidate_products
 from app.shared import LeadTypes, LEAD_ACTION_COSTS
-from app.shared.utils import to_dict
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-@router.get("/leads", response_model=List[LeadSchema])
+class LeadIncludes(str, Enum):
+    ACTIONS = "actions"
+
+
+class LeadFormats(str, Enum):
+    JSON = "json"
+    JSON_STREAM = "json-stream"
+
+
+_leads_adapter = TypeAdapter(List[LeadSchema])
+
+
+async def stream_leads_json(
+    customer_id: Optional[str],
+    product_id: Optional[str],
+    lead_type: Optional[LeadTypes],
+    cursor: Optional[str],
+    include_actions: bool,
+):
+    """A LeadPage document of every matching lead, written out page by page."""
+    yield '{"items": ['
+    separator = ""
+    # The request session is closed once the endpoint returns, so the export
+    # gets a session of its own that lives as long as the response body.
+    async with async_session() as session:
+        while True:
+            leads, cursor = await get_leads_from_db(
+                session,
+                customer_id,
+                product_id,
+                lead_type,
+                cursor,
+                MAX_LEADS_PAGE_SIZE,
+                include_actions,
+            )
+            if leads:
+                yield separator + _leads_adapter.dump_json(leads)[1:-1].decode()
+                separator = ", "
+            if cursor is None:
+                break
+    yield '], "next_cursor": null}'
+
+
+@router.get("/leads", response_model=LeadPage)
 async def get_leads(
     db: Annotated[AsyncSession, Depends(get_async_session)],
     customer_id: Optional[str] = Query(None, description="Filter by customer ID"),
     product_id: Optional[str] = Query(None, description="Filter by product ID"),
     lead_type: Optional[LeadTypes] = Query(None, description="Filter by lead type"),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page"
+    ),
+    limit: int = Query(
+        LEADS_PAGE_SIZE, ge=1, le=MAX_LEADS_PAGE_SIZE, description="Leads per page"
+    ),
+    include: Optional[LeadIncludes] = Query(
+        None, description="actions, to nest each lead's actions"
+    ),
+    format: LeadFormats = Query(
+        LeadFormats.JSON,
+        description="json for one page, json-stream to export every page",
+    ),
 ):
-    try:
-        query = select(LeadModel).options(
-            selectinload(LeadModel.customer),
-            selectinload(LeadModel.product),
-            selectinload(LeadModel.actions),
-        )
-
-        if customer_id:
-            query = query.where(LeadModel.customer_id == customer_id)
-        if product_id:
-            query = query.where(LeadModel.product_id == product_id)
-        if lead_type:
-            query = query.where(LeadModel.lead_type == lead_type)
+    include_actions = include == LeadIncludes.ACTIONS
+    if cursor:
+        try:
+            decode_lead_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        logger.info(f"~~**~~ GET /leads querying database... QUERY: {query}")
-        result = await db.execute(query)
-        leads = result.scalars().all()
-        logger.info(f"~~**~~ GET /leads finished querying db. RESULT: {leads}")
+    try:
+        if format == LeadFormats.JSON_STREAM:
+            return StreamingResponse(
+                stream_leads_json(
+                    customer_id, product_id, lead_type, cursor, include_actions
+                ),
+                media_type="application/json",
+            )
 
-        return leads
+        leads, next_cursor = await get_leads_from_db(
+            db, customer_id, product_id, lead_type, cursor, limit, include_actions
+        )
+        return LeadPage(items=leads, next_cursor=next_cursor)
 
     except SQLAlchemyError as e:
-        logger.error(f"Database query error: {str(e)}")
+        logger.error("Database query error: %s", e)
         raise HTTPException(status_code=500, detail="Database query error")
 
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail="Unexpected error")
 
 
@@ -77,21 +145,13 @@ async def get_one_lead(
     lead_id: str, db: Annotated[AsyncSession, Depends(get_async_session)]
 ):
     try:
-        logger.info(f"~~**~~ GET /leads/{lead_id} querying database...")
         query = (
             select(LeadModel)
-            .options(
-                selectinload(LeadModel.customer),
-                selectinload(LeadModel.product),
-                selectinload(LeadModel.actions),
-            )
+            .options(selectinload(LeadModel.actions))
             .where(LeadModel.id == lead_id)
         )
         result = await db.execute(query)
-        lead_db = result.scalar_one()
-        logger.info(
-            f"~~**~~ GET /leads/{lead_id} finished querying db. RESULT: {lead_db}"
-        )
+        lead_db = result.scalar_one_or_none()
 
         if lead_db is None:
             raise HTTPException(
@@ -100,37 +160,49 @@ async def get_one_lead(
                 headers={"X-Error": "Not-Found"},
             )
 
-        lead_dict = to_dict(lead_db)
-        logger.info(f"~~**~~ Lead object: {lead_dict}")
-
         return LeadSchema.from_orm(lead_db)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail="Unexpected error")
 
 
-@router.post("/leads/", status_code=201)
+@router.post("/leads/", response_model=List[LeadIngestResult], status_code=201)
 async def create_lead(
     leads_list: List[LeadCreate],
     db: Annotated[AsyncSession, Depends(get_async_session)],
+    idempotency_key: Optional[str] = Header(
+        None, max_length=255, description="Retries with the same key ingest once"
+    ),
 ):
-    for lead_data in leads_list:
-        save_lead_in_database(lead_data, db)
-
-        lead_actions: List[ActionCreate] = lead_data.actions
-
-        for action_data in lead_actions:
-            # NOTE: db_action = Action(**action.dict())
-            calculated_lead_action_value = calculate_action_value(
-                lead_type=lead_data.lead_type,
-                action_type=action_data.action_type,
-                engagement_level=action_data.engagement_level,
-            )
-            action_data.cost_amount = calculated_lead_action_value
-
-            save_action_in_database(action_data, db)
-
-    return HTTPResponse(201)
+    try:
+        return await bulk_save_leads(leads_list, db, idempotency_key)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RuntimeError as e:
+        logger.error("Database error while ingesting leads: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+
+
+@router.post("/leads/async", response_model=LeadsQueued, status_code=202)
+async def queue_leads(leads_list: List[LeadCreate]):
+    """Accept leads for the next micro-batch without waiting for the write.
+
+    Leads are validated against customers and products when written, and
+    rejections are logged rather than returned; see
+    app.crud.lead_buffer_service.
+    """
+    try:
+        await lead_buffer.submit([lead.model_dump(mode="json") for lead in leads_list])
+        return LeadsQueued(queued=len(leads_list))
+    except BufferFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
+    except OSError as e:
+        logger.error("Could not spill buffered leads: %s", e)
+        raise HTTPException(status_code=500, detail="Could not queue leads")
 
 
 @router.post("/customers/", response_model=CustomerSchema, status_code=201)
@@ -142,6 +214,7 @@ async def create_customer(
     db.add(db_customer)
     await db.commit()
     await db.refresh(db_customer)
+    await invalidate_customers([db_customer.id])
     return db_customer
 
 
@@ -153,4 +226,5 @@ async def create_product(
     db.add(db_product)
     await db.commit()
     await db.refresh(db_product)
+    await invalidate_products([db_product.id])
     return db_product
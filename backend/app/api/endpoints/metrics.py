@@ -0,0 +1,35 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.core.database import async_engine
+from app.core.instrumentation import render_metrics
+from app.core.pool_metrics import pool_status
+from app.core.reference_cache import reference_cache
+from app.crud.lead_buffer_service import lead_buffer
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def read_metrics():
+    """All metrics in Prometheus text format, aggregated over workers."""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@router.get("/metrics/pool")
+async def read_pool_metrics():
+    """Connection pool figures of the worker process serving the request."""
+    return {"pool": pool_status(async_engine.pool)}
+
+
+@router.get("/metrics/reference-cache")
+async def read_reference_cache_metrics():
+    """Customer and product cache hits and misses of the serving worker."""
+    return {"reference_cache": reference_cache.stats()}
+
+
+@router.get("/metrics/ingest-buffer")
+async def read_ingest_buffer_metrics():
+    """Queue depth and flushes of the serving worker's lead buffer."""
+    return {"ingest_buffer": lead_buffer.stats()}
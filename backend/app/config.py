@@ -1,10 +1,50 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 
 
 class Settings(BaseSettings):
     DATABASE_URL: str
     ENVIRONMENT: str = "development"
     DOMAIN: str = "localhost"
+    # Per worker process; see app.core.pool_metrics for sizing.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds; reconnect before idle timeouts do
+    DB_POOL_PRE_PING: bool = True
+    DB_ECHO: bool = False  # log every statement; debugging only
+    # where rendered billing reports are stored: "local" or "s3"
+    REPORT_STORAGE: str = "local"
+    REPORT_STORAGE_PATH: str = "reports"
+    REPORT_S3_BUCKET: str = "billing-reports"
+    AWS_ENDPOINT_URL: Optional[str] = None  # e.g. LocalStack
+    # customer and product lookups; see app.core.reference_cache
+    REFERENCE_CACHE_TTL: float = 300  # seconds
+    REFERENCE_CACHE_SIZE: int = 10_000  # entries per worker
+    REFERENCE_CACHE_URL: Optional[str] = None  # e.g. redis://localhost:6379/0
+    # how long POST /leads/ remembers requests and leads it has ingested;
+    # see app.crud.ingestion_key_service
+    IDEMPOTENCY_KEY_TTL: int = 24 * 3600  # seconds
+    # POST /leads/async; see app.core.ingestion_buffer
+    INGEST_BUFFER_PATH: str = "ingest-buffer"  # spill root; a directory per worker
+    INGEST_BATCH_ROWS: int = 5000  # leads and actions per micro-batch
+    INGEST_BATCH_DELAY: float = 0.2  # seconds the oldest lead waits at most
+    INGEST_BUFFER_MAX_ROWS: int = 100_000  # per worker; beyond it, 503
+    INGEST_BUFFER_FSYNC: bool = True  # fsync the spill file before each 202
+    # python -m app.worker; see app.crud.lead_event_service
+    LEAD_EVENTS_QUEUE_URL: Optional[str] = None
+    LEAD_EVENTS_DEAD_LETTER_URL: Optional[str] = None
+    LEAD_EVENTS_CONCURRENCY: int = 4  # batches written at once
+    LEAD_EVENTS_BATCH_SIZE: int = 100  # messages per batch
+    LEAD_EVENTS_WAIT_SECONDS: int = 20  # long poll; at most 20
+    LEAD_EVENTS_VISIBILITY_TIMEOUT: int = 30  # seconds; extended while writing
+    LEAD_EVENTS_MAX_RECEIVES: int = 5  # deliveries before dead-lettering
+    # see app.core.log_config
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # "json" or "text"
+    LOG_SAMPLE_RATE: float = 1.0  # share of DEBUG and INFO records kept
+    # path prefix -> level, e.g. {"/leads": "WARNING"}; longest prefix wins
+    LOG_ROUTE_LEVELS: dict[str, str] = {}
 
     class Config:
         env_file = ".env"
@@ -9,12 +9,24 @@ from alembic import command
 from faker import Faker
 
 from app.config import settings
+from app.core.instrumentation import instrument_engine
+from app.core.pool_metrics import MeasuredQueuePool
 import logging
 
 from app.models import ModelBase, Customer, Product, Lead, Action
 from app.shared import LeadTypes, ActionTypes, EngagementLevelTypes
 
-async_engine = create_async_engine(settings.DATABASE_URL, echo=True)
+async_engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    poolclass=MeasuredQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+instrument_engine(async_engine)
 async_session: AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
 
 
@@ -30,7 +42,7 @@ async def check_database_status():
             await conn.run_sync(ModelBase.metadata.create_all)
         logging.info("~~**~~ Database is up and running.")
     except SQLAlchemyError as e:
-        logging.error(f"Database connection error: {str(e)}")
+        logging.error("Database connection error: %s", e)
         raise HTTPException(status_code=500, detail="Database connection error")
 
 
@@ -117,9 +129,11 @@ async def seed_database():
                         await session.commit()
 
                 logging.info("~~**~~ Database seeded successfully.")
+                return True
             except SQLAlchemyError as e:
-                logging.error(f"Error seeding database: {str(e)}")
+                logging.error("Error seeding database: %s", e)
                 await session.rollback()
                 raise HTTPException(status_code=500, detail="Error seeding database")
         else:
             logging.info("~~**~~ Database already seeded.")
+        return False
@@ -0,0 +1,287 @@
+"""Write-ahead buffer coalescing small ingestion requests into large batches.
+
+``IngestionBuffer.submit`` appends a request's records to a spill log on
+local disk, queues them in memory and returns. A background task hands
+everything queued to one ``flush`` call once ``max_rows`` rows are waiting
+or the oldest has waited ``max_delay`` seconds; a flush that fails is
+retried with the same records.
+
+The spill log is a directory of append-only segment files, one JSON line
+per submitted request. A flush closes the segment being written and deletes
+the segments it covered once ``flush`` returns, so what is left on disk was
+accepted but not yet flushed, and ``start`` queues it again. Each worker
+process claims a ``worker-<n>`` directory under the spill root with an
+exclusive lock, so a restarted worker picks up what the one it replaces
+left behind. A record may thus be flushed twice after a crash; ``flush``
+has to be idempotent.
+"""
+
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import time
+from typing import IO, Awaitable, Callable, Iterator, Optional
+
+from app.core.instrumentation import (
+    INGEST_BUFFER_ROWS,
+    INGEST_FLUSH_ROWS,
+    INGEST_FLUSH_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class BufferFull(Exception):
+    """More rows are waiting to be flushed than the buffer holds."""
+
+
+def claim_spill_directory(root: str) -> tuple[str, IO]:
+    """The first ``worker-<n>`` directory under ``root`` that no process holds.
+
+    Returns it with its lock file, which holds the claim until closed.
+    """
+    for number in itertools.count():
+        path = os.path.join(root, f"worker-{number}")
+        os.makedirs(path, exist_ok=True)
+        lock = open(os.path.join(path, "lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        return path, lock
+
+
+class SpillLog:
+    """Numbered append-only segment files of JSON lines in one directory."""
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._file: Optional[IO] = None
+        self._segment: Optional[str] = None
+        segments = self.segments()
+        self._next_number = self._number(segments[-1]) + 1 if segments else 0
+
+    @staticmethod
+    def _number(segment: str) -> int:
+        name = os.path.basename(segment)
+        return int(name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+
+    def segments(self) -> list[str]:
+        return sorted(
+            (
+                os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+            ),
+            key=self._number,
+        )
+
+    def read(self, segment: str) -> Iterator[list]:
+        with open(segment) as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a segment being written at a crash
+                    logger.warning("Skipping a torn line in %s", segment)
+
+    def append(self, records: list) -> str:
+        """Write one line and return the segment it went to."""
+        if self._file is None:
+            self._segment = os.path.join(
+                self.path, f"{SEGMENT_PREFIX}{self._next_number:012d}{SEGMENT_SUFFIX}"
+            )
+            self._next_number += 1
+            self._file = open(self._segment, "a")
+        self._file.write(json.dumps(records) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        return self._segment
+
+    def rotate(self):
+        """Close the segment being written; the next append starts another."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self, segments: list[str]):
+        for segment in segments:
+            os.remove(segment)
+
+
+class IngestionBuffer:
+    """Records queued for ``flush`` in batches of about ``max_rows`` rows.
+
+    ``rows`` tells how many rows a record counts for; ``submit`` raises
+    ``BufferFull`` rather than queue beyond ``max_pending_rows``.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[list], Awaitable],
+        spill_root: str,
+        max_rows: int = 5000,
+        max_delay: float = 0.2,
+        max_pending_rows: int = 100_000,
+        rows: Callable[[object], int] = lambda record: 1,
+        fsync: bool = True,
+        retry_delay: float = 1.0,
+    ):
+        self.flush = flush
+        self.spill_root = spill_root
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending_rows = max_pending_rows
+        self.rows = rows
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self.spill: Optional[SpillLog] = None
+        self._lock_file: Optional[IO] = None
+        self._spill_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._queued = asyncio.Event()
+        self._full = asyncio.Event()
+        self._reset_pending()
+        self._flushing_rows = 0
+        self.flushes = 0
+        self.last_flush_seconds: Optional[float] = None
+
+    def _reset_pending(self):
+        self._pending: list = []
+        self._pending_segments: list[str] = []
+        self._pending_rows = 0
+        self._oldest: Optional[float] = None
+
+    @property
+    def depth(self) -> int:
+        """Rows accepted and not yet flushed, including a flush under way."""
+        return self._pending_rows + self._flushing_rows
+
+    def _queue(self, records: list, segment: str, rows: int):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._pending.extend(records)
+        if segment not in self._pending_segments:
+            self._pending_segments.append(segment)
+        self._pending_rows += rows
+        INGEST_BUFFER_ROWS.set(self.depth)
+        self._queued.set()
+        if self._pending_rows >= self.max_rows:
+            self._full.set()
+
+    async def start(self):
+        """Claim a spill directory, queue what it holds, and start flushing."""
+        os.makedirs(self.spill_root, exist_ok=True)
+        path, self._lock_file = claim_spill_directory(self.spill_root)
+        self.spill = SpillLog(path, self.fsync)
+        recovered = 0
+        for segment in self.spill.segments():
+            for records in self.spill.read(segment):
+                self._queue(records, segment, sum(map(self.rows, records)))
+                recovered += len(records)
+        if recovered:
+            logger.info(
+                "Ingestion buffer recovered %s records from %s", recovered, path
+            )
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush what is queued, then release the spill directory.
+
+        Records a last failed flush leaves behind stay in the spill log.
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        self._queued.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        self.spill.rotate()
+        self._lock_file.close()
+
+    async def submit(self, records: list):
+        """Make ``records`` durable in the spill log and queue them."""
+        rows = sum(map(self.rows, records))
+        if self.depth + rows > self.max_pending_rows:
+            raise BufferFull(f"{self.depth} rows are waiting to be ingested")
+        async with self._spill_lock:
+            segment = await asyncio.to_thread(self.spill.append, records)
+            self._queue(records, segment, rows)
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                self._queued.clear()
+                await self._queued.wait()
+                continue
+            if not self._closing and self._pending_rows < self.max_rows:
+                delay = self._oldest + self.max_delay - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            if not await self._flush_pending():
+                if self._closing:
+                    return
+                await asyncio.sleep(self.retry_delay)
+
+    async def _flush_pending(self) -> bool:
+        async with self._spill_lock:
+            records, segments = self._pending, self._pending_segments
+            rows, oldest = self._pending_rows, self._oldest
+            self._reset_pending()
+            self._full.clear()
+            self._flushing_rows = rows
+            # later submits go to a segment of their own
+            self.spill.rotate()
+
+        started = time.perf_counter()
+        try:
+            await self.flush(records)
+        except Exception as e:
+            logger.error(
+                "Ingestion buffer flush of %s records failed: %s", len(records), e
+            )
+            # back in front of anything submitted since
+            self._pending = records + self._pending
+            self._pending_segments = segments + self._pending_segments
+            self._pending_rows += rows
+            self._oldest = oldest
+            return False
+        finally:
+            self._flushing_rows = 0
+            INGEST_BUFFER_ROWS.set(self.depth)
+
+        self.last_flush_seconds = time.perf_counter() - started
+        self.flushes += 1
+        INGEST_FLUSH_SECONDS.observe(self.last_flush_seconds)
+        INGEST_FLUSH_ROWS.observe(rows)
+        await asyncio.to_thread(self.spill.remove, segments)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "rows": self.depth,
+            "records": len(self._pending),
+            "oldest_seconds": (
+                time.monotonic() - self._oldest if self._oldest is not None else None
+            ),
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "spill_directory": self.spill.path if self.spill else None,
+        }
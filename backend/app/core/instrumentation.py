@@ -0,0 +1,226 @@
+"""Prometheus instrumentation of requests, queries and the billing engine.
+
+``MetricsMiddleware`` times every request by route template and, through a
+context variable, collects the database queries the request ran. The
+billing engine wraps its stages in ``span`` and counts what it prices.
+
+Under gunicorn each worker has its own metrics; with
+``PROMETHEUS_MULTIPROC_DIR`` set (see ``gunicorn.conf.py``) workers write
+them to files there and ``GET /metrics`` aggregates all of them, whichever
+worker serves the scrape.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# Request and report latencies range from milliseconds to minutes.
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120
+)  # fmt: skip
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency, until the last body chunk is sent.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries run by one request.",
+    ["route"],
+    buckets=COUNT_BUCKETS,
+)
+REQUEST_QUERY_SECONDS = Histogram(
+    "http_request_db_query_seconds",
+    "Time one request spent in database queries.",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+SPAN_SECONDS = Histogram(
+    "billing_engine_span_seconds",
+    "Duration of billing engine stages.",
+    ["span"],
+    buckets=LATENCY_BUCKETS,
+)
+ACTIONS_PRICED = Counter(
+    "billing_actions_priced",
+    "Actions priced by the billing engine; rate() gives actions per second.",
+    ["engine"],
+)
+REPORT_ITEMS = Histogram(
+    "billing_report_items",
+    "Line items per billing report.",
+    ["format"],
+    buckets=COUNT_BUCKETS,
+)
+REFERENCE_CACHE_LOOKUPS = Counter(
+    "reference_cache_lookups",
+    "Customer and product lookups by id, by cache result.",
+    ["namespace", "result"],
+)
+INGESTION_REPLAYS = Counter(
+    "ingestion_replays",
+    "POST /leads/ requests and leads turned away as already ingested.",
+    ["kind"],
+)
+INGEST_BUFFER_ROWS = Gauge(
+    "ingest_buffer_rows",
+    "Rows accepted by POST /leads/async and not yet written.",
+    multiprocess_mode="livesum",
+)
+INGEST_FLUSH_SECONDS = Histogram(
+    "ingest_buffer_flush_seconds",
+    "Time to write one micro-batch of buffered rows.",
+    buckets=LATENCY_BUCKETS,
+)
+INGEST_FLUSH_ROWS = Histogram(
+    "ingest_buffer_flush_rows",
+    "Rows per micro-batch of buffered rows.",
+    buckets=COUNT_BUCKETS,
+)
+LEAD_EVENTS = Counter(
+    "lead_events",
+    "Lead and action events consumed from the queue, by outcome.",
+    ["result"],
+)
+LEAD_EVENT_BATCH_SECONDS = Histogram(
+    "lead_event_batch_seconds",
+    "Time to write and settle one batch of lead events.",
+    buckets=LATENCY_BUCKETS,
+)
+# Pool state is per worker; in multiprocess mode each keeps a pid label.
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections checked out.", multiprocess_mode="all"
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Connections open beyond the pool size; negative until it is filled.",
+    multiprocess_mode="all",
+)
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time from asking the pool for a connection to getting one.",
+    buckets=LATENCY_BUCKETS,
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts", "Checkouts that gave up after DB_POOL_TIMEOUT."
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+@contextmanager
+def span(name: str):
+    """Time a billing engine stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def count_priced(engine: str, actions: int):
+    ACTIONS_PRICED.labels(engine).inc(actions)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    started = conn.info["query_started"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Attribute the queries of an (async) engine to the current request."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route_label(scope) -> str:
+    # the route template, so path parameters do not explode the label set
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and database use per route."""
+
+    def __init__(self, app, engine=None):
+        self.app = app
+        self.engine = engine
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            route = _route_label(scope)
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(
+                elapsed
+            )
+            REQUEST_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_QUERY_SECONDS.labels(route).observe(stats.query_seconds)
+            if self.engine is not None:
+                POOL_CHECKED_OUT.set(self.engine.pool.checkedout())
+                POOL_OVERFLOW.set(self.engine.pool.overflow())
+
+
+def metrics_registry():
+    """The registry to expose: every worker's metrics in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus text exposition of all metrics, and its content type."""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
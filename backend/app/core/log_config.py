@@ -0,0 +1,167 @@
+"""Structured, sampled, non-blocking logging.
+
+Records go through a ``QueueHandler`` to a ``QueueListener`` thread that
+encodes them as JSON lines and writes them out, so a slow stderr or disk
+never stalls the event loop. Before anything is queued, records are
+filtered by level, ``LOG_LEVEL`` or the level ``LOG_ROUTE_LEVELS`` sets for
+the request's path, and sampled: only ``LOG_SAMPLE_RATE`` of the DEBUG and
+INFO records that pass are kept. Warnings and errors are never sampled.
+Use ``%``-style arguments (``logger.info("run %s", run_id)``): the message
+is only formatted for records that pass the filters.
+"""
+
+import copy
+import json
+import logging
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.config import settings
+
+# Attributes every LogRecord has; anything else came in through ``extra``.
+_RECORD_ATTRIBUTES = set(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None))
+) | {"message", "asctime"}
+
+_request_context: ContextVar[Optional[dict]] = ContextVar(
+    "log_request_context", default=None
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with ``extra`` fields and request context."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Apply the route's log level and sampling; tag records with the request."""
+
+    def __init__(self, level: int = logging.NOTSET, sample_rate: float = 1.0):
+        super().__init__()
+        self.level = level
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        level = self.level if context is None else context["level"]
+        if record.levelno < level:
+            return False
+        if context is not None:
+            record.method = context["method"]
+            record.path = context["path"]
+        if record.levelno < logging.WARNING and self.sample_rate < 1.0:
+            return random.random() < self.sample_rate
+        return True
+
+
+class _PreparingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, while they still hold their current values,
+        # but leave the JSON encoding to the listener thread. Unlike the base
+        # class, keep the message free of the traceback.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def level_number(level) -> int:
+    return level if isinstance(level, int) else logging.getLevelName(level.upper())
+
+
+def route_log_level(path: str, route_levels: dict, default: int) -> int:
+    """Level of the longest ``route_levels`` prefix of ``path``, or ``default``."""
+    matches = [prefix for prefix in route_levels if path.startswith(prefix)]
+    if not matches:
+        return default
+    return level_number(route_levels[max(matches, key=len)])
+
+
+class LogContextMiddleware:
+    """ASGI middleware setting the log level and context of each request."""
+
+    def __init__(self, app, route_levels: dict = None, default_level=None):
+        self.app = app
+        self.route_levels = (
+            settings.LOG_ROUTE_LEVELS if route_levels is None else route_levels
+        )
+        self.default_level = level_number(default_level or settings.LOG_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_context.set(
+            {
+                "level": route_log_level(
+                    scope["path"], self.route_levels, self.default_level
+                ),
+                "method": scope["method"],
+                "path": scope["path"],
+            }
+        )
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_context.reset(token)
+
+
+def configure_logging(
+    level=None,
+    json_format: bool = None,
+    sample_rate: float = None,
+    route_levels: dict = None,
+) -> QueueListener:
+    """Route all logging through a queue; returns the started listener.
+
+    Call ``listener.stop()`` at shutdown to flush the queue.
+    """
+    level = level_number(level or settings.LOG_LEVEL)
+    if route_levels is None:
+        route_levels = settings.LOG_ROUTE_LEVELS
+    if json_format is None:
+        json_format = settings.LOG_FORMAT == "json"
+    if sample_rate is None:
+        sample_rate = settings.LOG_SAMPLE_RATE
+
+    output = logging.StreamHandler()
+    output.setFormatter(
+        JsonFormatter()
+        if json_format
+        else logging.Formatter("%(levelname)s:%(name)s:%(message)s")
+    )
+    log_queue = queue.SimpleQueue()
+    handler = _PreparingQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter(level, sample_rate))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    # the filter applies the levels; the root only has to let the lowest through
+    root.setLevel(
+        min([level, *(level_number(value) for value in route_levels.values())])
+    )
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,205 @@
+"""SQS-compatible message queues.
+
+``SqsQueue`` talks to SQS, or to LocalStack with ``AWS_ENDPOINT_URL`` set,
+through boto3 in worker threads. ``MemoryQueue`` keeps messages in process
+with the same receive, visibility and receive-count behaviour, as a stand-in
+for tests and local runs.
+
+Both implement ``receive`` (long polling), ``delete``, ``extend`` (change the
+visibility timeout of received messages) and ``dead_letter``.
+"""
+
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from itertools import count
+from typing import NamedTuple, Optional
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# the most messages SQS receives, deletes or changes in one call
+SQS_BATCH_LIMIT = 10
+
+
+class Message(NamedTuple):
+    id: str
+    receipt_handle: str
+    body: str
+    # deliveries so far, this one included
+    receive_count: int
+
+
+@lru_cache
+def _sqs_client(endpoint_url: str = None):
+    import boto3
+
+    return boto3.client("sqs", endpoint_url=endpoint_url)
+
+
+def _chunks(items: list, size: int = SQS_BATCH_LIMIT):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class SqsQueue:
+    def __init__(
+        self,
+        url: str,
+        endpoint_url: Optional[str] = None,
+        dead_letter_url: Optional[str] = None,
+    ):
+        self.url = url
+        self.endpoint_url = endpoint_url
+        self.dead_letter_url = dead_letter_url
+
+    @property
+    def client(self):
+        return _sqs_client(self.endpoint_url)
+
+    async def send(self, body: str) -> str:
+        response = await asyncio.to_thread(
+            self.client.send_message, QueueUrl=self.url, MessageBody=body
+        )
+        return response["MessageId"]
+
+    async def receive(
+        self, max_messages: int, wait_seconds: float, visibility_timeout: int
+    ) -> list[Message]:
+        response = await asyncio.to_thread(
+            self.client.receive_message,
+            QueueUrl=self.url,
+            MaxNumberOfMessages=min(max_messages, SQS_BATCH_LIMIT),
+            WaitTimeSeconds=int(wait_seconds),
+            VisibilityTimeout=visibility_timeout,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        return [
+            Message(
+                message["MessageId"],
+                message["ReceiptHandle"],
+                message["Body"],
+                int(message["Attributes"]["ApproximateReceiveCount"]),
+            )
+            for message in response.get("Messages", [])
+        ]
+
+    async def _batch(self, operation, messages: list[Message], **fields):
+        for chunk in _chunks(messages):
+            response = await asyncio.to_thread(
+                operation,
+                QueueUrl=self.url,
+                Entries=[
+                    {"Id": str(position), "ReceiptHandle": message.receipt_handle}
+                    | fields
+                    for position, message in enumerate(chunk)
+                ],
+            )
+            for failure in response.get("Failed", []):
+                logger.warning(
+                    "SQS %s failed for a message: %s",
+                    operation.__name__,
+                    failure.get("Message"),
+                )
+
+    async def delete(self, messages: list[Message]):
+        await self._batch(self.client.delete_message_batch, messages)
+
+    async def extend(self, messages: list[Message], visibility_timeout: int):
+        await self._batch(
+            self.client.change_message_visibility_batch,
+            messages,
+            VisibilityTimeout=visibility_timeout,
+        )
+
+    async def dead_letter(self, messages: list[Message], reasons: list[str]):
+        """Move messages to the dead-letter queue with why, as an attribute.
+
+        Without one configured they are left to the queue's redrive policy.
+        """
+        if not self.dead_letter_url:
+            logger.error(
+                "No dead-letter queue; leaving %s messages to the redrive policy",
+                len(messages),
+            )
+            return
+        entries = [
+            {
+                "Id": str(position),
+                "MessageBody": message.body,
+                "MessageAttributes": {
+                    "reason": {"DataType": "String", "StringValue": reason[:1024]}
+                },
+            }
+            for position, (message, reason) in enumerate(zip(messages, reasons))
+        ]
+        for chunk in _chunks(entries):
+            await asyncio.to_thread(
+                self.client.send_message_batch,
+                QueueUrl=self.dead_letter_url,
+                Entries=chunk,
+            )
+        await self.delete(messages)
+
+
+class MemoryQueue:
+    """In-process stand-in for an SQS queue and its dead-letter queue."""
+
+    # how often a waiting receive looks again
+    POLL_SECONDS = 0.01
+
+    def __init__(self):
+        # id -> [body, visible at, receive count, current receipt handle]
+        self._messages: dict[str, list] = {}
+        self._ids = count()
+        self.dead_letters: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    async def send(self, body: str) -> str:
+        message_id = f"message-{next(self._ids)}"
+        self._messages[message_id] = [body, 0.0, 0, None]
+        return message_id
+
+    async def receive(
+        self, max_messages: int, wait_seconds: float, visibility_timeout: int
+    ) -> list[Message]:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            now = time.monotonic()
+            received = []
+            for message_id, state in self._messages.items():
+                if len(received) == min(max_messages, SQS_BATCH_LIMIT):
+                    break
+                if state[1] > now:
+                    continue
+                state[1] = now + visibility_timeout
+                state[2] += 1
+                state[3] = uuid4().hex
+                received.append(Message(message_id, state[3], state[0], state[2]))
+            if received or now >= deadline:
+                return received
+            await asyncio.sleep(min(self.POLL_SECONDS, deadline - now))
+
+    def _current(self, messages: list[Message]):
+        # the receipt handle of an earlier delivery no longer applies
+        for message in messages:
+            state = self._messages.get(message.id)
+            if state is not None and state[3] == message.receipt_handle:
+                yield message.id, state
+
+    async def delete(self, messages: list[Message]):
+        for message_id, _ in list(self._current(messages)):
+            del self._messages[message_id]
+
+    async def extend(self, messages: list[Message], visibility_timeout: int):
+        for _, state in self._current(messages):
+            state[1] = time.monotonic() + visibility_timeout
+
+    async def dead_letter(self, messages: list[Message], reasons: list[str]):
+        reasons = {message.id: reason for message, reason in zip(messages, reasons)}
+        for message_id, state in list(self._current(messages)):
+            self.dead_letters.append((state[0], reasons[message_id]))
+            del self._messages[message_id]
@@ -0,0 +1,95 @@
+"""Connection pool instrumentation.
+
+Every gunicorn worker has its own engine and pool, so these figures are per
+process; ``GET /metrics/pool`` reports them with the worker's pid, and
+``GET /metrics`` exports them for Prometheus. The total a
+deployment can open is ``workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)``, which
+has to stay under the database's ``max_connections``.
+"""
+
+import os
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.instrumentation import POOL_TIMEOUTS, POOL_WAIT_SECONDS
+
+
+class PoolMetrics:
+    """Cumulative checkout counts and wait times of one pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.overflow_max = 0
+
+    def observe_checkout(self, wait_seconds: float, overflow: int):
+        self.checkouts += 1
+        self.wait_seconds_total += wait_seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+        self.overflow_max = max(self.overflow_max, overflow)
+        POOL_WAIT_SECONDS.observe(wait_seconds)
+
+    def observe_timeout(self):
+        self.timeouts += 1
+        POOL_TIMEOUTS.inc()
+
+
+class MeasuredQueuePool(AsyncAdaptedQueuePool):
+    """``AsyncAdaptedQueuePool`` that times how long checkouts wait.
+
+    The wait is everything between asking for a connection and getting one:
+    queueing for a free connection, opening an overflow connection and the
+    pre-ping, if enabled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.observe_timeout()
+            raise
+        self.metrics.observe_checkout(time.perf_counter() - started, self.overflow())
+        return connection
+
+    def recreate(self):
+        # dispose() swaps in a new pool; carry the counters over
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def pool_status(pool) -> dict:
+    """Current and cumulative figures of a pool, for ``GET /metrics/pool``."""
+    status = {
+        "pid": os.getpid(),
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        # negative while the pool has not yet opened ``size`` connections
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+    }
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        status.update(
+            checkouts=metrics.checkouts,
+            timeouts=metrics.timeouts,
+            overflow_max=metrics.overflow_max,
+            wait_seconds_total=metrics.wait_seconds_total,
+            wait_seconds_max=metrics.wait_seconds_max,
+            wait_seconds_avg=(
+                metrics.wait_seconds_total / metrics.checkouts
+                if metrics.checkouts
+                else 0.0
+            ),
+        )
+    return status
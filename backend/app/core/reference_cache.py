@@ -0,0 +1,162 @@
+"""Read-through cache of rarely changing reference data.
+
+Customers and products are looked up by id on every report and ingestion
+batch but change rarely. Entries are plain, JSON-serialisable tuples, not
+ORM instances, so they are safe to share between sessions and processes.
+
+By default each worker keeps a bounded LRU of ``REFERENCE_CACHE_SIZE``
+entries for up to ``REFERENCE_CACHE_TTL`` seconds. With
+``REFERENCE_CACHE_URL`` set, workers share a Redis-compatible server
+instead, so an invalidation is seen by all of them at once; needs the
+``redis`` package (``poetry install -E cache``).
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.core.instrumentation import REFERENCE_CACHE_LOOKUPS
+
+
+class LocalCache:
+    """In-process LRU whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_many(self, keys: list) -> dict:
+        now = time.monotonic()
+        found = {}
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                continue
+            self._entries.move_to_end(key)
+            found[key] = value
+        return found
+
+    async def set_many(self, values: dict):
+        expires_at = time.monotonic() + self.ttl
+        for key, value in values.items():
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete_many(self, keys: list):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisCache:
+    """Any Redis-compatible server; memory is bounded by the TTL and its
+    ``maxmemory`` policy."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "reference:"):
+        import redis.asyncio
+
+        self.client = redis.asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        values = await self.client.mget([self.prefix + key for key in keys])
+        return {
+            key: json.loads(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    async def set_many(self, values: dict):
+        async with self.client.pipeline(transaction=False) as pipeline:
+            for key, value in values.items():
+                pipeline.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+            await pipeline.execute()
+
+    async def delete_many(self, keys: list):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
+
+
+class ReferenceCache:
+    """Namespaced read-through lookups over a ``LocalCache`` or ``RedisCache``.
+
+    Counts hits and misses per namespace, here and in Prometheus.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+
+    async def get_many(self, namespace: str, ids, load) -> dict:
+        """Entries for ``ids``; ``await load(missing_ids)`` fetches the rest.
+
+        ``load`` returns a dict of the ids it found; ids it does not know are
+        not cached, so they are found as soon as they are created.
+        """
+        ids = list(dict.fromkeys(ids))
+        keys = [f"{namespace}:{id}" for id in ids]
+        cached = await self.backend.get_many(keys)
+        found = {id: cached[key] for id, key in zip(ids, keys) if key in cached}
+        missing = [id for id in ids if id not in found]
+        self._count(namespace, len(found), len(missing))
+        if missing:
+            loaded = await load(missing)
+            if loaded:
+                await self.backend.set_many(
+                    {f"{namespace}:{id}": value for id, value in loaded.items()}
+                )
+            found.update(loaded)
+        return found
+
+    async def invalidate(self, namespace: str, ids):
+        await self.backend.delete_many([f"{namespace}:{id}" for id in ids])
+
+    def _count(self, namespace: str, hits: int, misses: int):
+        self.hits[namespace] = self.hits.get(namespace, 0) + hits
+        self.misses[namespace] = self.misses.get(namespace, 0) + misses
+        if hits:
+            REFERENCE_CACHE_LOOKUPS.labels(namespace, "hit").inc(hits)
+        if misses:
+            REFERENCE_CACHE_LOOKUPS.labels(namespace, "miss").inc(misses)
+
+    def stats(self) -> dict:
+        return {
+            namespace: {
+                "hits": self.hits.get(namespace, 0),
+                "misses": self.misses.get(namespace, 0),
+            }
+            for namespace in sorted(self.hits.keys() | self.misses.keys())
+        }
+
+
+def reference_cache_backend(url: Optional[str] = None):
+    """The backend configured in ``Settings``."""
+    url = url or settings.REFERENCE_CACHE_URL
+    if url:
+        return RedisCache(url, settings.REFERENCE_CACHE_TTL)
+    return LocalCache(settings.REFERENCE_CACHE_SIZE, settings.REFERENCE_CACHE_TTL)
+
+
+reference_cache = ReferenceCache(reference_cache_backend())
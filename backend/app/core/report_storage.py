@@ -0,0 +1,96 @@
+"""Storage of rendered billing report files.
+
+Files are written once under a content-addressed key and never modified;
+a snapshot's file is deleted when the snapshot is replaced.
+``BillingReportFile.file_path`` holds a local path or an ``s3://bucket/key``
+URL; reads and deletes dispatch on that, so files written before a storage
+change stay readable.
+"""
+
+import asyncio
+import os
+from functools import lru_cache
+
+from app.config import settings
+
+S3_SCHEME = "s3://"
+
+
+class LocalReportStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename, so a reader never sees a partial file
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, "wb") as file:
+            file.write(data)
+        os.replace(partial, path)
+
+    async def write(self, key: str, data: bytes) -> str:
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            await asyncio.to_thread(self._write, path, data)
+        return path
+
+
+class S3ReportStorage:
+    """Any S3-compatible store; LocalStack when ``AWS_ENDPOINT_URL`` is set."""
+
+    def __init__(self, bucket: str, endpoint_url: str = None):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+
+    async def write(self, key: str, data: bytes) -> str:
+        await asyncio.to_thread(
+            _s3_client(self.endpoint_url).put_object,
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+        )
+        return f"{S3_SCHEME}{self.bucket}/{key}"
+
+
+@lru_cache
+def _s3_client(endpoint_url: str = None):
+    import boto3
+
+    return boto3.client("s3", endpoint_url=endpoint_url)
+
+
+def _read_local(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+async def read_report_file(file_path: str) -> bytes:
+    if file_path.startswith(S3_SCHEME):
+        bucket, key = file_path[len(S3_SCHEME) :].split("/", 1)
+        client = _s3_client(settings.AWS_ENDPOINT_URL)
+        response = await asyncio.to_thread(client.get_object, Bucket=bucket, Key=key)
+        return await asyncio.to_thread(response["Body"].read)
+    return await asyncio.to_thread(_read_local, file_path)
+
+
+def _delete_local(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def delete_report_file(file_path: str):
+    if file_path.startswith(S3_SCHEME):
+        bucket, key = file_path[len(S3_SCHEME) :].split("/", 1)
+        client = _s3_client(settings.AWS_ENDPOINT_URL)
+        await asyncio.to_thread(client.delete_object, Bucket=bucket, Key=key)
+        return
+    await asyncio.to_thread(_delete_local, file_path)
+
+
+def report_storage():
+    """The storage new report files are written to, per ``Settings``."""
+    if settings.REPORT_STORAGE == "s3":
+        return S3ReportStorage(settings.REPORT_S3_BUCKET, settings.AWS_ENDPOINT_URL)
+    return LocalReportStorage(settings.REPORT_STORAGE_PATH)
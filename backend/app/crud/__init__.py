@@ -7,6 +7,8 @@ from .billing_report_service import (
 from .leads_service import (
     calculate_action_value,
     save_lead_in_database,
+    bulk_save_leads,
+    bulk_save_actions,
     get_leads_from_db,
     get_lead_by_id,
     get_leads_by_lead_type,
@@ -15,5 +17,44 @@ from .leads_service import (
     get_action_by_id,
     get_actions,
 )
+from .billing_engine import (
+    aggregate_billing_report,
+    billing_report_with_items,
+    fetch_report_items,
+    stream_report_items,
+)
+from .billing_rollup_service import (
+    add_to_billing_rollups,
+    closed_month_range,
+    rebuild_billing_rollups,
+    refresh_billing_rollups,
+    refresh_stale_billing_rollups,
+    rollup_billing_report,
+)
+from .action_partition_service import (
+    create_action_partition,
+    detach_action_partition,
+    ensure_action_partitions,
+)
+from .reference_data_service import (
+    get_customer,
+    get_customers,
+    get_products,
+    invalidate_customers,
+    invalidate_products,
+    product_names,
+)
+from .ingestion_key_service import (
+    IdempotencyKeyReused,
+    find_ingestion_keys,
+    purge_ingestion_keys,
+    save_ingestion_keys,
+)
+from .report_render_service import (
+    RENDERERS,
+    render_report,
+    report_render_context,
+)
+from .lead_event_service import LeadEventConsumer, parse_lead_event
 
 # Add other CRUD services here
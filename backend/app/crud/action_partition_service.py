@@ -0,0 +1,147 @@
+"""Monthly range partitions of the ``actions`` table.
+
+``actions`` is partitioned by ``created_at``: one partition per calendar month
+(``actions_YYYY_MM``) plus ``actions_default`` for rows outside every monthly
+partition. A report over a date range only scans the months it covers, and a
+closed month can be detached without rewriting the table; its totals stay
+available from ``billing_rollups``.
+
+Partitions are not created on ingestion. Every worker runs
+``ensure_action_partitions`` at startup and daily: it creates the current
+month and the ``ACTION_PARTITIONS_AHEAD`` months after it, and any earlier
+month with rows in ``actions_default``. Back-dated actions therefore sit in
+the default partition until the next run moves them into their month.
+Creating partitions takes a transaction-scoped advisory lock, so workers
+running it at the same time create each partition once.
+"""
+
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.billing_rollup_service import month_start, next_month
+
+DEFAULT_ACTION_PARTITION = "actions_default"
+
+# Monthly partitions kept ready beyond the current month.
+ACTION_PARTITIONS_AHEAD = 3
+
+ACTION_PARTITIONS_LOCK = "actions:partitions"
+
+
+def action_partition_name(month: date) -> str:
+    return f"actions_{month:%Y_%m}"
+
+
+async def action_partition_exists(db: AsyncSession, month: date) -> bool:
+    result = await db.execute(
+        text("SELECT to_regclass(:name)"), {"name": action_partition_name(month)}
+    )
+    return result.scalar() is not None
+
+
+async def action_partition_attached(db: AsyncSession, month: date) -> bool:
+    result = await db.execute(
+        text(
+            "SELECT 1 FROM pg_inherits WHERE inhparent = 'actions'::regclass "
+            "AND inhrelid = to_regclass(:name)"
+        ),
+        {"name": action_partition_name(month)},
+    )
+    return result.scalar() is not None
+
+
+async def lock_action_partitions(db: AsyncSession):
+    """Serialize partition changes until the transaction ends."""
+    await db.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(ACTION_PARTITIONS_LOCK)))
+    )
+
+
+async def default_partition_months(db: AsyncSession) -> list[date]:
+    """Months with rows in the default partition."""
+    result = await db.execute(
+        text(
+            "SELECT DISTINCT date_trunc('month', created_at)::date "
+            f"FROM {DEFAULT_ACTION_PARTITION}"
+        )
+    )
+    return sorted(result.scalars())
+
+
+async def create_action_partition(db: AsyncSession, month: date) -> bool:
+    """Create the partition of ``month`` unless a table of that name exists.
+
+    Returns True if created; a detached partition is never re-created.
+
+    Rows of that month already sitting in the default partition are moved
+    into the new partition before it is attached. Runs in the caller's
+    transaction, holding the partition lock; the caller commits.
+    """
+    month = month_start(month)
+    await lock_action_partitions(db)
+    if await action_partition_exists(db, month):
+        return False
+    name, lower, upper = action_partition_name(month), month, next_month(month)
+    await db.execute(
+        text(
+            f"CREATE TABLE {name} "
+            "(LIKE actions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    await db.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_ACTION_PARTITION} "
+            "WHERE created_at >= :lower AND created_at < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        {"lower": lower, "upper": upper},
+    )
+    await db.execute(
+        text(
+            f"ALTER TABLE actions ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+    )
+    return True
+
+
+async def ensure_action_partitions(
+    db: AsyncSession,
+    months_ahead: int = ACTION_PARTITIONS_AHEAD,
+    today: Optional[datetime] = None,
+) -> list[str]:
+    """Create the partitions of the current month and ``months_ahead`` after it,
+    and of the months with rows in the default partition.
+
+    Returns the names of the partitions created.
+    """
+    await lock_action_partitions(db)
+    month = month_start(today or datetime.now(timezone.utc))
+    months = set(await default_partition_months(db))
+    for _ in range(months_ahead + 1):
+        months.add(month)
+        month = next_month(month)
+    created = []
+    for month in sorted(months):
+        if await create_action_partition(db, month):
+            created.append(action_partition_name(month))
+    await db.commit()
+    return created
+
+
+async def detach_action_partition(db: AsyncSession, month: date) -> Optional[str]:
+    """Detach the partition of ``month`` from ``actions``; None if there is none.
+
+    The detached table keeps its rows and can be archived or dropped.
+    """
+    month = month_start(month)
+    await lock_action_partitions(db)
+    if not await action_partition_attached(db, month):
+        return None
+    name = action_partition_name(month)
+    await db.execute(text(f"ALTER TABLE actions DETACH PARTITION {name}"))
+    await db.commit()
+    return name
@@ -0,0 +1,278 @@
+"""Columnar in-memory store of actions for report computation.
+
+Actions are read with a Core ``select`` on the ``actions`` table, so no ORM
+instances or identity map entries are created, and packed into one NumPy
+structured array: ids become interned integer codes and the enum columns
+``CODE_DTYPE`` codes. Pricing, duplicate detection and the billing cap run
+over whole columns; rows are only shaped as line item dicts, and then as
+Pydantic models, at the response boundary.
+"""
+
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.billing_report_service import billing_cap, duplicate_mask
+from app.models import Action
+from app.shared import (
+    BILLING_CAP,
+    ActionTypes,
+    BillableStatus,
+    DedupWindows,
+    EngagementLevelTypes,
+    LeadTypes,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    encode,
+    price_actions,
+)
+
+actions_table = Action.__table__
+
+# Columns read per action, in the order ``ActionStore.from_rows`` expects.
+STORE_COLUMNS = (
+    actions_table.c.lead_id,
+    actions_table.c.customer_id,
+    actions_table.c.product_id,
+    actions_table.c.lead_type,
+    actions_table.c.action_type,
+    actions_table.c.engagement_level,
+    actions_table.c.created_at,
+)
+
+# 23 bytes per action; the ids live once each in ``ActionStore`` lookups.
+ACTION_DTYPE = np.dtype(
+    [
+        ("lead", np.int32),
+        ("customer", np.int32),
+        ("product", np.int32),
+        ("lead_type", np.uint8),
+        ("action_type", np.uint8),
+        ("engagement_level", np.uint8),
+        ("created_at", "datetime64[us]"),
+    ]
+)
+
+# code -> enum value, for shaping line items
+_LEAD_TYPE_VALUES = [member.value for member in LeadTypes]
+_ACTION_TYPE_VALUES = [member.value for member in ActionTypes]
+_ENGAGEMENT_LEVEL_VALUES = [member.value for member in EngagementLevelTypes]
+
+
+def intern(values, codes: dict) -> np.ndarray:
+    """Map values to dense integer codes, adding unseen values to ``codes``."""
+    return np.fromiter(
+        (codes.setdefault(value, len(codes)) for value in values), dtype=np.int32
+    )
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime64_us(values) -> np.ndarray:
+    """Naive datetimes as ``datetime64[us]``.
+
+    Integer microseconds since the epoch are several times faster to build
+    than NumPy's own conversion of datetime objects.
+    """
+    return np.fromiter(
+        ((value - _EPOCH) // _MICROSECOND for value in values), dtype=np.int64
+    ).view("datetime64[us]")
+
+
+class ActionStore:
+    """Actions in billing order as one structured array.
+
+    ``leads``, ``customers`` and ``products`` list the ids behind the codes in
+    the ``lead``, ``customer`` and ``product`` fields.
+    """
+
+    def __init__(self, actions: np.ndarray, leads, customers, products):
+        self.actions = actions
+        self.leads = leads
+        self.customers = customers
+        self.products = products
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    @classmethod
+    def from_rows(cls, rows) -> "ActionStore":
+        """Build a store from ``STORE_COLUMNS`` rows, already in billing order."""
+        actions = np.zeros(len(rows), dtype=ACTION_DTYPE)
+        lead_codes, customer_codes, product_codes = {}, {}, {}
+        if rows:
+            (
+                lead_ids,
+                customer_ids,
+                product_ids,
+                lead_types,
+                action_types,
+                engagement_levels,
+                created_ats,
+            ) = zip(*rows)
+            actions["lead"] = intern(lead_ids, lead_codes)
+            actions["customer"] = intern(customer_ids, customer_codes)
+            actions["product"] = intern(product_ids, product_codes)
+            actions["lead_type"] = encode(lead_types, LEAD_TYPE_CODES)
+            actions["action_type"] = encode(action_types, ACTION_TYPE_CODES)
+            actions["engagement_level"] = encode(
+                engagement_levels, ENGAGEMENT_LEVEL_CODES
+            )
+            actions["created_at"] = datetime64_us(created_ats)
+        return cls(
+            actions, list(lead_codes), list(customer_codes), list(product_codes)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.actions.nbytes
+
+    def month_codes(self) -> np.ndarray:
+        """Months since the earliest month in the store."""
+        months = self.actions["created_at"].astype("datetime64[M]").astype(np.int64)
+        return months - months.min() if len(months) else months
+
+
+def action_store_select(
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+):
+    """Core select of a customer's actions in billing order."""
+    query = select(*STORE_COLUMNS).where(actions_table.c.customer_id == customer_id)
+    if start_date:
+        query = query.where(actions_table.c.created_at >= start_date)
+    if end_date:
+        query = query.where(actions_table.c.created_at <= end_date)
+    return query.order_by(actions_table.c.created_at, actions_table.c.id)
+
+
+async def load_action_store(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> ActionStore:
+    result = await db.execute(action_store_select(customer_id, start_date, end_date))
+    return ActionStore.from_rows(result.all())
+
+
+class BilledActions(NamedTuple):
+    amount: np.ndarray
+    duplicate: np.ndarray
+    billed: np.ndarray
+
+
+def bill_actions(
+    store: ActionStore,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+    cap: float = BILLING_CAP,
+) -> BilledActions:
+    """Price, dedupe and cap every action of a store at once.
+
+    Same rules as the SQL engine: the first action of each duplicate key is
+    billed, and each lead is capped within the dedup window.
+    """
+    actions = store.actions
+    amount = price_actions(
+        actions["lead_type"], actions["action_type"], actions["engagement_level"]
+    )
+    if not len(store):
+        return BilledActions(amount, np.zeros(0, dtype=bool), np.zeros(0))
+
+    key_columns = [
+        actions["customer"],
+        actions["product"],
+        actions["lead_type"],
+        actions["action_type"],
+        actions["engagement_level"],
+    ]
+    groups = actions["lead"].astype(np.int64)
+    if dedup_window == DedupWindows.MONTH:
+        months = store.month_codes()
+        key_columns.append(months)
+        groups = groups * (int(months.max()) + 1) + months
+    duplicate = duplicate_mask(*key_columns)
+    billed = billing_cap(groups, np.where(duplicate, 0.0, amount), cap).billed
+    return BilledActions(amount, duplicate, billed)
+
+
+def store_totals(store: ActionStore, billed: BilledActions, names: dict) -> dict:
+    """Report totals, shaped like ``billing_engine.empty_report_totals``."""
+    products = store.actions["product"]
+    subtotals = np.bincount(
+        products, weights=billed.billed, minlength=len(store.products)
+    )
+    total_billed = float(billed.billed.sum())
+    subtotal_by_name = {}
+    for product_id, subtotal in zip(store.products, subtotals.tolist()):
+        name = names[product_id]
+        subtotal_by_name[name] = subtotal_by_name.get(name, 0.0) + subtotal
+    return {
+        "action_count": len(store),
+        "duplicate_count": int(billed.duplicate.sum()),
+        "total_billed_amount": total_billed,
+        "total_savings": float(billed.amount.sum()) - total_billed,
+        "product_subtotals": subtotal_by_name,
+    }
+
+
+def billed_statuses(billed: BilledActions) -> np.ndarray:
+    """The ``BillableStatus`` value of each billed action."""
+    return np.where(
+        billed.duplicate,
+        BillableStatus.NOT_BILLED.value,
+        np.where(
+            (billed.billed == 0) & (billed.amount > 0),
+            BillableStatus.CAPPED.value,
+            BillableStatus.BILLED.value,
+        ),
+    )
+
+
+def store_report_items(
+    store: ActionStore, billed: BilledActions, customer_email: str, names: dict
+) -> list[dict]:
+    """Shape billed actions as report line items."""
+    actions = store.actions
+    status = billed_statuses(billed)
+    product_names = [names[product_id] for product_id in store.products]
+    rows = zip(
+        actions["product"].tolist(),
+        actions["lead_type"].tolist(),
+        actions["action_type"].tolist(),
+        actions["engagement_level"].tolist(),
+        billed.amount.tolist(),
+        billed.billed.tolist(),
+        billed.duplicate.tolist(),
+        status.tolist(),
+    )
+    return [
+        {
+            "customer_email": customer_email,
+            "associated_product": product_names[product],
+            "lead_type": _LEAD_TYPE_VALUES[lead_type],
+            "action_type": _ACTION_TYPE_VALUES[action_type],
+            "engagement_level": _ENGAGEMENT_LEVEL_VALUES[engagement_level],
+            "amount": amount,
+            "billed_amount": billed_amount,
+            "duplicate": duplicate,
+            "status": item_status,
+        }
+        for (
+            product,
+            lead_type,
+            action_type,
+            engagement_level,
+            amount,
+            billed_amount,
+            duplicate,
+            item_status,
+        ) in rows
+    ]
@@ -0,0 +1,399 @@
+"""Set-based billing aggregation engine.
+
+Pricing, duplicate detection, the billing cap and per-product subtotals are
+evaluated by the database in one grouped query over the ``actions`` table, so
+a report costs a handful of result rows instead of one ORM instance per
+action. Line items are only selected when the caller asks for them: reports
+with items read the range once into an ``ActionStore`` and bill it in NumPy,
+streamed items are priced by SQL batch by batch.
+
+The cap limits what each lead is billed within the dedup window. Totals only
+need each lead's sum; streamed line items are capped in billing order by
+``BillingCapLedger``.
+"""
+
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from sqlalchemy import Integer, Numeric, and_, case, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.instrumentation import count_priced, span
+from app.crud.action_store import (
+    bill_actions,
+    load_action_store,
+    store_report_items,
+    store_totals,
+)
+from app.crud.billing_report_service import BillingCapLedger
+from app.crud.reference_data_service import product_names
+from app.models import Action, Product
+from app.shared import (
+    BILLING_CAP,
+    ActionTypes,
+    BillableStatus,
+    DedupWindows,
+    EngagementLevelTypes,
+    LeadTypes,
+    ENGAGEMENT_MULTIPLIERS,
+    LEAD_ACTION_COSTS,
+    LEAD_TYPE_BASE_VALUES,
+)
+
+# Rows fetched per round-trip when streaming line items from a server-side cursor.
+STREAM_BATCH_SIZE = 1000
+
+# Actions sharing these columns are billed once; every later occurrence is
+# recorded as savings.
+DUPLICATE_KEY_COLUMNS = (
+    Action.customer_id,
+    Action.product_id,
+    Action.lead_type,
+    Action.action_type,
+    Action.engagement_level,
+)
+
+
+def _price(value):
+    return cast(value, Numeric)
+
+
+def action_value_expression():
+    """SQL equivalent of ``calculate_action_value`` for a row of ``actions``."""
+    base_value = case(
+        *[
+            (Action.lead_type == LeadTypes(lead_type), _price(value))
+            for lead_type, value in LEAD_TYPE_BASE_VALUES.items()
+        ],
+        else_=_price(0),
+    )
+    action_cost = case(
+        *[
+            (
+                and_(
+                    Action.lead_type == LeadTypes(lead_type),
+                    Action.action_type == ActionTypes(action_type),
+                ),
+                _price(cost),
+            )
+            for lead_type, costs in LEAD_ACTION_COSTS.items()
+            for action_type, cost in costs.items()
+        ],
+        else_=_price(0),
+    )
+    multiplier = case(
+        *[
+            (Action.engagement_level == EngagementLevelTypes(level), _price(value))
+            for level, value in ENGAGEMENT_MULTIPLIERS.items()
+        ],
+        else_=_price(1),
+    )
+    return base_value + action_cost * multiplier
+
+
+def action_month_expression():
+    return func.date_trunc("month", Action.created_at)
+
+
+def duplicate_partition(dedup_window: DedupWindows = DedupWindows.REPORT) -> tuple:
+    if dedup_window == DedupWindows.MONTH:
+        return DUPLICATE_KEY_COLUMNS + (action_month_expression(),)
+    return DUPLICATE_KEY_COLUMNS
+
+
+def priced_actions_select(*criteria, dedup_window=DedupWindows.REPORT):
+    """Select the actions matching ``criteria`` with their price and duplicate flag.
+
+    Duplicates are only detected among the selected actions.
+    """
+    occurrence = func.row_number().over(
+        partition_by=duplicate_partition(dedup_window),
+        order_by=(Action.created_at, Action.id),
+    )
+    return select(
+        Action.id,
+        Action.lead_id,
+        Action.customer_id,
+        Action.product_id,
+        Action.lead_type,
+        Action.action_type,
+        Action.engagement_level,
+        Action.created_at,
+        action_value_expression().label("amount"),
+        (occurrence > 1).label("is_duplicate"),
+    ).where(*criteria)
+
+
+def customer_actions_criteria(
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> list:
+    criteria = [Action.customer_id == customer_id]
+    if start_date:
+        criteria.append(Action.created_at >= start_date)
+    if end_date:
+        criteria.append(Action.created_at <= end_date)
+    return criteria
+
+
+def priced_actions_query(
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+):
+    """Select a customer's actions with their price and duplicate flag."""
+    return priced_actions_select(
+        *customer_actions_criteria(customer_id, start_date, end_date),
+        dedup_window=dedup_window,
+    )
+
+
+async def has_actions(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> bool:
+    """Whether a customer has any action in the range, from one index probe."""
+    result = await db.execute(
+        select(Action.id)
+        .where(*customer_actions_criteria(customer_id, start_date, end_date))
+        .limit(1)
+    )
+    return result.first() is not None
+
+
+def lead_totals_select(priced, *group_columns):
+    """Per-lead counts and billed/savings of a priced subquery, capped.
+
+    Grouped by lead (a lead's actions share its customer and product) and
+    ``group_columns``, e.g. the month for monthly windows. Whatever a lead
+    would be billed over ``BILLING_CAP`` counts as savings.
+    """
+    billed = case((priced.c.is_duplicate, _price(0)), else_=priced.c.amount)
+    savings = case((priced.c.is_duplicate, priced.c.amount), else_=_price(0))
+    duplicates = case((priced.c.is_duplicate, 1), else_=0)
+    uncapped = func.sum(billed)
+    capped = func.least(uncapped, _price(BILLING_CAP))
+    return select(
+        priced.c.lead_id,
+        priced.c.customer_id,
+        priced.c.product_id,
+        *group_columns,
+        func.count().label("action_count"),
+        func.sum(duplicates).label("duplicate_count"),
+        capped.label("billed"),
+        (func.sum(savings) + uncapped - capped).label("savings"),
+    ).group_by(
+        priced.c.lead_id, priced.c.customer_id, priced.c.product_id, *group_columns
+    )
+
+
+def billing_aggregates(lead_totals) -> list:
+    """Action/duplicate counts and billed/savings sums over lead totals."""
+    return [
+        cast(func.sum(lead_totals.c.action_count), Integer).label("action_count"),
+        cast(func.sum(lead_totals.c.duplicate_count), Integer).label(
+            "duplicate_count"
+        ),
+        func.sum(lead_totals.c.billed).label("billed"),
+        func.sum(lead_totals.c.savings).label("savings"),
+    ]
+
+
+def cap_window_columns(priced, dedup_window: DedupWindows) -> tuple:
+    """The lead is capped once per month in monthly windows."""
+    if dedup_window == DedupWindows.MONTH:
+        return (func.date_trunc("month", priced.c.created_at),)
+    return ()
+
+
+def product_totals_query(priced, dedup_window: DedupWindows = DedupWindows.REPORT):
+    """Group a priced actions subquery into per-product billed/savings totals."""
+    leads = lead_totals_select(
+        priced, *cap_window_columns(priced, dedup_window)
+    ).subquery()
+    return (
+        select(
+            leads.c.product_id,
+            Product.name.label("product_name"),
+            *billing_aggregates(leads),
+        )
+        .join(Product, Product.id == leads.c.product_id)
+        .group_by(leads.c.product_id, Product.name)
+    )
+
+
+def add_product_totals(totals: dict, rows) -> dict:
+    """Fold ``product_totals_query``-shaped rows into report totals."""
+    subtotals = totals["product_subtotals"]
+    for row in rows:
+        billed = float(row.billed or 0)
+        totals["action_count"] += row.action_count
+        totals["duplicate_count"] += row.duplicate_count or 0
+        totals["total_billed_amount"] += billed
+        totals["total_savings"] += float(row.savings or 0)
+        subtotals[row.product_name] = subtotals.get(row.product_name, 0.0) + billed
+    return totals
+
+
+def empty_report_totals() -> dict:
+    return {
+        "action_count": 0,
+        "duplicate_count": 0,
+        "total_billed_amount": 0.0,
+        "total_savings": 0.0,
+        "product_subtotals": {},
+    }
+
+
+def add_item_to_totals(totals: dict, item: dict) -> dict:
+    """Fold one line item into running report totals."""
+    totals["action_count"] += 1
+    subtotals = totals["product_subtotals"]
+    subtotals.setdefault(item["associated_product"], 0.0)
+    if item["duplicate"]:
+        totals["duplicate_count"] += 1
+    totals["total_billed_amount"] += item["billed_amount"]
+    totals["total_savings"] += item["amount"] - item["billed_amount"]
+    subtotals[item["associated_product"]] += item["billed_amount"]
+    return totals
+
+
+async def aggregate_billing_report(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+) -> dict:
+    """Compute report totals for a customer without loading any actions."""
+    priced = priced_actions_query(
+        customer_id, start_date, end_date, dedup_window
+    ).subquery()
+    with span("aggregate_totals"):
+        result = await db.execute(product_totals_query(priced, dedup_window))
+        totals = add_product_totals(empty_report_totals(), result)
+    count_priced("sql", totals["action_count"])
+    return totals
+
+
+def report_items_query(
+    customer_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+):
+    """Select the priced line items of a report in billing order."""
+    priced = priced_actions_query(
+        customer_id, start_date, end_date, dedup_window
+    ).subquery()
+    return (
+        select(priced, Product.name.label("product_name"))
+        .join(Product, Product.id == priced.c.product_id)
+        .order_by(priced.c.created_at, priced.c.id)
+    )
+
+
+def report_item_from_row(row, customer_email: str, billed_amount: float) -> dict:
+    """Shape a row of ``report_items_query`` as a billing report line item."""
+    if row.is_duplicate:
+        status = BillableStatus.NOT_BILLED
+    elif billed_amount or not row.amount:
+        status = BillableStatus.BILLED
+    else:
+        status = BillableStatus.CAPPED
+    return {
+        "customer_email": customer_email,
+        "associated_product": row.product_name,
+        "lead_type": row.lead_type.value,
+        "action_type": row.action_type.value,
+        "engagement_level": row.engagement_level.value,
+        "amount": float(row.amount),
+        "billed_amount": billed_amount,
+        "duplicate": row.is_duplicate,
+        "status": status.value,
+    }
+
+
+def report_items_from_rows(
+    rows, customer_email: str, ledger: BillingCapLedger
+) -> list[dict]:
+    """Shape a batch of rows as line items, capping them with ``ledger``."""
+    amounts = np.fromiter(
+        (0.0 if row.is_duplicate else float(row.amount) for row in rows),
+        dtype=np.float64,
+        count=len(rows),
+    )
+    capped = ledger.apply(
+        [row.lead_id for row in rows], [row.created_at for row in rows], amounts
+    )
+    return [
+        report_item_from_row(row, customer_email, billed)
+        for row, billed in zip(rows, capped.billed.tolist())
+    ]
+
+
+async def billing_report_with_items(
+    db: AsyncSession,
+    customer_id: str,
+    customer_email: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+) -> tuple[dict, list[dict]]:
+    """Report totals and line items from one read into an ``ActionStore``."""
+    with span("load_actions"):
+        store = await load_action_store(db, customer_id, start_date, end_date)
+    with span("bill_actions"):
+        billed = bill_actions(store, dedup_window)
+    count_priced("columnar", len(store))
+    names = await product_names(db, store.products)
+    with span("shape_items"):
+        return (
+            store_totals(store, billed, names),
+            store_report_items(store, billed, customer_email, names),
+        )
+
+
+async def fetch_report_items(
+    db: AsyncSession,
+    customer_id: str,
+    customer_email: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+) -> list[dict]:
+    _, items = await billing_report_with_items(
+        db, customer_id, customer_email, start_date, end_date, dedup_window
+    )
+    return items
+
+
+async def stream_report_items(
+    db: AsyncSession,
+    customer_id: str,
+    customer_email: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    dedup_window: DedupWindows = DedupWindows.REPORT,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> AsyncIterator[list[dict]]:
+    """Yield line items in batches from a server-side cursor.
+
+    Only one batch of rows is held in memory at a time, regardless of how many
+    actions fall into the report range.
+    """
+    query = report_items_query(
+        customer_id, start_date, end_date, dedup_window
+    ).execution_options(yield_per=batch_size)
+    result = await db.stream(query)
+    ledger = BillingCapLedger(dedup_window)
+    async for rows in result.partitions(batch_size):
+        with span("stream_batch"):
+            items = report_items_from_rows(rows, customer_email, ledger)
+        count_priced("stream", len(rows))
+        yield items
@@ -1,5 +1,8 @@
 from app.schemas import BillingReportCreate, BillingReport
+from app.shared import BILLING_CAP, DedupWindows
 from decimal import Decimal
+from typing import NamedTuple
+import numpy as np
 
 
 async def get_billing_report():
@@ -28,6 +31,122 @@ def is_duplicate_action(current_action, processed_product_actions: list) -> bool
     return False
 
 
+def duplicate_mask(*key_columns: np.ndarray) -> np.ndarray:
+    """Flag every row whose key columns repeat an earlier row.
+
+    For columnar batches: each key column is an integer array (enum codes,
+    interned ids, month numbers) and rows must already be in billing order.
+    """
+    rows = len(key_columns[0])
+    duplicates = np.ones(rows, dtype=bool)
+    if not rows:
+        return duplicates
+
+    # Pack the columns into one int64 per row (mixed radix) so np.unique
+    # sorts scalars instead of rows.
+    radixes = [int(column.max()) + 1 for column in key_columns]
+    if np.prod(radixes, dtype=float) < 2**63:
+        keys = np.zeros(rows, dtype=np.int64)
+        for column, radix in zip(key_columns, radixes):
+            keys = keys * radix + column.astype(np.int64)
+        _, first_rows = np.unique(keys, return_index=True)
+    else:
+        _, first_rows = np.unique(
+            np.stack(key_columns, axis=1), axis=0, return_index=True
+        )
+    duplicates[first_rows] = False
+    return duplicates
+
+
+class CappedAmounts(NamedTuple):
+    running: np.ndarray  # billable total of the row's group up to and including it
+    billed: np.ndarray
+    savings: np.ndarray  # the part of each amount over the cap
+    crossed: np.ndarray  # rows on which their group went over the cap
+
+
+def billing_cap(
+    group_codes: np.ndarray,
+    amounts: np.ndarray,
+    cap: float = BILLING_CAP,
+    spent: np.ndarray = None,
+) -> CappedAmounts:
+    """Bill amounts until their group's running total reaches ``cap``.
+
+    Rows must be in billing order; ``group_codes`` are small integers (e.g.
+    interned lead ids) and duplicates should come with an amount of 0. If
+    given, ``spent[code]`` is what each group was billed before this batch;
+    it is updated in place, so consecutive batches can be capped one by one.
+    """
+    rows = len(amounts)
+    if not rows:
+        empty = np.zeros(0)
+        return CappedAmounts(empty, empty, empty, np.zeros(0, dtype=bool))
+
+    # Stable sort by group keeps billing order within each group; one cumsum
+    # then gives every group's running total once each group's offset is
+    # taken off.
+    order = np.argsort(group_codes, kind="stable")
+    groups = group_codes[order]
+    sorted_amounts = amounts[order].astype(np.float64)
+    running = np.cumsum(sorted_amounts)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    lengths = np.diff(np.r_[starts, rows])
+    offsets = running[starts] - sorted_amounts[starts]
+    if spent is not None:
+        offsets -= spent[groups[starts]]
+    running -= np.repeat(offsets, lengths)
+    if spent is not None:
+        spent[groups[starts + lengths - 1]] = running[starts + lengths - 1]
+
+    before = running - sorted_amounts
+    billed = np.minimum(running, cap) - np.minimum(before, cap)
+    crossed = (before < cap) & (running > cap)
+
+    unsorted = np.empty(rows, dtype=order.dtype)
+    unsorted[order] = np.arange(rows)
+    billed = billed[unsorted]
+    return CappedAmounts(
+        running[unsorted], billed, amounts - billed, crossed[unsorted]
+    )
+
+
+class BillingCapLedger:
+    """Running billed totals of each lead, or of each lead and month.
+
+    The billing cap applies per lead within the same window duplicates are
+    detected in. One ledger caps a report's line items batch after batch.
+    """
+
+    def __init__(self, window: DedupWindows = DedupWindows.REPORT, cap=BILLING_CAP):
+        self.window = window
+        self.cap = cap
+        self._codes = {}
+        self._spent = np.zeros(0)
+
+    def group_key(self, lead_id, created_at) -> tuple:
+        if self.window == DedupWindows.MONTH:
+            return (lead_id, created_at.year, created_at.month)
+        return (lead_id,)
+
+    def apply(self, lead_ids, created_ats, amounts: np.ndarray) -> CappedAmounts:
+        """Cap the next batch of billable amounts, in billing order."""
+        codes = self._codes
+        group_codes = np.fromiter(
+            (
+                codes.setdefault(self.group_key(lead_id, created_at), len(codes))
+                for lead_id, created_at in zip(lead_ids, created_ats)
+            ),
+            dtype=np.int64,
+            count=len(amounts),
+        )
+        if len(codes) > len(self._spent):
+            grown = np.zeros(max(len(codes), 2 * len(self._spent)))
+            grown[: len(self._spent)] = self._spent
+            self._spent = grown
+        return billing_cap(group_codes, amounts, self.cap, self._spent)
+
+
 def set_duplicate_fields(action, is_duplicate):
     action.is_duplicate = is_duplicate
     action.status = "Not Billed (Duplicate)" if is_duplicate else "Billed"
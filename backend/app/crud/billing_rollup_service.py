@@ -0,0 +1,294 @@
+"""Monthly billing rollups.
+
+``billing_rollups`` holds billed/savings totals per customer, product and
+calendar month. Ingestion only adds what it writes to ``action_count`` and
+marks the rows stale, in proportion to the batch: duplicates and the cap
+depend on the whole month, so billed, savings and duplicate_count are
+recomputed by ``refresh_stale_billing_rollups`` on a schedule. Reports that
+cover whole closed months are answered from these rows instead of the
+``actions`` table when none of them is stale.
+
+The refresh runs in one worker at a time, under a transaction-scoped
+advisory lock, and locks the rows it recomputes before reading their months:
+ingestion into them either committed before the read or waits for the
+refresh and marks them stale again.
+"""
+
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import Date, and_, cast, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.instrumentation import span
+from app.crud.billing_engine import (
+    action_month_expression,
+    add_product_totals,
+    billing_aggregates,
+    empty_report_totals,
+    lead_totals_select,
+    priced_actions_select,
+)
+from app.models import Action, BillingRollup, Product
+from app.shared import DedupWindows
+
+ROLLUP_VALUE_COLUMNS = ("action_count", "duplicate_count", "billed", "savings")
+
+# (customer, product, month) groups per upsert; eight parameters each.
+ROLLUP_BATCH_SIZE = 1000
+
+# (customer, month) pairs recomputed per transaction by the refresh.
+REFRESH_BATCH_SIZE = 100
+
+REFRESH_LOCK = "billing_rollups:refresh"
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def closed_month_range(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    now: Optional[datetime] = None,
+) -> Optional[tuple[date, date]]:
+    """First and last month of a report range made of whole, closed months.
+
+    The range must start at midnight on the first of a month and end on the
+    last second of a month, and that month must be over. Returns None for
+    any other range.
+    """
+    if start_date is None or end_date is None:
+        return None
+    start_date, end_date = _utc_naive(start_date), _utc_naive(end_date)
+    first_month, last_month = month_start(start_date), month_start(end_date)
+    month_end = datetime.combine(next_month(last_month), datetime.min.time())
+
+    if start_date != datetime.combine(first_month, datetime.min.time()):
+        return None
+    if end_date + timedelta(seconds=1) < month_end:
+        return None
+    current_month = month_start(_utc_naive(now or datetime.now(timezone.utc)))
+    if first_month > last_month or next_month(last_month) > current_month:
+        return None
+    return first_month, last_month
+
+
+def customer_month_criteria(customer_months: Iterable[tuple[str, date]]):
+    return or_(
+        *[
+            and_(
+                Action.customer_id == customer_id,
+                Action.created_at >= month,
+                Action.created_at < next_month(month),
+            )
+            for customer_id, month in customer_months
+        ]
+    )
+
+
+def rollup_key_columns():
+    return (BillingRollup.customer_id, BillingRollup.product_id, BillingRollup.month)
+
+
+def rollup_refresh_statement(*criteria, keys: Optional[list[tuple]] = None):
+    """Upsert the rollups of every (customer, product, month) matching ``criteria``.
+
+    ``criteria`` must select whole months, since duplicates are detected
+    within each month. With ``keys``, only existing rows among those
+    (customer, product, month) keys are overwritten; any other existing row
+    is left stale for the next refresh.
+    """
+    priced = (
+        priced_actions_select(*criteria, dedup_window=DedupWindows.MONTH)
+        .add_columns(cast(action_month_expression(), Date).label("month"))
+        .subquery()
+    )
+    # leads are capped per month, like duplicates
+    leads = lead_totals_select(priced, priced.c.month).subquery()
+    rollups = select(
+        leads.c.customer_id,
+        leads.c.product_id,
+        leads.c.month,
+        *billing_aggregates(leads),
+    ).group_by(leads.c.customer_id, leads.c.product_id, leads.c.month)
+
+    statement = pg_insert(BillingRollup).from_select(
+        ["customer_id", "product_id", "month", *ROLLUP_VALUE_COLUMNS], rollups
+    )
+    values = {column: statement.excluded[column] for column in ROLLUP_VALUE_COLUMNS}
+    return statement.on_conflict_do_update(
+        index_elements=list(rollup_key_columns()),
+        set_={**values, "stale": False, "updated_at": func.now()},
+        where=None if keys is None else tuple_(*rollup_key_columns()).in_(keys),
+    )
+
+
+async def add_to_billing_rollups(db: AsyncSession, action_rows: list[dict]):
+    """Count newly written actions into their rollups and mark those stale.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    counts = Counter(
+        (row["customer_id"], row["product_id"], month_start(row["created_at"]))
+        for row in action_rows
+    )
+    # upserts in key order, so concurrent ingestions never deadlock
+    groups = sorted(counts.items())
+    for start in range(0, len(groups), ROLLUP_BATCH_SIZE):
+        statement = pg_insert(BillingRollup).values(
+            [
+                {
+                    "customer_id": customer_id,
+                    "product_id": product_id,
+                    "month": month,
+                    "action_count": count,
+                    "duplicate_count": 0,
+                    "billed": 0,
+                    "savings": 0,
+                    "stale": True,
+                }
+                for (customer_id, product_id, month), count in groups[
+                    start : start + ROLLUP_BATCH_SIZE
+                ]
+            ]
+        )
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[
+                    BillingRollup.customer_id,
+                    BillingRollup.product_id,
+                    BillingRollup.month,
+                ],
+                set_={
+                    "action_count": BillingRollup.action_count
+                    + statement.excluded.action_count,
+                    "stale": True,
+                    "updated_at": func.now(),
+                },
+            )
+        )
+
+
+async def refresh_billing_rollups(
+    db: AsyncSession, customer_months: Iterable[tuple[str, date]]
+):
+    """Recompute the rollups of the given (customer, month) pairs.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    customer_months = sorted(set(customer_months))
+    if not customer_months:
+        return
+    # in key order, like ingestion, so the two never deadlock
+    keys = (
+        await db.execute(
+            select(*rollup_key_columns())
+            .where(
+                or_(
+                    *[
+                        and_(
+                            BillingRollup.customer_id == customer_id,
+                            BillingRollup.month == month,
+                        )
+                        for customer_id, month in customer_months
+                    ]
+                )
+            )
+            .order_by(*rollup_key_columns())
+            .with_for_update()
+        )
+    ).all()
+    if keys:
+        # rows left without actions are not written by the upsert
+        await db.execute(
+            update(BillingRollup)
+            .where(tuple_(*rollup_key_columns()).in_(keys))
+            .values(
+                **{column: 0 for column in ROLLUP_VALUE_COLUMNS},
+                stale=False,
+                updated_at=func.now(),
+            )
+        )
+    await db.execute(
+        rollup_refresh_statement(customer_month_criteria(customer_months), keys=keys)
+    )
+
+
+async def refresh_stale_billing_rollups(db: AsyncSession) -> int:
+    """Recompute every stale rollup; returns the (customer, month) pairs done.
+
+    Returns 0 without waiting if another worker is refreshing.
+    """
+    stale = (
+        await db.execute(
+            select(BillingRollup.customer_id, BillingRollup.month)
+            .where(BillingRollup.stale)
+            .distinct()
+            .order_by(BillingRollup.customer_id, BillingRollup.month)
+        )
+    ).all()
+    refreshed = 0
+    for start in range(0, len(stale), REFRESH_BATCH_SIZE):
+        locked = await db.scalar(
+            select(func.pg_try_advisory_xact_lock(func.hashtext(REFRESH_LOCK)))
+        )
+        if not locked:
+            await db.rollback()
+            break
+        batch = stale[start : start + REFRESH_BATCH_SIZE]
+        await refresh_billing_rollups(db, batch)
+        await db.commit()
+        refreshed += len(batch)
+    return refreshed
+
+
+async def rebuild_billing_rollups(db: AsyncSession):
+    """Recompute every rollup from the ``actions`` table."""
+    await db.execute(rollup_refresh_statement())
+    await db.execute(update(BillingRollup).values(stale=False))
+    await db.commit()
+
+
+async def rollup_billing_report(
+    db: AsyncSession, customer_id: str, first_month: date, last_month: date
+) -> Optional[dict]:
+    """Report totals read from rollups; None if the range has no rollups, or
+    stale ones."""
+    query = (
+        select(
+            BillingRollup.product_id,
+            Product.name.label("product_name"),
+            *[
+                func.sum(getattr(BillingRollup, column)).label(column)
+                for column in ROLLUP_VALUE_COLUMNS
+            ],
+            func.bool_or(BillingRollup.stale).label("stale"),
+        )
+        .join(Product, Product.id == BillingRollup.product_id)
+        .where(
+            BillingRollup.customer_id == customer_id,
+            BillingRollup.month >= first_month,
+            BillingRollup.month <= last_month,
+        )
+        .group_by(BillingRollup.product_id, Product.name)
+    )
+    with span("rollup_totals"):
+        rows = (await db.execute(query)).all()
+    if not rows or any(row.stale for row in rows):
+        return None
+    return add_product_totals(empty_report_totals(), rows)
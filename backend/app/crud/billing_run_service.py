@@ -0,0 +1,358 @@
+"""Month-end billing runs.
+
+A run bills every customer for one calendar month. Creating a run records one
+``billing_run_customers`` row per customer; a bounded pool of asyncio workers
+then claims pending customers one at a time (``FOR UPDATE SKIP LOCKED``), each
+on a session of its own. A customer's report, the linking of its actions and
+its ``done`` mark commit together, so a run resumed after a crash, or by
+several processes at once, never bills a customer twice.
+
+An incremental run bills only the actions not on a report yet; see
+app.crud.incremental_billing_service. A full run of a month whose actions are
+partly on reports already, e.g. late ones billed by an incremental run of a
+later month, bills the rest of the month the same way, against what was
+billed before.
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from uuid import uuid4
+
+from sqlalchemy import case, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.crud.billing_engine import aggregate_billing_report
+from app.crud.incremental_billing_service import (
+    price_unbilled_actions,
+    save_incremental_bill,
+)
+from app.crud.billing_rollup_service import (
+    closed_month_range,
+    month_start,
+    next_month,
+    rollup_billing_report,
+)
+from app.models import (
+    Action,
+    BillingReport,
+    BillingRun,
+    BillingRunCustomer,
+    Customer,
+)
+from app.shared import BillingRunCustomerStatus, BillingRunStatus, DedupWindows
+
+logger = logging.getLogger(__name__)
+
+# Customers billed concurrently by one process.
+BILLING_RUN_WORKERS = 4
+
+# Runs being processed by this process, by id.
+_running_tasks: dict[str, asyncio.Task] = {}
+
+
+def month_period(month: date) -> tuple[datetime, datetime]:
+    """First and last instant of a calendar month, as report range bounds."""
+    start = datetime.combine(month_start(month), datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+    return start, end - timedelta(microseconds=1)
+
+
+async def create_billing_run(
+    db: AsyncSession, month: date, incremental: bool = False
+) -> BillingRun:
+    """Queue a run for ``month`` with every current customer pending."""
+    run = BillingRun(
+        id=str(uuid4()),
+        month=month_start(month),
+        status=BillingRunStatus.QUEUED,
+        incremental=incremental,
+    )
+    db.add(run)
+    await db.flush()
+    # status and action_count take their column defaults
+    await db.execute(
+        insert(BillingRunCustomer).from_select(
+            ["run_id", "customer_id"], select(literal(run.id), Customer.id)
+        )
+    )
+    await db.commit()
+    return run
+
+
+async def get_billing_run_for_month(
+    db: AsyncSession, month: date
+) -> Optional[BillingRun]:
+    result = await db.execute(
+        select(BillingRun)
+        .where(BillingRun.month == month_start(month))
+        .order_by(BillingRun.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def retry_failed_customers(db: AsyncSession, run: BillingRun) -> BillingRun:
+    """Put the failed customers of a finished run back to pending."""
+    await db.execute(
+        update(BillingRunCustomer)
+        .where(
+            BillingRunCustomer.run_id == run.id,
+            BillingRunCustomer.status == BillingRunCustomerStatus.FAILED,
+        )
+        .values(status=BillingRunCustomerStatus.PENDING, error=None, finished_at=None)
+    )
+    run.status = BillingRunStatus.QUEUED
+    run.finished_at = None
+    await db.commit()
+    return run
+
+
+async def billing_run_progress(db: AsyncSession, run: BillingRun) -> dict:
+    """Customer counts by status, actions billed and throughput of a run."""
+    done = BillingRunCustomer.status == BillingRunCustomerStatus.DONE
+    failed = BillingRunCustomer.status == BillingRunCustomerStatus.FAILED
+    row = (
+        await db.execute(
+            select(
+                func.count().label("customer_count"),
+                func.sum(case((done, 1), else_=0)).label("customers_done"),
+                func.sum(case((failed, 1), else_=0)).label("customers_failed"),
+                func.sum(BillingRunCustomer.action_count).label("action_count"),
+                func.sum(BillingReport.total_billed_amount).label("total_billed"),
+                func.sum(BillingReport.savings_amount).label("total_savings"),
+            )
+            .select_from(BillingRunCustomer)
+            .outerjoin(
+                BillingReport,
+                BillingReport.id == BillingRunCustomer.billing_report_id,
+            )
+            .where(BillingRunCustomer.run_id == run.id)
+        )
+    ).one()
+
+    progress = {
+        "id": run.id,
+        "month": run.month,
+        "status": run.status,
+        "incremental": run.incremental,
+        "created_at": run.created_at,
+        "started_at": run.started_at,
+        "finished_at": run.finished_at,
+        "customer_count": row.customer_count,
+        "customers_done": row.customers_done or 0,
+        "customers_failed": row.customers_failed or 0,
+        "action_count": row.action_count or 0,
+        "total_billed_amount": float(row.total_billed or 0),
+        "total_savings": float(row.total_savings or 0),
+        "elapsed_seconds": None,
+        "customers_per_second": None,
+        "actions_per_second": None,
+    }
+    if run.started_at:
+        elapsed = (run.finished_at or datetime.now(timezone.utc)) - run.started_at
+        seconds = max(elapsed.total_seconds(), 1e-6)
+        progress["elapsed_seconds"] = seconds
+        progress["customers_per_second"] = progress["customers_done"] / seconds
+        progress["actions_per_second"] = progress["action_count"] / seconds
+    return progress
+
+
+async def _report_totals(
+    db: AsyncSession, customer_id: str, month: date, start: datetime, end: datetime
+) -> dict:
+    # a closed month is answered from the rollups when they have it
+    totals = None
+    if closed_month_range(start, end):
+        totals = await rollup_billing_report(db, customer_id, month, month)
+    if totals is None:
+        totals = await aggregate_billing_report(
+            db, customer_id, start, end, DedupWindows.MONTH
+        )
+    return totals
+
+
+async def _has_billed_actions(
+    db: AsyncSession, customer_id: str, start: datetime, end: datetime
+) -> bool:
+    result = await db.execute(
+        select(Action.id)
+        .where(
+            Action.customer_id == customer_id,
+            Action.created_at >= start,
+            Action.created_at <= end,
+            Action.billing_report_id.is_not(None),
+        )
+        .limit(1)
+    )
+    return result.first() is not None
+
+
+async def bill_next_customer(db: AsyncSession, run: BillingRun) -> bool:
+    """Bill one pending customer of ``run``; False once none is left to claim.
+
+    Customers claimed by other workers are skipped, not waited for.
+    """
+    claimed = (
+        await db.execute(
+            select(BillingRunCustomer)
+            .where(
+                BillingRunCustomer.run_id == run.id,
+                BillingRunCustomer.status == BillingRunCustomerStatus.PENDING,
+            )
+            .order_by(BillingRunCustomer.customer_id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+    ).scalar_one_or_none()
+    if claimed is None:
+        await db.rollback()
+        return False
+
+    customer_id = claimed.customer_id
+    start, end = month_period(run.month)
+    try:
+        if run.incremental:
+            bill = await price_unbilled_actions(db, customer_id, end)
+            totals = bill.totals
+        elif await _has_billed_actions(db, customer_id, start, end):
+            # the month's totals would count what is on reports already
+            bill = await price_unbilled_actions(db, customer_id, end, start)
+            totals = bill.totals
+        else:
+            bill = None
+            totals = await _report_totals(db, customer_id, run.month, start, end)
+        if totals["action_count"]:
+            report = BillingReport(
+                id=str(uuid4()),
+                customer_id=customer_id,
+                total_billed_amount=totals["total_billed_amount"],
+                savings_amount=totals["total_savings"],
+                period_start=start,
+                period_end=end,
+            )
+            db.add(report)
+            await db.flush()
+            if bill is not None:
+                await save_incremental_bill(db, customer_id, bill, report.id)
+            else:
+                linked = await db.execute(
+                    update(Action)
+                    .where(
+                        Action.customer_id == customer_id,
+                        Action.created_at >= start,
+                        Action.created_at <= end,
+                        Action.billing_report_id.is_(None),
+                    )
+                    .values(billing_report_id=report.id)
+                    .execution_options(synchronize_session=False)
+                )
+                # an incremental run billed some of them meanwhile; a retry
+                # bills what is left
+                if linked.rowcount != totals["action_count"]:
+                    raise RuntimeError("Actions were billed by another run")
+            claimed.billing_report_id = report.id
+        claimed.action_count = totals["action_count"]
+        claimed.status = BillingRunCustomerStatus.DONE
+        claimed.finished_at = datetime.now(timezone.utc)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(
+            "Billing run %s failed for customer %s: %s", run.id, customer_id, e
+        )
+        await db.execute(
+            update(BillingRunCustomer)
+            .where(
+                BillingRunCustomer.run_id == run.id,
+                BillingRunCustomer.customer_id == customer_id,
+                # another worker may have claimed and billed it meanwhile
+                BillingRunCustomer.status == BillingRunCustomerStatus.PENDING,
+            )
+            .values(
+                status=BillingRunCustomerStatus.FAILED,
+                error=str(e)[:255],
+                finished_at=datetime.now(timezone.utc),
+            )
+        )
+        await db.commit()
+    return True
+
+
+async def _billing_worker(session_factory: async_sessionmaker, run: BillingRun):
+    async with session_factory() as session:
+        while await bill_next_customer(session, run):
+            pass
+
+
+async def process_billing_run(
+    session_factory: async_sessionmaker,
+    run_id: str,
+    workers: int = BILLING_RUN_WORKERS,
+):
+    """Bill every pending customer of a run with ``workers`` concurrent workers."""
+    async with session_factory() as session:
+        run = await session.get(BillingRun, run_id)
+        run.status = BillingRunStatus.RUNNING
+        run.started_at = run.started_at or datetime.now(timezone.utc)
+        await session.commit()
+
+    await asyncio.gather(
+        *[_billing_worker(session_factory, run) for _ in range(workers)]
+    )
+
+    async with session_factory() as session:
+        run = await session.get(BillingRun, run_id, with_for_update=True)
+        statuses = set(
+            await session.scalars(
+                select(BillingRunCustomer.status)
+                .where(BillingRunCustomer.run_id == run_id)
+                .distinct()
+            )
+        )
+        # another process may still be finishing customers it claimed
+        if BillingRunCustomerStatus.PENDING not in statuses:
+            run.status = (
+                BillingRunStatus.FAILED
+                if BillingRunCustomerStatus.FAILED in statuses
+                else BillingRunStatus.COMPLETED
+            )
+            run.finished_at = datetime.now(timezone.utc)
+        await session.commit()
+    logger.info("~~**~~ Billing run %s finished: %s", run_id, run.status.value)
+
+
+def start_billing_run(
+    session_factory: async_sessionmaker,
+    run_id: str,
+    workers: int = BILLING_RUN_WORKERS,
+) -> asyncio.Task:
+    """Process a run in the background unless this process already is."""
+    task = _running_tasks.get(run_id)
+    if task is None or task.done():
+        task = asyncio.create_task(
+            process_billing_run(session_factory, run_id, workers)
+        )
+        _running_tasks[run_id] = task
+        task.add_done_callback(lambda _: _running_tasks.pop(run_id, None))
+    return task
+
+
+async def resume_billing_runs(
+    session_factory: async_sessionmaker, workers: int = BILLING_RUN_WORKERS
+) -> list[str]:
+    """Restart the runs left queued or running, e.g. by a crashed worker."""
+    async with session_factory() as session:
+        run_ids = list(
+            await session.scalars(
+                select(BillingRun.id).where(
+                    BillingRun.status.in_(
+                        [BillingRunStatus.QUEUED, BillingRunStatus.RUNNING]
+                    )
+                )
+            )
+        )
+    for run_id in run_ids:
+        start_billing_run(session_factory, run_id, workers)
+    return run_ids
@@ -0,0 +1,435 @@
+"""Incremental billing: price only actions not yet on a report.
+
+A full billing run reprices a customer's whole month. An incremental run
+selects the customer's actions with ``billing_report_id IS NULL`` up to the
+end of the month, late arrivals for months billed before included, and
+dedupes and caps them against what each month has billed so far: one
+``BillingDedupKey`` row per duplicate key billed and one ``BillingLeadTotal``
+row per lead. Only the rows of the keys and leads among the new actions are
+read, and only those that change are written back, along with the price,
+duplicate flag, status and report of every action, with one
+``UPDATE ... FROM (VALUES ...)`` per batch. A run thus costs time in
+proportion to what arrived since the last one.
+
+A ``BillingDedupState`` row marks a month's rows as complete and serializes
+runs billing that month. A month without one, e.g. billed by full runs only,
+gets its rows computed in the database from its actions already on reports,
+the first time an incremental run needs them.
+"""
+
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import Boolean, Date, DateTime, Numeric, String, any_, cast
+from sqlalchemy import bindparam, column, literal, select, tuple_
+from sqlalchemy import update, values
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.instrumentation import count_priced, span
+from app.crud.action_store import (
+    STORE_COLUMNS,
+    ActionStore,
+    BilledActions,
+    billed_statuses,
+    store_totals,
+)
+from app.crud.billing_engine import lead_totals_select, priced_actions_select
+from app.crud.billing_report_service import billing_cap, duplicate_mask
+from app.crud.billing_rollup_service import next_month
+from app.crud.reference_data_service import product_names
+from app.models import Action, BillingDedupKey, BillingDedupState, BillingLeadTotal
+from app.shared import (
+    BILLING_CAP,
+    ActionTypes,
+    BillableStatus,
+    DedupWindows,
+    EngagementLevelTypes,
+    LeadTypes,
+    price_actions,
+)
+
+actions_table = Action.__table__
+states_table = BillingDedupState.__table__
+keys_table = BillingDedupKey.__table__
+lead_totals_table = BillingLeadTotal.__table__
+
+# Rows per statement; five parameters each, well under asyncpg's 32767.
+WRITE_BATCH_SIZE = 5000
+
+# status column values are the enum member names
+_STATUS_NAMES = {member.value: member.name for member in BillableStatus}
+
+# code -> enum member
+_LEAD_TYPES = list(LeadTypes)
+_ACTION_TYPES = list(ActionTypes)
+_ENGAGEMENT_LEVELS = list(EngagementLevelTypes)
+
+_KEY_COLUMNS = ("product_id", "lead_type", "action_type", "engagement_level")
+
+
+class DedupState(NamedTuple):
+    """The keys and lead totals of one month that a batch of actions needs.
+
+    Keys are (product id, lead type, action type, engagement level).
+    """
+
+    duplicate_keys: set
+    lead_billed: dict
+
+
+class IncrementalBill(NamedTuple):
+    """Unbilled actions of a customer, priced, with the states they leave."""
+
+    ids: list[str]
+    created_ats: list[datetime]
+    billed: BilledActions
+    new_keys: list[tuple]  # (month, *key)
+    lead_totals: list[tuple]  # (month, lead id, billed), changed ones only
+    totals: dict
+
+
+def action_months(store: ActionStore) -> tuple[np.ndarray, list[date]]:
+    """Each action's month as a code, and the first day of each code's month."""
+    months, codes = np.unique(
+        store.actions["created_at"].astype("datetime64[M]"), return_inverse=True
+    )
+    return codes, months.astype(object).tolist()
+
+
+def duplicate_keys(store: ActionStore) -> list[tuple]:
+    actions = store.actions
+    return [
+        (
+            store.products[product],
+            _LEAD_TYPES[lead_type],
+            _ACTION_TYPES[action_type],
+            _ENGAGEMENT_LEVELS[engagement_level],
+        )
+        for product, lead_type, action_type, engagement_level in zip(
+            actions["product"].tolist(),
+            actions["lead_type"].tolist(),
+            actions["action_type"].tolist(),
+            actions["engagement_level"].tolist(),
+        )
+    ]
+
+
+def bill_against_states(
+    store: ActionStore, states: dict, cap: float = BILLING_CAP
+) -> BilledActions:
+    """Price, dedupe and cap one customer's actions after what was billed.
+
+    ``states`` has the ``DedupState`` of every month in the store, with at
+    least the keys and leads of its actions, and is updated with what is
+    billed here. Same rules as ``bill_actions`` with
+    monthly windows.
+    """
+    actions = store.actions
+    amount = price_actions(
+        actions["lead_type"], actions["action_type"], actions["engagement_level"]
+    )
+    if not len(store):
+        return BilledActions(amount, np.zeros(0, dtype=bool), np.zeros(0))
+
+    month_codes, months = action_months(store)
+    duplicate = duplicate_mask(
+        actions["product"],
+        actions["lead_type"],
+        actions["action_type"],
+        actions["engagement_level"],
+        month_codes,
+    )
+    # the first of each key in this batch may have been billed before
+    keys = duplicate_keys(store)
+    for row in np.flatnonzero(~duplicate).tolist():
+        billed_keys = states[months[month_codes[row]]].duplicate_keys
+        if keys[row] in billed_keys:
+            duplicate[row] = True
+        else:
+            billed_keys.add(keys[row])
+
+    groups = actions["lead"].astype(np.int64) * len(months) + month_codes
+    present = np.unique(groups).tolist()
+    spent = np.zeros(len(store.leads) * len(months))
+    for group in present:
+        lead_billed = states[months[group % len(months)]].lead_billed
+        spent[group] = lead_billed.get(store.leads[group // len(months)], 0.0)
+    capped = billing_cap(groups, np.where(duplicate, 0.0, amount), cap, spent)
+    for group, total in zip(present, spent[present].tolist()):
+        states[months[group % len(months)]].lead_billed[
+            store.leads[group // len(months)]
+        ] = total
+    return BilledActions(amount, duplicate, capped.billed)
+
+
+def unbilled_actions_select(
+    customer_id: str, end: datetime, start: Optional[datetime] = None
+):
+    """A customer's actions not on any report, up to ``end``, in billing order.
+
+    Locked: a run selecting them meanwhile skips those this one links.
+    """
+    criteria = [
+        actions_table.c.customer_id == customer_id,
+        actions_table.c.billing_report_id.is_(None),
+        actions_table.c.created_at <= end,
+    ]
+    if start:
+        criteria.append(actions_table.c.created_at >= start)
+    return (
+        select(actions_table.c.id, *STORE_COLUMNS)
+        .where(*criteria)
+        .order_by(actions_table.c.created_at, actions_table.c.id)
+        .with_for_update()
+    )
+
+
+async def seed_dedup_state(db: AsyncSession, customer_id: str, month: date):
+    """Write the key and lead total rows of a month from its actions on reports.
+
+    Same rules as the aggregate report query with a monthly window, computed
+    by the database; the month is billed in one window, so its actions on
+    reports are billed the way they were.
+    """
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+    billed = [
+        Action.customer_id == customer_id,
+        Action.created_at >= start,
+        Action.created_at < end,
+        Action.billing_report_id.is_not(None),
+    ]
+    month_value = literal(month, Date)
+    await db.execute(
+        pg_insert(BillingDedupKey)
+        .from_select(
+            ["customer_id", "month", *_KEY_COLUMNS],
+            select(
+                Action.customer_id,
+                month_value,
+                *(getattr(Action, name) for name in _KEY_COLUMNS),
+            )
+            .where(*billed)
+            .distinct(),
+        )
+        .on_conflict_do_nothing()
+    )
+    priced = priced_actions_select(*billed, dedup_window=DedupWindows.MONTH)
+    lead_totals = lead_totals_select(priced.subquery()).subquery()
+    await db.execute(
+        pg_insert(BillingLeadTotal)
+        .from_select(
+            ["customer_id", "month", "lead_id", "billed"],
+            select(
+                lead_totals.c.customer_id,
+                month_value,
+                lead_totals.c.lead_id,
+                lead_totals.c.billed,
+            ),
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+async def lock_dedup_states(db: AsyncSession, customer_id: str, months: list[date]):
+    """Lock the state of each of ``months``, seeding those that have none."""
+    created = await db.execute(
+        pg_insert(BillingDedupState)
+        .values([{"customer_id": customer_id, "month": month} for month in months])
+        .on_conflict_do_nothing()
+        .returning(states_table.c.month)
+    )
+    for month in sorted(created.scalars()):
+        await seed_dedup_state(db, customer_id, month)
+    await db.execute(
+        select(states_table.c.month)
+        .where(
+            states_table.c.customer_id == customer_id,
+            states_table.c.month.in_(months),
+        )
+        .with_for_update()
+    )
+
+
+async def load_dedup_states(
+    db: AsyncSession, customer_id: str, store: ActionStore
+) -> dict:
+    """The ``DedupState`` of each month in ``store``, locked.
+
+    Only the keys and leads of the store's actions are read.
+    """
+    month_codes, months = action_months(store)
+    if not months:
+        return {}
+    await lock_dedup_states(db, customer_id, months)
+    states = {month: DedupState(set(), {}) for month in months}
+
+    wanted = {
+        (months[code], *key)
+        for code, key in zip(month_codes.tolist(), duplicate_keys(store))
+    }
+    key_columns = [keys_table.c.month, *(keys_table.c[name] for name in _KEY_COLUMNS)]
+    result = await db.execute(
+        select(*key_columns).where(
+            keys_table.c.customer_id == customer_id,
+            tuple_(*key_columns).in_(list(wanted)),
+        )
+    )
+    for month, *key in result:
+        states[month].duplicate_keys.add(tuple(key))
+
+    result = await db.execute(
+        select(
+            lead_totals_table.c.month,
+            lead_totals_table.c.lead_id,
+            lead_totals_table.c.billed,
+        ).where(
+            lead_totals_table.c.customer_id == customer_id,
+            lead_totals_table.c.month.in_(months),
+            lead_totals_table.c.lead_id
+            == any_(bindparam("lead_ids", store.leads, type_=ARRAY(String))),
+        )
+    )
+    for month, lead_id, billed in result:
+        states[month].lead_billed[lead_id] = float(billed)
+    return states
+
+
+async def price_unbilled_actions(
+    db: AsyncSession, customer_id: str, end: datetime, start: Optional[datetime] = None
+) -> IncrementalBill:
+    """Price a customer's actions not yet on a report, up to ``end``."""
+    with span("load_unbilled_actions"):
+        rows = (
+            await db.execute(unbilled_actions_select(customer_id, end, start))
+        ).all()
+    store = ActionStore.from_rows([row[1:] for row in rows])
+    states = await load_dedup_states(db, customer_id, store)
+    loaded = {
+        month: (set(state.duplicate_keys), dict(state.lead_billed))
+        for month, state in states.items()
+    }
+    with span("bill_actions"):
+        billed = bill_against_states(store, states)
+    count_priced("incremental", len(store))
+    names = await product_names(db, store.products)
+
+    new_keys, lead_totals = [], []
+    for month, state in states.items():
+        keys, lead_billed = loaded[month]
+        new_keys.extend((month, *key) for key in state.duplicate_keys - keys)
+        lead_totals.extend(
+            (month, lead_id, total)
+            for lead_id, total in state.lead_billed.items()
+            if lead_billed.get(lead_id) != total
+        )
+    return IncrementalBill(
+        [row.id for row in rows],
+        [row.created_at for row in rows],
+        billed,
+        new_keys,
+        lead_totals,
+        store_totals(store, billed, names),
+    )
+
+
+def billed_actions_update(rows: list[tuple], report_id: str):
+    """Write back priced actions and link them to ``report_id``.
+
+    ``rows`` are (id, created_at, cost_amount, is_duplicate, status name),
+    sent as one ``UPDATE actions ... FROM (VALUES ...)``.
+    """
+    billed = values(
+        column("id", String),
+        column("created_at", DateTime),
+        column("cost_amount", Numeric),
+        column("is_duplicate", Boolean),
+        column("status", String),
+        name="billed",
+    ).data(rows)
+    return (
+        update(actions_table)
+        .where(
+            actions_table.c.id == billed.c.id,
+            # lets the planner prune partitions
+            actions_table.c.created_at == billed.c.created_at,
+            actions_table.c.billing_report_id.is_(None),
+        )
+        .values(
+            cost_amount=billed.c.cost_amount,
+            is_duplicate=billed.c.is_duplicate,
+            status=cast(billed.c.status, actions_table.c.status.type),
+            billing_report_id=report_id,
+        )
+    )
+
+
+async def save_dedup_states(db: AsyncSession, customer_id: str, bill: IncrementalBill):
+    """Insert the keys ``bill`` billed first and upsert the lead totals it moved."""
+    for start in range(0, len(bill.new_keys), WRITE_BATCH_SIZE):
+        await db.execute(
+            pg_insert(BillingDedupKey)
+            .values(
+                [
+                    {
+                        "customer_id": customer_id,
+                        "month": month,
+                        **dict(zip(_KEY_COLUMNS, key)),
+                    }
+                    for month, *key in bill.new_keys[start : start + WRITE_BATCH_SIZE]
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+    for start in range(0, len(bill.lead_totals), WRITE_BATCH_SIZE):
+        statement = pg_insert(BillingLeadTotal).values(
+            [
+                {
+                    "customer_id": customer_id,
+                    "month": month,
+                    "lead_id": lead_id,
+                    "billed": total,
+                }
+                for month, lead_id, total in bill.lead_totals[
+                    start : start + WRITE_BATCH_SIZE
+                ]
+            ]
+        )
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[
+                    BillingLeadTotal.customer_id,
+                    BillingLeadTotal.month,
+                    BillingLeadTotal.lead_id,
+                ],
+                # the month's state is locked, see lock_dedup_states
+                set_={"billed": statement.excluded.billed},
+            )
+        )
+
+
+async def save_incremental_bill(
+    db: AsyncSession, customer_id: str, bill: IncrementalBill, report_id: str
+):
+    """Write back what ``bill`` priced and link it to ``report_id``.
+
+    Leaves committing to the caller, with the report.
+    """
+    statuses = [_STATUS_NAMES[status] for status in billed_statuses(bill.billed)]
+    rows = list(
+        zip(
+            bill.ids,
+            bill.created_ats,
+            bill.billed.amount.tolist(),
+            bill.billed.duplicate.tolist(),
+            statuses,
+        )
+    )
+    with span("write_billed_actions"):
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            await db.execute(
+                billed_actions_update(rows[start : start + WRITE_BATCH_SIZE], report_id)
+            )
+    await save_dedup_states(db, customer_id, bill)
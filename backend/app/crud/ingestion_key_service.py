@@ -0,0 +1,154 @@
+"""Idempotent lead ingestion.
+
+``ingestion_keys`` holds two kinds of key, both sha256 digests:
+
+* request keys, of a client's ``Idempotency-Key`` header, with a hash of the
+  payload and the results returned for it. A retry of the request gets the
+  same results back and ingests nothing.
+* lead keys, of a lead's id and content. A retry that sends a lead again is
+  rejected rather than billed twice; distinct leads with equal fields have
+  distinct ids, so both are ingested. A retry under a new id is caught only
+  by its request key. Action events (see app.crud.lead_event_service) have
+  keys of their content too.
+
+All keys of a request are looked up with one ``SELECT ... WHERE key =
+ANY(:keys)``, and written in the transaction that ingests the leads. Keys
+expire after ``IDEMPOTENCY_KEY_TTL`` seconds and are then purged.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from sqlalchemy import any_, bindparam, delete, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models import IngestionKey
+from app.schemas import ActionCreate, LeadCreate
+
+# Rows per multi-row INSERT, as in app.crud.leads_service.
+KEY_BATCH_SIZE = 5000
+
+
+class IdempotencyKeyReused(ValueError):
+    """An Idempotency-Key sent again with a different payload."""
+
+
+def _digest(kind: str, content: str) -> str:
+    return hashlib.sha256(f"{kind}:{content}".encode()).hexdigest()
+
+
+def request_key(idempotency_key: str) -> str:
+    return _digest("request", idempotency_key)
+
+
+def payload_hash(leads: List[LeadCreate]) -> str:
+    return _digest(
+        "payload",
+        json.dumps([lead.model_dump(mode="json") for lead in leads], sort_keys=True),
+    )
+
+
+def lead_content_key(lead: LeadCreate) -> str:
+    """Same for the same lead sent again under its id."""
+    content = lead.model_dump(mode="json")
+    return _digest("lead", json.dumps(content, sort_keys=True))
+
+
+def action_content_key(action: ActionCreate) -> str:
+    """Same for the same action of a lead sent again."""
+    return _digest("action", json.dumps(action.model_dump(mode="json"), sort_keys=True))
+
+
+def _utc_now() -> datetime:
+    # expires_at is TIMESTAMP WITHOUT TIME ZONE, in UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def ingestion_keys_query(keys: list[str], now: datetime):
+    """Unexpired keys among ``keys``, bound as one array parameter."""
+    keys_param = bindparam("keys", keys, type_=ARRAY(IngestionKey.key.type))
+    return select(
+        IngestionKey.key,
+        IngestionKey.lead_id,
+        IngestionKey.content_hash,
+        IngestionKey.response,
+    ).where(IngestionKey.key == any_(keys_param), IngestionKey.expires_at > now)
+
+
+async def find_ingestion_keys(db: AsyncSession, keys: Iterable[str]) -> dict:
+    """Unexpired rows of ``keys``, by key."""
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    result = await db.execute(ingestion_keys_query(keys, _utc_now()))
+    return {row.key: row for row in result}
+
+
+def replayed_results(row, leads: List[LeadCreate]) -> list[dict]:
+    """The results stored with a request key, if the payload is the same."""
+    if row.content_hash != payload_hash(leads):
+        raise IdempotencyKeyReused(
+            "Idempotency-Key was already used with a different payload"
+        )
+    return json.loads(row.response)
+
+
+def lead_key_rows(lead_keys: dict[str, str]) -> list[dict]:
+    """Rows for leads just ingested, from their content keys to their ids."""
+    expires_at = _utc_now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    return [
+        {
+            "key": key,
+            "lead_id": lead_id,
+            "content_hash": None,
+            "response": None,
+            "expires_at": expires_at,
+        }
+        for key, lead_id in lead_keys.items()
+    ]
+
+
+def request_key_row(
+    idempotency_key: str, leads: List[LeadCreate], results: list[dict]
+) -> dict:
+    return {
+        "key": request_key(idempotency_key),
+        "lead_id": None,
+        "content_hash": payload_hash(leads),
+        "response": json.dumps(results),
+        "expires_at": _utc_now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    }
+
+
+async def save_ingestion_keys(db: AsyncSession, rows: list[dict]):
+    """Insert key rows; an expired row with the same key is replaced."""
+    for start in range(0, len(rows), KEY_BATCH_SIZE):
+        batch = rows[start : start + KEY_BATCH_SIZE]
+        statement = pg_insert(IngestionKey).values(batch)
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[IngestionKey.key],
+                set_={
+                    "lead_id": statement.excluded.lead_id,
+                    "content_hash": statement.excluded.content_hash,
+                    "response": statement.excluded.response,
+                    "expires_at": statement.excluded.expires_at,
+                },
+                where=IngestionKey.expires_at <= _utc_now(),
+            )
+        )
+
+
+async def purge_ingestion_keys(
+    db: AsyncSession, now: Optional[datetime] = None
+) -> int:
+    """Delete expired keys; returns how many."""
+    result = await db.execute(
+        delete(IngestionKey).where(IngestionKey.expires_at <= (now or _utc_now()))
+    )
+    await db.commit()
+    return result.rowcount
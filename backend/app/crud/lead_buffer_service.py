@@ -0,0 +1,67 @@
+"""Leads accepted at once by POST /leads/async and written in micro-batches.
+
+See app.core.ingestion_buffer. Each batch goes through ``bulk_save_leads``
+like a synchronous request; as no response is left to report them in, the
+leads it rejects are logged. Ingestion is idempotent on lead id and
+content, so a batch replayed from the spill log after a crash is not billed
+twice.
+"""
+
+import logging
+
+from pydantic import ValidationError
+
+from app.config import settings
+from app.core.database import async_session
+from app.core.ingestion_buffer import IngestionBuffer
+from app.crud.leads_service import bulk_save_leads
+from app.schemas import LeadCreate
+
+logger = logging.getLogger(__name__)
+
+# rejections logged per batch
+LOGGED_REJECTIONS = 20
+
+
+def lead_rows(record: dict) -> int:
+    """A lead counts for its own row and one per action."""
+    return 1 + len(record.get("actions", ()))
+
+
+async def ingest_lead_batch(records: list[dict]):
+    leads = []
+    for record in records:
+        try:
+            leads.append(LeadCreate.model_validate(record))
+        except ValidationError as e:
+            # cannot succeed on a retry either
+            logger.error("Dropping unreadable buffered lead: %s", e)
+    if not leads:
+        return
+
+    async with async_session() as session:
+        # a RuntimeError leaves the batch to be retried
+        results = await bulk_save_leads(leads, session)
+
+    rejected = [result for result in results if not result["accepted"]]
+    if rejected:
+        logger.warning(
+            "%s of %s buffered leads rejected: %s",
+            len(rejected),
+            len(results),
+            "; ".join(
+                f"{result['id']}: {result['reason']}"
+                for result in rejected[:LOGGED_REJECTIONS]
+            ),
+        )
+
+
+lead_buffer = IngestionBuffer(
+    ingest_lead_batch,
+    settings.INGEST_BUFFER_PATH,
+    max_rows=settings.INGEST_BATCH_ROWS,
+    max_delay=settings.INGEST_BATCH_DELAY,
+    max_pending_rows=settings.INGEST_BUFFER_MAX_ROWS,
+    rows=lead_rows,
+    fsync=settings.INGEST_BUFFER_FSYNC,
+)
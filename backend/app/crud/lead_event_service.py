@@ -0,0 +1,187 @@
+"""Leads and actions consumed as events from an SQS queue.
+
+Producers send one event per message, as JSON::
+
+    {"type": "lead", "data": {...LeadCreate...}}
+    {"type": "action", "data": {...ActionCreate...}}
+
+``LeadEventConsumer`` long-polls the queue (see app.core.message_queue) from
+``concurrency`` tasks. Each collects up to ``batch_size`` messages, writes
+their leads with ``bulk_save_leads`` and then their actions with
+``bulk_save_actions``, and deletes the messages that were written. While a
+batch is being written its messages are kept invisible to other consumers.
+
+What happens to a message:
+
+* written, or rejected as already ingested: deleted. SQS delivers at least
+  once, and ingestion is idempotent on lead id and content.
+* action of a lead not ingested yet: left for redelivery, as events are not
+  ordered.
+* unreadable, rejected, or delivered more than ``max_receives`` times:
+  moved to the dead-letter queue with the reason.
+* batch failed to write: left for redelivery.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Union
+
+from pydantic import ValidationError
+
+from app.core.instrumentation import LEAD_EVENT_BATCH_SECONDS, LEAD_EVENTS
+from app.core.message_queue import Message
+from app.crud.leads_service import bulk_save_actions, bulk_save_leads
+from app.schemas import ActionCreate, LeadCreate
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = {"lead": LeadCreate, "action": ActionCreate}
+
+
+def parse_lead_event(body: str) -> Union[LeadCreate, ActionCreate]:
+    """The lead or action in a message body; ValueError if there is none."""
+    try:
+        event = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Not JSON: {e}") from e
+    if not isinstance(event, dict) or event.get("type") not in EVENT_TYPES:
+        raise ValueError("Not a lead or action event")
+    try:
+        return EVENT_TYPES[event["type"]].model_validate(event.get("data"))
+    except ValidationError as e:
+        raise ValueError(f"Invalid {event['type']}: {e}") from e
+
+
+def _already_ingested(reason: str) -> bool:
+    return reason.startswith("Duplicate") or reason == "Lead already exists"
+
+
+class LeadEventConsumer:
+    def __init__(
+        self,
+        queue,
+        session_factory,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        wait_seconds: float = 20,
+        visibility_timeout: int = 30,
+        max_receives: int = 5,
+    ):
+        self.queue = queue
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self._stopping = False
+
+    def stop(self):
+        """Finish the batches being written and return from ``run``."""
+        self._stopping = True
+
+    async def run(self):
+        logger.info(
+            "Consuming lead events with %s tasks, up to %s messages a batch",
+            self.concurrency,
+            self.batch_size,
+        )
+        await asyncio.gather(*(self._consume() for _ in range(self.concurrency)))
+
+    async def _consume(self):
+        while not self._stopping:
+            try:
+                messages = await self._receive_batch()
+                if messages:
+                    await self.process(messages)
+            except Exception as e:
+                # the queue is unreachable; receive again after a pause
+                logger.error("Lead event consumer failed: %s", e)
+                await asyncio.sleep(1)
+
+    async def _receive_batch(self) -> list[Message]:
+        """Long-poll for the first messages, then take what is already there."""
+        messages = await self.queue.receive(
+            self.batch_size, self.wait_seconds, self.visibility_timeout
+        )
+        while messages and len(messages) < self.batch_size and not self._stopping:
+            more = await self.queue.receive(
+                self.batch_size - len(messages), 0, self.visibility_timeout
+            )
+            if not more:
+                break
+            messages.extend(more)
+        return messages
+
+    async def _heartbeat(self, messages: list[Message]):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            await self.queue.extend(messages, self.visibility_timeout)
+
+    async def process(self, messages: list[Message]):
+        """Write one batch of messages and settle each of them."""
+        started = time.perf_counter()
+        heartbeat = asyncio.create_task(self._heartbeat(messages))
+        try:
+            done, dead, reasons = await self._write(messages)
+        finally:
+            heartbeat.cancel()
+        if done:
+            await self.queue.delete(done)
+        if dead:
+            for message, reason in zip(dead, reasons):
+                logger.warning("Dead-lettering lead event %s: %s", message.id, reason)
+            await self.queue.dead_letter(dead, reasons)
+            LEAD_EVENTS.labels("dead_lettered").inc(len(dead))
+        LEAD_EVENT_BATCH_SECONDS.observe(time.perf_counter() - started)
+
+    async def _write(self, messages: list[Message]):
+        """Messages to delete, and messages to dead-letter with reasons."""
+        done, dead, reasons = [], [], []
+        leads, actions = [], []
+        for message in messages:
+            if message.receive_count > self.max_receives:
+                dead.append(message)
+                reasons.append(f"Delivered {message.receive_count} times")
+                continue
+            try:
+                event = parse_lead_event(message.body)
+            except ValueError as e:
+                dead.append(message)
+                reasons.append(str(e))
+                continue
+            (leads if isinstance(event, LeadCreate) else actions).append(
+                (message, event)
+            )
+
+        try:
+            async with self.session_factory() as session:
+                lead_results = await self._save(bulk_save_leads, leads, session)
+                action_results = await self._save(bulk_save_actions, actions, session)
+        except RuntimeError as e:
+            logger.error("Writing %s lead events failed: %s", len(messages), e)
+            LEAD_EVENTS.labels("retried").inc(len(leads) + len(actions))
+            return [], dead, reasons
+
+        for (message, _), result in zip(leads + actions, lead_results + action_results):
+            reason: Optional[str] = result["reason"]
+            if result["accepted"]:
+                done.append(message)
+                LEAD_EVENTS.labels("ingested").inc()
+            elif _already_ingested(reason):
+                done.append(message)
+                LEAD_EVENTS.labels("duplicate").inc()
+            elif reason.startswith("Unknown lead"):
+                LEAD_EVENTS.labels("retried").inc()
+            else:
+                dead.append(message)
+                reasons.append(reason)
+        return done, dead, reasons
+
+    @staticmethod
+    async def _save(save, events: list, session) -> list[dict]:
+        if not events:
+            return []
+        return await save([event for _, event in events], session)
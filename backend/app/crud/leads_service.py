@@ -1,28 +1,442 @@
+import base64
+import binascii
+import json
 from fastapi import HTTPException, Depends
+from sqlalchemy import select, insert, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Annotated
+from datetime import datetime, timezone
+from typing import Annotated, List, Optional
+from uuid import uuid4
 from app.schemas import LeadCreate, Lead, Action, ActionCreate
 from app.core.database import get_async_session
+from app.core.instrumentation import INGESTION_REPLAYS
+from app.crud.billing_rollup_service import add_to_billing_rollups
+from app.crud.ingestion_key_service import (
+    action_content_key,
+    find_ingestion_keys,
+    lead_content_key,
+    lead_key_rows,
+    replayed_results,
+    request_key,
+    request_key_row,
+    save_ingestion_keys,
+)
+from app.crud.reference_data_service import get_customers, get_products
 import app.models as models
-from app.shared import LEAD_ACTION_COSTS
+from app.shared import (
+    LEAD_ACTION_COSTS,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    calculate_action_value,
+    encode,
+    price_actions,
+)
 
+# Rows per multi-row INSERT statement, keeping each one well under asyncpg's
+# limit of 32767 bind parameters.
+INSERT_BATCH_SIZE = 5000
 
-def calculate_action_value(lead_type, action_type, engagement_level):
+# Default and largest page of GET /leads.
+LEADS_PAGE_SIZE = 100
+MAX_LEADS_PAGE_SIZE = 1000
 
-    if result in LEAD_ACTION_COSTS.get(lead_type, {}):
-        action_costs = LEAD_ACTION_COSTS[source]
-        if isinstance(action_costs, dict):
-            cost = action_costs.get(result, 0)
-        return cost
-    return 0
+LEAD_COLUMNS = tuple(
+    models.Lead.__table__.c[name]
+    for name in ("id", "lead_type", "customer_id", "product_id", "created_at")
+)
+ACTION_COLUMNS = tuple(
+    models.Action.__table__.c[name]
+    for name in (
+        "id",
+        "lead_id",
+        "customer_id",
+        "product_id",
+        "lead_type",
+        "action_type",
+        "engagement_level",
+        "created_at",
+        "cost_amount",
+        "is_duplicate",
+        "status",
+        "billing_report_id",
+    )
+)
+
+ACTION_COPY_COLUMNS = (
+    "id",
+    "lead_id",
+    "customer_id",
+    "product_id",
+    "lead_type",
+    "action_type",
+    "engagement_level",
+    "created_at",
+    "cost_amount",
+)
 
 
 # LEADS
 
 
-# FIXME: this function is not implemented yet
-async def get_leads_from_db():
-    pass
+def encode_lead_cursor(created_at: datetime, lead_id: str) -> str:
+    """Opaque cursor pointing just after a lead in ``(created_at, id)`` order."""
+    position = json.dumps([created_at.isoformat(), lead_id])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_lead_cursor(cursor: str) -> tuple[datetime, str]:
+    """Inverse of ``encode_lead_cursor``; raises ValueError on a bad cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, lead_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(lead_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def leads_page_query(
+    customer_id: Optional[str] = None,
+    product_id: Optional[str] = None,
+    lead_type: Optional[str] = None,
+    after: Optional[tuple[datetime, str]] = None,
+    limit: int = LEADS_PAGE_SIZE,
+):
+    """Keyset page of lead columns in ``(created_at, id)`` order.
+
+    Selects one row past ``limit``, which tells whether another page follows.
+    """
+    leads = models.Lead.__table__
+    query = select(*LEAD_COLUMNS)
+    if customer_id:
+        query = query.where(leads.c.customer_id == customer_id)
+    if product_id:
+        query = query.where(leads.c.product_id == product_id)
+    if lead_type:
+        query = query.where(leads.c.lead_type == lead_type)
+    if after:
+        query = query.where(tuple_(leads.c.created_at, leads.c.id) > tuple_(*after))
+    return query.order_by(leads.c.created_at, leads.c.id).limit(limit + 1)
+
+
+async def actions_by_lead(db: AsyncSession, lead_ids: list) -> dict:
+    actions = models.Action.__table__
+    result = await db.execute(
+        select(*ACTION_COLUMNS)
+        .where(actions.c.lead_id.in_(lead_ids))
+        .order_by(actions.c.created_at, actions.c.id)
+    )
+    grouped = {lead_id: [] for lead_id in lead_ids}
+    for row in result.mappings():
+        grouped[row["lead_id"]].append(dict(row))
+    return grouped
+
+
+async def get_leads_from_db(
+    db: AsyncSession,
+    customer_id: Optional[str] = None,
+    product_id: Optional[str] = None,
+    lead_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = LEADS_PAGE_SIZE,
+    include_actions: bool = False,
+) -> tuple[list[dict], Optional[str]]:
+    """One page of leads as dicts, and the cursor of the next page if any.
+
+    Leads are read as plain column rows; ``actions`` is None unless
+    ``include_actions``, in which case one more query fetches the actions of
+    the whole page.
+    """
+    after = decode_lead_cursor(cursor) if cursor else None
+    result = await db.execute(
+        leads_page_query(customer_id, product_id, lead_type, after, limit)
+    )
+    leads = [dict(row) for row in result.mappings()]
+    next_cursor = None
+    if len(leads) > limit:
+        leads = leads[:limit]
+        next_cursor = encode_lead_cursor(leads[-1]["created_at"], leads[-1]["id"])
+
+    actions = {}
+    if include_actions and leads:
+        actions = await actions_by_lead(db, [lead["id"] for lead in leads])
+    for lead in leads:
+        lead["actions"] = actions.get(lead["id"], []) if include_actions else None
+    return leads, next_cursor
+
+
+def _utc_naive(value: datetime) -> datetime:
+    # actions.created_at is TIMESTAMP WITHOUT TIME ZONE
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def validate_lead(
+    lead: LeadCreate, customer_ids: set, product_ids: set, seen_lead_ids: set
+) -> Optional[str]:
+    """Return why a lead cannot be ingested, or None if it can."""
+    if lead.id in seen_lead_ids:
+        return "Duplicate lead id in payload"
+    if lead.customer_id not in customer_ids:
+        return f"Unknown customer {lead.customer_id}"
+    if lead.product_id not in product_ids:
+        return f"Unknown product {lead.product_id}"
+    billable_actions = LEAD_ACTION_COSTS.get(lead.lead_type, {})
+    for action in lead.actions:
+        if action.action_type not in billable_actions:
+            return (
+                f"Action type {action.action_type.value} is not billable "
+                f"for lead type {lead.lead_type.value}"
+            )
+    return None
+
+
+def price_action_rows(rows: list[dict]) -> list[dict]:
+    """Set the ``cost_amount`` of ``actions`` rows from their types."""
+    cost_amounts = price_actions(
+        encode((row["lead_type"] for row in rows), LEAD_TYPE_CODES),
+        encode((row["action_type"] for row in rows), ACTION_TYPE_CODES),
+        encode((row["engagement_level"] for row in rows), ENGAGEMENT_LEVEL_CODES),
+    ).tolist()
+    for row, cost_amount in zip(rows, cost_amounts):
+        row["cost_amount"] = cost_amount
+    return rows
+
+
+def build_action_rows(leads: List[LeadCreate]) -> list[dict]:
+    """Flatten the actions of accepted leads into priced ``actions`` rows."""
+    return price_action_rows(
+        [
+            {
+                "id": str(uuid4()),
+                "lead_id": lead.id,
+                "customer_id": lead.customer_id,
+                "product_id": lead.product_id,
+                "lead_type": lead.lead_type,
+                "action_type": action.action_type,
+                "engagement_level": action.engagement_level,
+                "created_at": _utc_naive(action.created_at),
+            }
+            for lead in leads
+            for action in lead.actions
+        ]
+    )
+
+
+async def _insert_leads(leads: List[LeadCreate], db: AsyncSession) -> set:
+    """Multi-row INSERT ... ON CONFLICT DO NOTHING; returns the ids written."""
+    inserted = set()
+    for start in range(0, len(leads), INSERT_BATCH_SIZE):
+        rows = [
+            {
+                "id": lead.id,
+                "customer_id": lead.customer_id,
+                "product_id": lead.product_id,
+                "lead_type": lead.lead_type,
+                "created_at": lead.created_at,
+            }
+            for lead in leads[start : start + INSERT_BATCH_SIZE]
+        ]
+        statement = (
+            pg_insert(models.Lead)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[models.Lead.id])
+            .returning(models.Lead.id)
+        )
+        result = await db.execute(statement)
+        inserted.update(result.scalars().all())
+    return inserted
+
+
+async def _write_action_rows(action_rows: list[dict], db: AsyncSession):
+    """Insert actions and count them into the rollups of their months."""
+    await _insert_actions(action_rows, db)
+    await add_to_billing_rollups(db, action_rows)
+
+
+async def _insert_actions(action_rows: list[dict], db: AsyncSession):
+    connection = await db.connection()
+    if connection.dialect.driver != "asyncpg":
+        await db.execute(insert(models.Action), action_rows)
+        return
+
+    # COPY runs on the same connection, inside the open transaction.
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        models.Action.__tablename__,
+        columns=ACTION_COPY_COLUMNS,
+        records=[
+            (
+                row["id"],
+                row["lead_id"],
+                row["customer_id"],
+                row["product_id"],
+                # enum columns store member names
+                row["lead_type"].name,
+                row["action_type"].name,
+                row["engagement_level"].name,
+                row["created_at"],
+                row["cost_amount"],
+            )
+            for row in action_rows
+        ],
+    )
+
+
+async def bulk_save_leads(
+    leads: List[LeadCreate],
+    db: AsyncSession,
+    idempotency_key: Optional[str] = None,
+) -> list[dict]:
+    """Validate, price and write a batch of leads and actions in one transaction.
+
+    Returns one accept/reject result per lead, in payload order. A request
+    retried with the same ``idempotency_key`` gets its first results back,
+    and a lead already ingested with the same id and content is rejected; see
+    app.crud.ingestion_key_service.
+    """
+    customer_ids = {lead.customer_id for lead in leads}
+    product_ids = {lead.product_id for lead in leads}
+    content_keys = [lead_content_key(lead) for lead in leads]
+    replay_key = request_key(idempotency_key) if idempotency_key else None
+    try:
+        # the request key and every lead key in one query
+        lookup = content_keys + [replay_key] if replay_key else content_keys
+        keys = await find_ingestion_keys(db, lookup)
+        if replay_key in keys:
+            INGESTION_REPLAYS.labels("request").inc()
+            return replayed_results(keys[replay_key], leads)
+
+        known_customers = set(await get_customers(db, customer_ids))
+        known_products = set(await get_products(db, product_ids))
+
+        reasons = []
+        seen_lead_ids = set()
+        candidates = []
+        for lead, content_key in zip(leads, content_keys):
+            reason = validate_lead(lead, known_customers, known_products, seen_lead_ids)
+            seen_lead_ids.add(lead.id)
+            if reason is None and content_key in keys:
+                INGESTION_REPLAYS.labels("lead").inc()
+                reason = f"Duplicate of lead {keys[content_key].lead_id}"
+            reasons.append(reason)
+            if reason is None:
+                candidates.append(lead)
+
+        inserted = await _insert_leads(candidates, db) if candidates else set()
+        accepted = [lead for lead in candidates if lead.id in inserted]
+        action_rows = build_action_rows(accepted)
+        if action_rows:
+            await _write_action_rows(action_rows, db)
+
+        results = []
+        for lead, reason in zip(leads, reasons):
+            if reason is None and lead.id not in inserted:
+                reason = "Lead already exists"
+            if reason is None:
+                results.append(
+                    {"id": lead.id, "accepted": True, "action_count": len(lead.actions)}
+                )
+            else:
+                results.append({"id": lead.id, "accepted": False, "reason": reason})
+
+        key_rows = lead_key_rows(
+            {
+                content_key: lead.id
+                for lead, content_key in zip(leads, content_keys)
+                if lead.id in inserted
+            }
+        )
+        if idempotency_key:
+            key_rows.append(request_key_row(idempotency_key, leads, results))
+        await save_ingestion_keys(db, key_rows)
+
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise RuntimeError(str(e.__cause__ or e)) from e
+
+    return results
+
+
+def validate_action(action: ActionCreate, lead) -> Optional[str]:
+    """Return why an action of an ingested ``lead`` cannot be ingested, or None."""
+    if lead is None:
+        return f"Unknown lead {action.lead_id}"
+    if (action.customer_id, action.product_id, action.lead_type) != (
+        lead.customer_id,
+        lead.product_id,
+        lead.lead_type,
+    ):
+        return f"Action does not match lead {action.lead_id}"
+    if action.action_type not in LEAD_ACTION_COSTS.get(action.lead_type, {}):
+        return (
+            f"Action type {action.action_type.value} is not billable "
+            f"for lead type {action.lead_type.value}"
+        )
+    return None
+
+
+async def bulk_save_actions(actions: List[ActionCreate], db: AsyncSession) -> list:
+    """Write actions of leads ingested earlier, in one transaction.
+
+    Returns one accept/reject result per action, in order. Actions carry no
+    id, so one already ingested is recognised by its content.
+    """
+    content_keys = [action_content_key(action) for action in actions]
+    leads = models.Lead.__table__
+    try:
+        ingested = await find_ingestion_keys(db, content_keys)
+        result = await db.execute(
+            select(
+                leads.c.id, leads.c.customer_id, leads.c.product_id, leads.c.lead_type
+            ).where(leads.c.id.in_({action.lead_id for action in actions}))
+        )
+        known_leads = {row.id: row for row in result}
+
+        reasons = []
+        accepted_keys = {}
+        for action, content_key in zip(actions, content_keys):
+            reason = validate_action(action, known_leads.get(action.lead_id))
+            if reason is None and (
+                content_key in ingested or content_key in accepted_keys
+            ):
+                reason = "Duplicate action"
+            reasons.append(reason)
+            if reason is None:
+                accepted_keys[content_key] = action.lead_id
+
+        action_rows = price_action_rows(
+            [
+                {
+                    "id": str(uuid4()),
+                    "lead_id": action.lead_id,
+                    "customer_id": action.customer_id,
+                    "product_id": action.product_id,
+                    "lead_type": action.lead_type,
+                    "action_type": action.action_type,
+                    "engagement_level": action.engagement_level,
+                    "created_at": _utc_naive(action.created_at),
+                }
+                for action, reason in zip(actions, reasons)
+                if reason is None
+            ]
+        )
+        if action_rows:
+            await _write_action_rows(action_rows, db)
+        await save_ingestion_keys(db, lead_key_rows(accepted_keys))
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise RuntimeError(str(e.__cause__ or e)) from e
+
+    return [
+        {"lead_id": action.lead_id, "accepted": reason is None, "reason": reason}
+        for action, reason in zip(actions, reasons)
+    ]
 
 
 async def save_lead_in_database(
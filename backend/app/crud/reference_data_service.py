@@ -0,0 +1,68 @@
+"""Customer and product lookups by id, through the reference cache.
+
+Anything that changes a customer or product must call ``invalidate_customers``
+or ``invalidate_products`` once the change is committed.
+"""
+
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.reference_cache import reference_cache
+from app.models import Customer, Product
+
+CUSTOMERS = "customer"
+PRODUCTS = "product"
+
+
+class CustomerRef(NamedTuple):
+    id: str
+    name: str
+    email: str
+
+
+class ProductRef(NamedTuple):
+    id: str
+    name: str
+
+
+async def get_customers(db: AsyncSession, customer_ids) -> dict[str, CustomerRef]:
+    async def load(missing: list) -> dict:
+        result = await db.execute(
+            select(Customer.id, Customer.name, Customer.email).where(
+                Customer.id.in_(missing)
+            )
+        )
+        return {row.id: tuple(row) for row in result}
+
+    found = await reference_cache.get_many(CUSTOMERS, customer_ids, load)
+    return {id: CustomerRef(*value) for id, value in found.items()}
+
+
+async def get_customer(db: AsyncSession, customer_id: str) -> Optional[CustomerRef]:
+    return (await get_customers(db, [customer_id])).get(customer_id)
+
+
+async def get_products(db: AsyncSession, product_ids) -> dict[str, ProductRef]:
+    async def load(missing: list) -> dict:
+        result = await db.execute(
+            select(Product.id, Product.name).where(Product.id.in_(missing))
+        )
+        return {row.id: tuple(row) for row in result}
+
+    found = await reference_cache.get_many(PRODUCTS, product_ids, load)
+    return {id: ProductRef(*value) for id, value in found.items()}
+
+
+async def product_names(db: AsyncSession, product_ids) -> dict[str, str]:
+    products = await get_products(db, product_ids)
+    return {id: product.name for id, product in products.items()}
+
+
+async def invalidate_customers(customer_ids):
+    await reference_cache.invalidate(CUSTOMERS, customer_ids)
+
+
+async def invalidate_products(product_ids):
+    await reference_cache.invalidate(PRODUCTS, product_ids)
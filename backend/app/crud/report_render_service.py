@@ -0,0 +1,278 @@
+"""Stored billing reports rendered as Markdown, CSV or HTML.
+
+Line items are read with ``stream_report_items`` one batch at a time, and
+each batch is rendered into a single chunk of the response, so memory is
+bounded by the batch size however many lines a report has. Product
+subtotals and totals are folded in as the items go by and written after the
+table; nothing is read twice.
+"""
+
+import csv
+import html
+import io
+from datetime import datetime
+from typing import AsyncIterator, NamedTuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.instrumentation import REPORT_ITEMS
+from app.crud.billing_engine import (
+    STREAM_BATCH_SIZE,
+    add_item_to_totals,
+    empty_report_totals,
+    stream_report_items,
+)
+from app.crud.reference_data_service import get_customer
+from app.models import BillingReport, BillingReportFile
+from app.shared import BILLING_CAP, DedupWindows
+
+ITEM_COLUMNS = (
+    "customer_email",
+    "associated_product",
+    "lead_type",
+    "action_type",
+    "engagement_level",
+    "amount",
+    "billed_amount",
+    "duplicate",
+    "status",
+)
+ITEM_HEADINGS = (
+    "Customer Email",
+    "Associated Product",
+    "Lead Type",
+    "Action Type",
+    "Engagement Level",
+    "Amount (USD)",
+    "Billed (USD)",
+    "Duplicate",
+    "Status",
+)
+
+
+class RenderContext(NamedTuple):
+    report_id: str
+    customer_id: str
+    customer_name: str
+    customer_email: str
+    period_start: Optional[datetime]
+    period_end: Optional[datetime]
+    dedup_window: DedupWindows
+
+
+async def report_render_context(
+    db: AsyncSession, report_id: str
+) -> Optional[RenderContext]:
+    """What rendering a stored report needs, or None if there is no such report
+    or its customer is gone."""
+    # reports requested through the API are stored as snapshots, with their window
+    snapshot = await db.get(BillingReportFile, report_id)
+    # the others were written by billing runs, which dedupe per month
+    report = snapshot or await db.get(BillingReport, report_id)
+    if report is None:
+        return None
+    customer = await get_customer(db, report.customer_id)
+    if customer is None:
+        return None
+    return RenderContext(
+        report_id,
+        report.customer_id,
+        customer.name,
+        customer.email,
+        report.period_start,
+        report.period_end,
+        snapshot.dedup_window if snapshot else DedupWindows.MONTH,
+    )
+
+
+def _money(value: float) -> str:
+    return f"${value:.2f}"
+
+
+def _period(context: RenderContext) -> str:
+    start = context.period_start.isoformat() if context.period_start else "start"
+    end = context.period_end.isoformat() if context.period_end else "now"
+    return f"{start} to {end}"
+
+
+def _explanation() -> str:
+    return (
+        "Duplicate actions are billed once, and no lead is billed more than "
+        f"{_money(BILLING_CAP)}; what was not billed is counted as savings."
+    )
+
+
+def _markdown_cell(value) -> str:
+    return str(value).replace("|", "\\|")
+
+
+class MarkdownRenderer:
+    media_type = "text/markdown"
+
+    def __init__(self, subtotals: bool = True):
+        self.subtotals = subtotals
+
+    def header(self, context: RenderContext) -> str:
+        return "".join(
+            [
+                "### **Detailed Billing Breakdown**\n\n",
+                f"#### **B2B Partner Company: `{context.customer_name}`**\n",
+                f"**End Customer Email:** `{context.customer_email}`  \n",
+                f"**Period:** {_period(context)}\n\n",
+                "| " + " | ".join(f"**{h}**" for h in ITEM_HEADINGS) + " |\n",
+                "|" + "---|" * len(ITEM_HEADINGS) + "\n",
+            ]
+        )
+
+    def rows(self, items: list[dict]) -> str:
+        return "".join(
+            f"| `{_markdown_cell(item['customer_email'])}`"
+            f" | `{_markdown_cell(item['associated_product'])}`"
+            f" | {item['lead_type']} | {item['action_type']}"
+            f" | {item['engagement_level']} | {_money(item['amount'])}"
+            f" | {_money(item['billed_amount'])}"
+            f" | {'Yes' if item['duplicate'] else 'No'} | {item['status']} |\n"
+            for item in items
+        )
+
+    def footer(self, context: RenderContext, totals: dict) -> str:
+        lines = ["\n"]
+        if self.subtotals:
+            lines.extend(
+                f"**Subtotal for `{_markdown_cell(product)}`:** {_money(subtotal)}  \n"
+                for product, subtotal in totals["product_subtotals"].items()
+            )
+            lines.append("\n")
+        lines.append(
+            f"**Total Billed Amount:** {_money(totals['total_billed_amount'])}  \n"
+        )
+        lines.append(
+            "**Total Savings from Duplicates and Caps:** "
+            f"{_money(totals['total_savings'])}\n\n"
+        )
+        lines.append(f"*{_explanation()}*\n")
+        return "".join(lines)
+
+
+class CsvRenderer:
+    """One row per line item; subtotal and total rows follow, marked in the
+    status column."""
+
+    media_type = "text/csv"
+
+    def __init__(self, subtotals: bool = True):
+        self.subtotals = subtotals
+
+    def _write(self, rows) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def header(self, context: RenderContext) -> str:
+        return self._write([ITEM_COLUMNS])
+
+    def rows(self, items: list[dict]) -> str:
+        return self._write(
+            [item[column] for column in ITEM_COLUMNS] for item in items
+        )
+
+    def footer(self, context: RenderContext, totals: dict) -> str:
+        rows = []
+        if self.subtotals:
+            rows.extend(
+                ["", product, "", "", "", "", subtotal, "", "Subtotal"]
+                for product, subtotal in totals["product_subtotals"].items()
+            )
+        amount = totals["total_billed_amount"] + totals["total_savings"]
+        rows.append(
+            ["", "", "", "", "", amount, totals["total_billed_amount"], "", "Total"]
+        )
+        return self._write(rows)
+
+
+class HtmlRenderer:
+    media_type = "text/html"
+
+    def __init__(self, subtotals: bool = True):
+        self.subtotals = subtotals
+
+    def header(self, context: RenderContext) -> str:
+        e = html.escape
+        return "".join(
+            [
+                "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">",
+                f"<title>Billing report {e(context.report_id)}</title></head>\n",
+                "<body>\n<h3>Detailed Billing Breakdown</h3>\n",
+                f"<h4>B2B Partner Company: {e(context.customer_name)}</h4>\n",
+                f"<p>End Customer Email: {e(context.customer_email)}<br>\n",
+                f"Period: {e(_period(context))}</p>\n",
+                "<table>\n<thead><tr>",
+                "".join(f"<th>{heading}</th>" for heading in ITEM_HEADINGS),
+                "</tr></thead>\n<tbody>\n",
+            ]
+        )
+
+    def rows(self, items: list[dict]) -> str:
+        e = html.escape
+        return "".join(
+            f"<tr><td>{e(item['customer_email'])}</td>"
+            f"<td>{e(item['associated_product'])}</td>"
+            f"<td>{e(item['lead_type'])}</td><td>{e(item['action_type'])}</td>"
+            f"<td>{e(item['engagement_level'])}</td>"
+            f"<td>{_money(item['amount'])}</td>"
+            f"<td>{_money(item['billed_amount'])}</td>"
+            f"<td>{'Yes' if item['duplicate'] else 'No'}</td>"
+            f"<td>{e(item['status'])}</td></tr>\n"
+            for item in items
+        )
+
+    def footer(self, context: RenderContext, totals: dict) -> str:
+        e = html.escape
+        parts = ["</tbody>\n</table>\n"]
+        if self.subtotals:
+            parts.append("<table>\n<thead><tr><th>Product</th><th>Subtotal</th>")
+            parts.append("</tr></thead>\n<tbody>\n")
+            parts.extend(
+                f"<tr><td>{e(product)}</td><td>{_money(subtotal)}</td></tr>\n"
+                for product, subtotal in totals["product_subtotals"].items()
+            )
+            parts.append("</tbody>\n</table>\n")
+        parts.append(
+            f"<p>Total Billed Amount: {_money(totals['total_billed_amount'])}<br>\n"
+            "Total Savings from Duplicates and Caps: "
+            f"{_money(totals['total_savings'])}</p>\n"
+            f"<p><em>{e(_explanation())}</em></p>\n</body></html>\n"
+        )
+        return "".join(parts)
+
+
+RENDERERS = {"md": MarkdownRenderer, "csv": CsvRenderer, "html": HtmlRenderer}
+
+
+async def render_report(
+    session_factory: async_sessionmaker,
+    context: RenderContext,
+    format: str,
+    subtotals: bool = True,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> AsyncIterator[str]:
+    """The rendered report, one chunk per batch of line items."""
+    renderer = RENDERERS[format](subtotals)
+    totals = empty_report_totals()
+    yield renderer.header(context)
+    # the response outlives the request session, see stream_ndjson_report
+    async with session_factory() as session:
+        async for items in stream_report_items(
+            session,
+            context.customer_id,
+            context.customer_email,
+            context.period_start,
+            context.period_end,
+            context.dedup_window,
+            batch_size,
+        ):
+            for item in items:
+                add_item_to_totals(totals, item)
+            yield renderer.rows(items)
+    REPORT_ITEMS.labels(format).observe(totals["action_count"])
+    yield renderer.footer(context, totals)
@@ -0,0 +1,223 @@
+"""Persisted billing report snapshots.
+
+The first request for a (customer, range, dedup window, items) key stores the
+rendered report as gzip JSON, named by the sha256 of the document, and
+records it in ``billing_report_files``. Later requests are answered from that
+file, with the hash as ETag.
+
+A snapshot goes stale when actions land in its range, when the customer is
+billed, or when the billing rules change (``BILLING_ENGINE_VERSION``).
+Ingestion keeps ``billing_rollups.action_count`` current, so the rollups of
+the range's months and the customer's latest billing report give a cheap
+fingerprint, read in one query; only when the action count moves are the
+actions of the range counted, and the snapshot is recomputed if that count
+changed. Looking a snapshot up never writes.
+
+Snapshots are rows of their own, not billing reports. A key has one: storing
+a report replaces the key's previous snapshot and deletes its file, so open
+ranges, whose snapshots go stale with every ingestion, do not pile up.
+"""
+
+import gzip
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.report_storage import (
+    delete_report_file,
+    read_report_file,
+    report_storage,
+)
+from app.crud.billing_rollup_service import month_start
+from app.models import Action, BillingReport, BillingReportFile, BillingRollup
+from app.shared import BILLING_ENGINE_VERSION, DedupWindows
+
+logger = logging.getLogger(__name__)
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    # report ranges are compared with TIMESTAMP WITHOUT TIME ZONE columns
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _equal_or_null(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def _snapshot_key_criteria(
+    customer_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    dedup_window: DedupWindows,
+    include_items: bool,
+) -> list:
+    return [
+        BillingReportFile.customer_id == customer_id,
+        _equal_or_null(BillingReportFile.period_start, start_date),
+        _equal_or_null(BillingReportFile.period_end, end_date),
+        BillingReportFile.dedup_window == dedup_window,
+        BillingReportFile.include_items == include_items,
+    ]
+
+
+class ReportFingerprint(NamedTuple):
+    rollup_action_count: int
+    latest_billing_report_id: Optional[str]
+
+
+async def report_fingerprint(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+) -> ReportFingerprint:
+    """Actions ingested into the months a range touches, from the rollups, and
+    the customer's latest billing report."""
+    latest_report = (
+        select(BillingReport.id)
+        .where(BillingReport.customer_id == customer_id)
+        .order_by(BillingReport.created_at.desc(), BillingReport.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    query = select(
+        func.coalesce(func.sum(BillingRollup.action_count), 0), latest_report
+    ).where(BillingRollup.customer_id == customer_id)
+    if start_date:
+        query = query.where(BillingRollup.month >= month_start(start_date))
+    if end_date:
+        query = query.where(BillingRollup.month <= month_start(end_date))
+    action_count, report_id = (await db.execute(query)).one()
+    return ReportFingerprint(int(action_count), report_id)
+
+
+async def range_action_count(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+) -> int:
+    query = select(func.count()).where(Action.customer_id == customer_id)
+    if start_date:
+        query = query.where(Action.created_at >= start_date)
+    if end_date:
+        query = query.where(Action.created_at <= end_date)
+    return await db.scalar(query)
+
+
+async def find_report_snapshot(
+    db: AsyncSession,
+    customer_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    dedup_window: DedupWindows,
+    include_items: bool,
+) -> Optional[BillingReportFile]:
+    """The current snapshot of a report key, or None if missing or stale."""
+    start_date, end_date = _utc_naive(start_date), _utc_naive(end_date)
+    snapshot = (
+        await db.execute(
+            select(BillingReportFile)
+            .where(
+                *_snapshot_key_criteria(
+                    customer_id, start_date, end_date, dedup_window, include_items
+                )
+            )
+            .order_by(BillingReportFile.created_at.desc())
+            .limit(1)
+        )
+    ).scalar_one_or_none()
+    if snapshot is None:
+        return None
+
+    if snapshot.engine_version != BILLING_ENGINE_VERSION:
+        return None
+    fingerprint = await report_fingerprint(db, customer_id, start_date, end_date)
+    if fingerprint.latest_billing_report_id != snapshot.latest_billing_report_id:
+        return None
+    if fingerprint.rollup_action_count == snapshot.rollup_action_count:
+        return snapshot
+    # new actions in the range's months; are any of them in the range itself?
+    # (counted on every request until the snapshot is next replaced)
+    if (
+        await range_action_count(db, customer_id, start_date, end_date)
+        != snapshot.action_count
+    ):
+        return None
+    return snapshot
+
+
+async def read_report_snapshot(snapshot: BillingReportFile) -> bytes:
+    """The gzip-compressed report document."""
+    return await read_report_file(snapshot.file_path)
+
+
+def compress_report(document: bytes) -> tuple[str, bytes]:
+    """Content hash of a report document and its compressed file contents."""
+    # mtime=0 keeps the file bytes a function of the document alone
+    return hashlib.sha256(document).hexdigest(), gzip.compress(document, mtime=0)
+
+
+async def save_report_snapshot(
+    db: AsyncSession,
+    report_id: str,
+    customer_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    dedup_window: DedupWindows,
+    include_items: bool,
+    totals: dict,
+    fingerprint: ReportFingerprint,
+    document: bytes,
+) -> BillingReportFile:
+    """Store a rendered report as the snapshot of its key, replacing the
+    previous one.
+
+    ``fingerprint`` must be read with ``report_fingerprint`` before the
+    report is computed, so actions landing meanwhile make it look stale.
+    """
+    start_date, end_date = _utc_naive(start_date), _utc_naive(end_date)
+    content_hash, data = compress_report(document)
+    file_path = await report_storage().write(
+        f"{customer_id}/{content_hash}.json.gz", data
+    )
+    superseded = (
+        await db.execute(
+            delete(BillingReportFile)
+            .where(
+                *_snapshot_key_criteria(
+                    customer_id, start_date, end_date, dedup_window, include_items
+                )
+            )
+            .returning(BillingReportFile.file_path)
+        )
+    ).scalars().all()
+    snapshot = BillingReportFile(
+        id=report_id,
+        customer_id=customer_id,
+        file_path=file_path,
+        period_start=start_date,
+        period_end=end_date,
+        dedup_window=dedup_window,
+        include_items=include_items,
+        content_hash=content_hash,
+        action_count=totals["action_count"],
+        rollup_action_count=fingerprint.rollup_action_count,
+        engine_version=BILLING_ENGINE_VERSION,
+        latest_billing_report_id=fingerprint.latest_billing_report_id,
+    )
+    db.add(snapshot)
+    await db.commit()
+    # documents carry their own id, so no other snapshot shares these files
+    for path in set(superseded) - {file_path}:
+        try:
+            await delete_report_file(path)
+        except Exception as e:
+            logger.warning("Could not delete superseded report file %s: %s", path, e)
+    return snapshot
@@ -8,17 +8,30 @@ from .config import settings
 from .models import ModelBase
 from .core.database import (
     async_engine,
+    async_session,
     check_database_status,
     drop_and_create_tables,
     seed_database,
     apply_migrations,
 )
+from .core.instrumentation import MetricsMiddleware
+from .core.log_config import LogContextMiddleware, configure_logging
+from .crud.action_partition_service import ensure_action_partitions
+from .crud.billing_rollup_service import (
+    rebuild_billing_rollups,
+    refresh_stale_billing_rollups,
+)
+from .crud.billing_run_service import resume_billing_runs
+from .crud.ingestion_key_service import purge_ingestion_keys
+from .crud.lead_buffer_service import lead_buffer
 from .api.endpoints import health
 from .api.endpoints import leads
 from .api.endpoints import billing_reports
+from .api.endpoints import billing_runs
+from .api.endpoints import metrics
 
 
-logging.basicConfig(level=logging.INFO)
+log_listener = configure_logging()
 
 
 app = FastAPI(
@@ -42,9 +55,14 @@ else:
         allow_methods=["GET", "POST"],
         allow_headers=["*"],
     )
+app.add_middleware(LogContextMiddleware)
+# outermost, so latency includes the other middleware
+app.add_middleware(MetricsMiddleware, engine=async_engine)
 app.include_router(health.router, tags=["health"])
 app.include_router(leads.router, tags=["leads"])
 app.include_router(billing_reports.router, tags=["billing_reports"])
+app.include_router(billing_runs.router, tags=["billing_runs"])
+app.include_router(metrics.router, tags=["metrics"])
 
 
 @app.on_event("startup")
@@ -53,14 +71,56 @@ async def startup_event():
     await check_database_status()
     await drop_and_create_tables()
     # await apply_migrations()
-    await seed_database()
+    async with async_session() as session:
+        await ensure_action_partitions(session)
+    if await seed_database():
+        # seeded actions bypass ingestion, so roll them up in one pass
+        async with async_session() as session:
+            await rebuild_billing_rollups(session)
+    # queues leads a previous worker accepted and did not write
+    await lead_buffer.start()
+    # pick up runs interrupted by a crash or restart
+    resumed = await resume_billing_runs(async_session)
+    if resumed:
+        logging.info("~~**~~ Resumed billing runs: %s", ", ".join(resumed))
+
+
+@app.on_event("startup")
+@repeat_every(seconds=60 * 60 * 24, wait_first=True)
+async def create_upcoming_action_partitions():
+    async with async_session() as session:
+        created = await ensure_action_partitions(session)
+    if created:
+        logging.info("~~**~~ Created action partitions: %s", ", ".join(created))
+
+
+@app.on_event("startup")
+@repeat_every(seconds=60, wait_first=True)
+async def refresh_stale_rollups():
+    # ingestion only counts actions into the rollups; see billing_rollup_service.
+    # One worker refreshes at a time, the others skip the run.
+    async with async_session() as session:
+        refreshed = await refresh_stale_billing_rollups(session)
+    if refreshed:
+        logging.info("~~**~~ Refreshed rollups of %s customer months", refreshed)
+
+
+@app.on_event("startup")
+@repeat_every(seconds=60 * 60, wait_first=True)
+async def purge_expired_ingestion_keys():
+    async with async_session() as session:
+        purged = await purge_ingestion_keys(session)
+    if purged:
+        logging.info("~~**~~ Purged expired ingestion keys: %s", purged)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logging.info("~~**~~ Running shutdown event...")
+    await lead_buffer.stop()
     await async_engine.dispose()
     logging.info("~~**~~ Engine disposed.")
+    log_listener.stop()
 
 
 @app.get("/")
@@ -4,6 +4,11 @@ from .product import Product
 from .lead import Lead
 from .action import Action
 from .billing_report import BillingReport
+from .billing_report_file import BillingReportFile
+from .billing_rollup import BillingRollup
+from .billing_dedup_state import BillingDedupKey, BillingDedupState, BillingLeadTotal
+from .billing_run import BillingRun, BillingRunCustomer
+from .ingestion_key import IngestionKey
 
 __all__ = [
     "ModelBase",
@@ -12,4 +17,12 @@ __all__ = [
     "Lead",
     "Action",
     "BillingReport",
+    "BillingReportFile",
+    "BillingRollup",
+    "BillingDedupState",
+    "BillingDedupKey",
+    "BillingLeadTotal",
+    "BillingRun",
+    "BillingRunCustomer",
+    "IngestionKey",
 ]
@@ -1,5 +1,15 @@
 import uuid
-from sqlalchemy import String, DateTime, Boolean, Numeric, ForeignKey, Enum
+from sqlalchemy import (
+    DDL,
+    String,
+    DateTime,
+    Boolean,
+    Numeric,
+    ForeignKey,
+    Enum,
+    Index,
+    event,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
@@ -18,6 +28,29 @@ from app.shared import (
 
 class Action(ModelBase):
     __tablename__ = "actions"
+    __table_args__ = (
+        # Access path of billing reports and rollups: one customer over a
+        # created_at range. The INCLUDE columns are everything the report
+        # query reads, so it runs as an index-only scan.
+        Index(
+            "ix_actions_customer_id_created_at",
+            "customer_id",
+            "created_at",
+            postgresql_include=[
+                "id",
+                "lead_id",  # the billing cap is per lead
+                "product_id",
+                "lead_type",
+                "action_type",
+                "engagement_level",
+            ],
+        ),
+        # Actions arrive roughly in created_at order, so a BRIN index gives
+        # cheap range pruning for month-wide scans at a tiny size.
+        Index("ix_actions_created_at_brin", "created_at", postgresql_using="brin"),
+        # One partition per created_at month, see crud.action_partition_service.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     id: Mapped[str] = mapped_column(
         String(36), primary_key=True, index=True, nullable=False
     )
@@ -25,7 +58,7 @@ class Action(ModelBase):
         String, ForeignKey("leads.id"), nullable=False, index=True
     )
     customer_id: Mapped[str] = mapped_column(
-        String, ForeignKey("customers.id"), nullable=False, index=True
+        String, ForeignKey("customers.id"), nullable=False
     )
     product_id: Mapped[str] = mapped_column(
         String, ForeignKey("products.id"), nullable=False, index=True
@@ -38,8 +71,9 @@ class Action(ModelBase):
     engagement_level: Mapped[EngagementLevelTypes] = mapped_column(
         Enum(EngagementLevelTypes), nullable=False
     )
+    # part of the primary key because it is the partition key
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, nullable=False
+        DateTime, primary_key=True, nullable=False
     )  # comes populated in POST req payload as timestamp, changed name for consistency, no default value
     cost_amount: Mapped[Optional[Numeric]] = mapped_column(Numeric, default=None)
     is_duplicate: Mapped[Optional[bool]] = mapped_column(Boolean, default=None)
@@ -47,13 +81,27 @@ class Action(ModelBase):
         Enum(BillableStatus), default=None
     )
 
-    lead: Mapped["Lead"] = relationship("Lead", back_populates="actions", lazy="joined")
+    # only loaded through explicit loader options, see Lead
+    lead: Mapped["Lead"] = relationship(
+        "Lead", back_populates="actions", lazy="raise_on_sql"
+    )
     customer: Mapped["Customer"] = relationship(
-        "Customer", back_populates="actions", lazy="joined"
+        "Customer", back_populates="actions", lazy="raise_on_sql"
     )
     product: Mapped["Product"] = relationship(
-        "Product", back_populates="actions", lazy="joined"
+        "Product", back_populates="actions", lazy="raise_on_sql"
     )
     billing_report: Mapped["BillingReport"] = relationship(
-        "BillingReport", back_populates="actions", lazy="joined"
+        "BillingReport", back_populates="actions", lazy="raise_on_sql"
     )
+
+
+# A partitioned table only accepts rows that fall into a partition; the
+# default partition takes any month without its own partition.
+event.listen(
+    Action.__table__,
+    "after_create",
+    DDL(
+        "CREATE TABLE IF NOT EXISTS actions_default PARTITION OF actions DEFAULT"
+    ).execute_if(dialect="postgresql"),
+)
@@ -0,0 +1,60 @@
+from sqlalchemy import String, Date, DateTime, Numeric, ForeignKey, Enum
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date, datetime
+from .models import ModelBase
+from app.shared import LeadTypes, ActionTypes, EngagementLevelTypes
+
+
+class BillingDedupState(ModelBase):
+    """Marks the ``BillingDedupKey`` and ``BillingLeadTotal`` rows of one
+    customer's calendar month as complete.
+
+    Incremental billing runs price only actions not yet on a report, and
+    dedupe and cap them against those rows instead of rereading the month;
+    see app.crud.incremental_billing_service. Runs billing the same month
+    serialize on this row.
+    """
+
+    __tablename__ = "billing_dedup_states"
+    customer_id: Mapped[str] = mapped_column(
+        String, ForeignKey("customers.id"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)  # first day
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), onupdate=func.now()
+    )
+
+
+class BillingDedupKey(ModelBase):
+    """A duplicate key billed once for a customer within a calendar month."""
+
+    __tablename__ = "billing_dedup_keys"
+    customer_id: Mapped[str] = mapped_column(
+        String, ForeignKey("customers.id"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)  # first day
+    product_id: Mapped[str] = mapped_column(
+        String, ForeignKey("products.id"), primary_key=True
+    )
+    lead_type: Mapped[LeadTypes] = mapped_column(Enum(LeadTypes), primary_key=True)
+    action_type: Mapped[ActionTypes] = mapped_column(
+        Enum(ActionTypes), primary_key=True
+    )
+    engagement_level: Mapped[EngagementLevelTypes] = mapped_column(
+        Enum(EngagementLevelTypes), primary_key=True
+    )
+
+
+class BillingLeadTotal(ModelBase):
+    """What one lead has been billed within a calendar month, for the cap."""
+
+    __tablename__ = "billing_lead_totals"
+    customer_id: Mapped[str] = mapped_column(
+        String, ForeignKey("customers.id"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)  # first day
+    lead_id: Mapped[str] = mapped_column(
+        String, ForeignKey("leads.id"), primary_key=True
+    )
+    billed: Mapped[Numeric] = mapped_column(Numeric, nullable=False)
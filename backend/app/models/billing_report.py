@@ -19,15 +19,18 @@ class BillingReport(ModelBase):
     # )  # serialized for storage purposes
     total_billed_amount: Mapped[Numeric] = mapped_column(Numeric, nullable=False)
     savings_amount: Mapped[Optional[Numeric]] = mapped_column(Numeric, default=0.0)
-    file_path: Mapped[str] = mapped_column(String(255), nullable=False)
+    # billed range; reports written by billing runs cover one calendar month
+    period_start: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    period_end: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    file_path: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=func.now(), index=True
     )
     actions: Mapped[List["Action"]] = relationship(
-        "Action", back_populates="billing_report"
+        "Action", back_populates="billing_report", lazy="noload"
     )
     customer: Mapped["Customer"] = relationship(
-        "Customer", back_populates="billing_reports"
+        "Customer", back_populates="billing_reports", lazy="raise_on_sql"
     )
     # billing_report_file: Mapped["BillingReportFile"] = relationship(
     #     "BillingReportFile", back_populates="billing_report"
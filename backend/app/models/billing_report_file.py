@@ -1,17 +1,61 @@
-from sqlalchemy import ForeignKey, String, DateTime, func
+from sqlalchemy import (
+    ForeignKey,
+    String,
+    DateTime,
+    Integer,
+    Boolean,
+    Enum,
+    Index,
+    func,
+)
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime
+from typing import Optional
 from .models import ModelBase
+from app.shared import DedupWindows
 
 
 class BillingReportFile(ModelBase):
+    """A stored, rendered billing report and the request it answers.
+
+    Repeat requests for the same customer, range and options are served from
+    the file as long as no action has landed in the range, the customer has
+    not been billed, and the billing rules have not changed since. ``id`` is
+    the id of the report document.
+    """
+
     __tablename__ = "billing_report_files"
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, index=True)
-    billing_report_id: Mapped[str] = mapped_column(
-        ForeignKey("billing_reports.id"), index=True
+    __table_args__ = (
+        Index(
+            "ix_billing_report_files_snapshot_key",
+            "customer_id",
+            "period_start",
+            "period_end",
+            "dedup_window",
+            "include_items",
+        ),
     )
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, index=True)
     customer_id: Mapped[str] = mapped_column(ForeignKey("customers.id"), index=True)
     file_path: Mapped[str] = mapped_column(String(255), nullable=False)
+    # None: the range is open on that side
+    period_start: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    period_end: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    dedup_window: Mapped[DedupWindows] = mapped_column(
+        Enum(DedupWindows), nullable=False
+    )
+    include_items: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # sha256 of the uncompressed document; also its ETag
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # actions in the range, and in the rollups of its months, when computed
+    action_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    rollup_action_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # BILLING_ENGINE_VERSION, and the customer's latest billing report, when
+    # the report was computed
+    engine_version: Mapped[int] = mapped_column(Integer, nullable=False)
+    latest_billing_report_id: Mapped[Optional[str]] = mapped_column(
+        String(36), default=None
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=func.now(), index=True
     )
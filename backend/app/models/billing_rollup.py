@@ -0,0 +1,53 @@
+from sqlalchemy import (
+    String,
+    Boolean,
+    Date,
+    DateTime,
+    Integer,
+    Numeric,
+    ForeignKey,
+    Index,
+)
+from sqlalchemy.sql import false, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date, datetime
+from .models import ModelBase
+
+
+class BillingRollup(ModelBase):
+    """Billing totals of one customer's product for one calendar month.
+
+    Ingestion adds the actions it writes to ``action_count`` and marks the
+    row stale; the duplicate- and cap-aware values are recomputed for stale
+    rows in the background. Reports over closed months read a few of these
+    rows instead of scanning ``actions`` once none of them is stale.
+    Duplicates are counted, and leads capped, within the month.
+    """
+
+    __tablename__ = "billing_rollups"
+    __table_args__ = (
+        Index(
+            "ix_billing_rollups_stale",
+            "customer_id",
+            "month",
+            postgresql_where=text("stale"),
+        ),
+    )
+    customer_id: Mapped[str] = mapped_column(
+        String, ForeignKey("customers.id"), primary_key=True
+    )
+    product_id: Mapped[str] = mapped_column(
+        String, ForeignKey("products.id"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)  # first day
+    billed: Mapped[Numeric] = mapped_column(Numeric, nullable=False, default=0)
+    savings: Mapped[Numeric] = mapped_column(Numeric, nullable=False, default=0)
+    duplicate_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    action_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # actions were added since billed, savings and duplicate_count were computed
+    stale: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), onupdate=func.now()
+    )
@@ -0,0 +1,76 @@
+from sqlalchemy import (
+    Boolean,
+    String,
+    Date,
+    DateTime,
+    Integer,
+    ForeignKey,
+    Enum,
+    Index,
+)
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date, datetime
+from typing import Optional
+from .models import ModelBase
+from app.shared import BillingRunStatus, BillingRunCustomerStatus
+
+
+class BillingRun(ModelBase):
+    """One month-end billing run over every customer."""
+
+    __tablename__ = "billing_runs"
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    # first day; a failed run is resumed rather than billed again by another
+    month: Mapped[date] = mapped_column(Date, nullable=False, unique=True, index=True)
+    status: Mapped[BillingRunStatus] = mapped_column(
+        Enum(BillingRunStatus), nullable=False, default=BillingRunStatus.QUEUED
+    )
+    # bill only actions not yet on a report; see
+    # app.crud.incremental_billing_service
+    incremental: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default="false"
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now()
+    )
+    started_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), default=None
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), default=None
+    )
+
+
+class BillingRunCustomer(ModelBase):
+    """Progress of one customer within a billing run.
+
+    A customer is marked done in the same transaction that writes its report
+    and links its actions, so a run resumed after a crash only picks up the
+    customers still pending.
+    """
+
+    __tablename__ = "billing_run_customers"
+    __table_args__ = (
+        # workers claim the next pending customer of a run
+        Index("ix_billing_run_customers_run_id_status", "run_id", "status"),
+    )
+    run_id: Mapped[str] = mapped_column(
+        String(36), ForeignKey("billing_runs.id"), primary_key=True
+    )
+    customer_id: Mapped[str] = mapped_column(
+        String, ForeignKey("customers.id"), primary_key=True
+    )
+    status: Mapped[BillingRunCustomerStatus] = mapped_column(
+        Enum(BillingRunCustomerStatus),
+        nullable=False,
+        default=BillingRunCustomerStatus.PENDING,
+    )
+    billing_report_id: Mapped[Optional[str]] = mapped_column(
+        String, ForeignKey("billing_reports.id"), default=None
+    )
+    action_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[Optional[str]] = mapped_column(String(255), default=None)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), default=None
+    )
@@ -17,12 +17,14 @@ class Customer(ModelBase):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=func.now()
     )
+    # Unbounded collections over the hot tables are never loaded implicitly;
+    # queries that need them ask for them with a loader option.
     leads: Mapped[list["Lead"]] = relationship(
-        "Lead", back_populates="customer", lazy="joined"
+        "Lead", back_populates="customer", lazy="noload"
     )
     actions: Mapped[list["Action"]] = relationship(
-        "Action", back_populates="customer", lazy="joined"
+        "Action", back_populates="customer", lazy="noload"
     )
     billing_reports: Mapped[list["BillingReport"]] = relationship(
-        "BillingReport", back_populates="customer", lazy="joined"
+        "BillingReport", back_populates="customer", lazy="noload"
     )
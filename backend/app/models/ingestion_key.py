@@ -0,0 +1,26 @@
+from sqlalchemy import String, DateTime, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from typing import Optional
+from .models import ModelBase
+
+
+class IngestionKey(ModelBase):
+    """A request or lead that ingestion has seen lately.
+
+    ``key`` is a sha256 digest, of a client's Idempotency-Key or of a lead's
+    content; see app.crud.ingestion_key_service. Rows are dropped once they
+    expire.
+    """
+
+    __tablename__ = "ingestion_keys"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    # lead keys: the lead ingested with this content
+    lead_id: Mapped[Optional[str]] = mapped_column(String(36), default=None)
+    # request keys: sha256 of the payload, and the results returned for it
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), default=None)
+    response: Mapped[Optional[str]] = mapped_column(Text, default=None)
+    # UTC
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, index=True
+    )
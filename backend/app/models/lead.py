@@ -1,4 +1,4 @@
-from sqlalchemy import String, DateTime, ForeignKey, Enum
+from sqlalchemy import String, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 from typing import List
@@ -10,11 +10,19 @@ from app.shared.lead_action_types import LeadTypes
 
 class Lead(ModelBase):
     __tablename__ = "leads"
+    __table_args__ = (
+        # Keyset pagination order of GET /leads, overall and per customer;
+        # the latter also serves plain customer_id lookups.
+        Index("ix_leads_created_at_id", "created_at", "id"),
+        Index(
+            "ix_leads_customer_id_created_at_id", "customer_id", "created_at", "id"
+        ),
+    )
     id: Mapped[str] = mapped_column(
         String(36), primary_key=True, index=True, nullable=False
     )
     customer_id: Mapped[str] = mapped_column(
-        String, ForeignKey("customers.id"), index=True, nullable=False
+        String, ForeignKey("customers.id"), nullable=False
     )
     product_id: Mapped[str] = mapped_column(
         String, ForeignKey("products.id"), index=True, nullable=False
@@ -23,12 +31,14 @@ class Lead(ModelBase):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False
     )  # comes populated in POST req payload, no default
+    # Loading these takes an explicit loader option; a lazy load that would
+    # emit SQL raises instead of quietly running one query per lead.
     customer: Mapped["Customer"] = relationship(
-        "Customer", back_populates="leads", lazy="joined"
+        "Customer", back_populates="leads", lazy="raise_on_sql"
     )
     product: Mapped["Product"] = relationship(
-        "Product", back_populates="leads", lazy="joined"
+        "Product", back_populates="leads", lazy="raise_on_sql"
     )
     actions: Mapped[List["Action"]] = relationship(
-        "Action", back_populates="lead", lazy="joined"
+        "Action", back_populates="lead", lazy="raise_on_sql"
     )
@@ -16,9 +16,10 @@ class Product(ModelBase):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=func.now()
     )
+    # unbounded collections, see Customer
     leads: Mapped[list["Lead"]] = relationship(
-        "Lead", back_populates="product", lazy="joined"
+        "Lead", back_populates="product", lazy="noload"
     )
     actions: Mapped[list["Action"]] = relationship(
-        "Action", back_populates="product", lazy="joined"
+        "Action", back_populates="product", lazy="noload"
     )
@@ -6,6 +6,8 @@ from .base import (
     BillingReportCreate,
     BillingReport,
     BillingReportItem,
+    BillingRunCreate,
+    BillingRun,
     ProductBase,
     ProductCreate,
     Product,
@@ -13,6 +15,10 @@ from .base import (
     ActionCreate,
     Action,
     LeadBase,
+    LeadActionCreate,
     LeadCreate,
+    LeadIngestResult,
+    LeadsQueued,
     Lead,
+    LeadPage,
 )
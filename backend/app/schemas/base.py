@@ -1,10 +1,11 @@
 from typing import List, Optional, Dict
 from uuid import UUID
 from pydantic import BaseModel as SchemaBase, Field
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from app.shared import (
     BillableStatus,
+    BillingRunStatus,
     LeadTypes,
     ActionTypes,
     EngagementLevelTypes,
@@ -38,6 +39,7 @@ class BillingReportItem(SchemaBase):
     action_type: str
     engagement_level: str
     amount: float
+    billed_amount: float  # amount, less duplicates and what is over the cap
     duplicate: bool
     status: str
 
@@ -55,6 +57,8 @@ class BillingReportCreate(BillingReportBase):
 
 class BillingReport(BillingReportBase):
     id: str = Field(primary_key=True)
+    total_billed_amount: float = Field(default=0.0)
+    total_savings: float = Field(default=0.0)
     items: Optional[List[BillingReportItem]] = Field(default=None)
     product_subtotals: Dict[str, float]
 
@@ -63,6 +67,33 @@ class BillingReport(BillingReportBase):
         from_attributes = True
 
 
+class BillingRunCreate(SchemaBase):
+    month: date = Field(description="Any day of the month to bill")
+    incremental: bool = Field(
+        default=False,
+        description="Bill only actions not on a report yet, up to the month's end",
+    )
+
+
+class BillingRun(SchemaBase):
+    id: str
+    month: date
+    status: BillingRunStatus
+    incremental: bool = Field(default=False)
+    created_at: Optional[datetime] = Field(default=None)
+    started_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+    customer_count: int = Field(default=0)
+    customers_done: int = Field(default=0)
+    customers_failed: int = Field(default=0)
+    action_count: int = Field(default=0)
+    total_billed_amount: float = Field(default=0.0)
+    total_savings: float = Field(default=0.0)
+    elapsed_seconds: Optional[float] = Field(default=None)
+    customers_per_second: Optional[float] = Field(default=None)
+    actions_per_second: Optional[float] = Field(default=None)
+
+
 class ActionBase(SchemaBase):
     lead_type: LeadTypes = Field(nullable=False)
     action_type: ActionTypes = Field(nullable=False)
@@ -98,12 +129,34 @@ class LeadBase(SchemaBase):
     product_id: str = Field(foreign_key="products.id", nullable=False)
 
 
+class LeadActionCreate(SchemaBase):
+    action_type: ActionTypes = Field(nullable=False)
+    engagement_level: EngagementLevelTypes = Field(nullable=False)
+    created_at: datetime = Field(nullable=False)
+
+
 class LeadCreate(LeadBase):
     id: str = Field(primary_key=True, nullable=False)
     created_at: datetime = Field(nullable=False)
+    actions: List[LeadActionCreate] = Field(default=[])
+
+
+class LeadIngestResult(SchemaBase):
+    id: str
+    accepted: bool
+    action_count: int = Field(default=0)
+    reason: Optional[str] = Field(default=None)
+
+
+class LeadsQueued(SchemaBase):
+    # leads queued for the next micro-batch of POST /leads/async
+    queued: int
 
 
 class Lead(LeadBase):
+    id: Optional[str] = Field(default=None)
+    created_at: Optional[datetime] = Field(default=None)
+    # None in lead listings unless requested with include=actions
     actions: Optional[List[Action]] = Field(default=[])
 
     class Config:
@@ -111,6 +164,12 @@ class Lead(LeadBase):
         from_attributes = True
 
 
+class LeadPage(SchemaBase):
+    items: List[Lead]
+    # pass as ``cursor`` for the next page; None on the last page
+    next_cursor: Optional[str] = Field(default=None)
+
+
 class ProductBase(SchemaBase):
     name: str = Field(nullable=False)
     description: Optional[str] = Field(nullable=True)
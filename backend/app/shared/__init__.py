@@ -4,12 +4,26 @@ from .lead_action_types import (
     ActionTypes,
     EngagementLevelTypes,
     BillableStatus,
+    DedupWindows,
+    BillingRunStatus,
+    BillingRunCustomerStatus,
 )
 
 
 from .billing_pricing import (
     LEAD_ACTION_COSTS,
     BILLING_CAP,
+    BILLING_ENGINE_VERSION,
     ENGAGEMENT_MULTIPLIERS,
     LEAD_TYPE_BASE_VALUES,
 )
+
+from .pricing import (
+    PRICE_TABLE,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    calculate_action_value,
+    encode,
+    price_actions,
+)
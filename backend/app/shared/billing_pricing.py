@@ -1,5 +1,9 @@
 BILLING_CAP = 100
 
+# Bump when prices, duplicate detection or the cap change, so stored report
+# snapshots computed under the old rules are recomputed.
+BILLING_ENGINE_VERSION = 1
+
 LEAD_ACTION_COSTS = {
     "Website Visit": {
         "Visit": 1,
@@ -48,3 +48,24 @@ class ActionTypes(str, Enum):
 class BillableStatus(str, Enum):
     BILLED = "Billed"
     NOT_BILLED = "Not Billed (Duplicate)"
+    CAPPED = "Not Billed (Cap)"  # the lead already reached BILLING_CAP
+
+
+# DEDUP WINDOWS
+class DedupWindows(str, Enum):
+    REPORT = "report"  # an action is billed once per report
+    MONTH = "month"  # an action is billed once per calendar month
+
+
+# BILLING RUNS
+class BillingRunStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"  # finished, but some customers could not be billed
+
+
+class BillingRunCustomerStatus(str, Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
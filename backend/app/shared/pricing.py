@@ -0,0 +1,89 @@
+"""Precompiled pricing tables.
+
+``LEAD_TYPE_BASE_VALUES``, ``LEAD_ACTION_COSTS`` and ``ENGAGEMENT_MULTIPLIERS``
+are folded once, at import time, into a dense ``PRICE_TABLE`` indexed by the
+ordinals of ``LeadTypes``, ``ActionTypes`` and ``EngagementLevelTypes``.
+Single actions are priced with one hash lookup and arrays of enum codes are
+priced with one NumPy gather.
+"""
+
+import numpy as np
+
+from .billing_pricing import (
+    ENGAGEMENT_MULTIPLIERS,
+    LEAD_ACTION_COSTS,
+    LEAD_TYPE_BASE_VALUES,
+)
+from .lead_action_types import ActionTypes, EngagementLevelTypes, LeadTypes
+
+LEAD_TYPE_CODES = {member: code for code, member in enumerate(LeadTypes)}
+ACTION_TYPE_CODES = {member: code for code, member in enumerate(ActionTypes)}
+ENGAGEMENT_LEVEL_CODES = {
+    member: code for code, member in enumerate(EngagementLevelTypes)
+}
+
+# Enum codes fit in a byte; arrays of codes use this dtype.
+CODE_DTYPE = np.uint8
+
+
+def _compile_price_table() -> np.ndarray:
+    base_values = np.array(
+        [LEAD_TYPE_BASE_VALUES.get(lead_type, 0) for lead_type in LeadTypes],
+        dtype=np.float64,
+    )
+    action_costs = np.array(
+        [
+            [
+                LEAD_ACTION_COSTS.get(lead_type, {}).get(action_type, 0)
+                for action_type in ActionTypes
+            ]
+            for lead_type in LeadTypes
+        ],
+        dtype=np.float64,
+    )
+    multipliers = np.array(
+        [ENGAGEMENT_MULTIPLIERS.get(level, 1) for level in EngagementLevelTypes],
+        dtype=np.float64,
+    )
+    # table[lead, action, engagement] = base[lead] + cost[lead, action] * mult[engagement]
+    return (
+        base_values[:, None, None]
+        + action_costs[:, :, None] * multipliers[None, None, :]
+    )
+
+
+PRICE_TABLE = _compile_price_table()
+PRICE_TABLE.setflags(write=False)
+
+# Flat view of PRICE_TABLE for scalar lookups. The enums are ``str`` enums, so
+# keys match both members and their plain string values.
+_ACTION_VALUES = {
+    (lead_type, action_type, level): float(
+        PRICE_TABLE[lead_code, action_code, level_code]
+    )
+    for lead_type, lead_code in LEAD_TYPE_CODES.items()
+    for action_type, action_code in ACTION_TYPE_CODES.items()
+    for level, level_code in ENGAGEMENT_LEVEL_CODES.items()
+}
+
+
+def calculate_action_value(lead_type, action_type, engagement_level) -> float:
+    """Price one action: base value of the lead type plus the weighted action cost."""
+    try:
+        return _ACTION_VALUES[(lead_type, action_type, engagement_level)]
+    except KeyError:
+        # Values outside the enums are priced like the original dict lookups.
+        base_value = LEAD_TYPE_BASE_VALUES.get(lead_type, 0)
+        action_value = LEAD_ACTION_COSTS.get(lead_type, {}).get(action_type, 0)
+        engagement_multiplier = ENGAGEMENT_MULTIPLIERS.get(engagement_level, 1)
+        return base_value + (action_value * engagement_multiplier)
+
+
+def encode(values, codes: dict) -> np.ndarray:
+    """Map enum members (or their string values) to an array of codes."""
+    return np.fromiter((codes[value] for value in values), dtype=CODE_DTYPE)
+
+
+def price_actions(lead_codes, action_codes, engagement_codes) -> np.ndarray:
+    """Price arrays of (lead type, action type, engagement level) codes at once."""
+    return PRICE_TABLE[lead_codes, action_codes, engagement_codes]
@@ -0,0 +1,50 @@
+"""Lead event consumer, run as its own process: ``python -m app.worker``.
+
+Reads ``LEAD_EVENTS_QUEUE_URL`` (see app.crud.lead_event_service) until
+SIGTERM or SIGINT, then finishes the batches being written and exits.
+"""
+
+import asyncio
+import logging
+import signal
+
+from .config import settings
+from .core.database import async_engine, async_session
+from .core.log_config import configure_logging
+from .core.message_queue import SqsQueue
+from .crud.lead_event_service import LeadEventConsumer
+
+
+async def main():
+    if not settings.LEAD_EVENTS_QUEUE_URL:
+        raise SystemExit("LEAD_EVENTS_QUEUE_URL is not set")
+    queue = SqsQueue(
+        settings.LEAD_EVENTS_QUEUE_URL,
+        endpoint_url=settings.AWS_ENDPOINT_URL,
+        dead_letter_url=settings.LEAD_EVENTS_DEAD_LETTER_URL,
+    )
+    consumer = LeadEventConsumer(
+        queue,
+        async_session,
+        batch_size=settings.LEAD_EVENTS_BATCH_SIZE,
+        concurrency=settings.LEAD_EVENTS_CONCURRENCY,
+        wait_seconds=settings.LEAD_EVENTS_WAIT_SECONDS,
+        visibility_timeout=settings.LEAD_EVENTS_VISIBILITY_TIMEOUT,
+        max_receives=settings.LEAD_EVENTS_MAX_RECEIVES,
+    )
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, consumer.stop)
+    try:
+        await consumer.run()
+    finally:
+        await async_engine.dispose()
+        logging.info("~~**~~ Lead event consumer stopped.")
+
+
+if __name__ == "__main__":
+    log_listener = configure_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark: memory per action of the columnar ActionStore vs ORM and item objects
+
+Memory is what tracemalloc sees allocated by each representation on top of
+the raw result rows, which every path starts from; time is one untraced run.
+ORM instances are built transient, so identity map and committed-state
+copies of loaded instances come on top of the figure shown for them.
+
+Usage (from backend/):
+    python -m benchmarks.bench_action_store [--actions 100000]
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from app.crud.action_store import (
+    ActionStore,
+    bill_actions,
+    store_report_items,
+)
+from app.models import Action
+from app.schemas import BillingReportItem
+from app.shared import (
+    ActionTypes,
+    EngagementLevelTypes,
+    LeadTypes,
+    LEAD_ACTION_COSTS,
+)
+
+
+def synthetic_rows(count: int, leads: int = 5000, products: int = 20, seed=7):
+    """Rows shaped like ``STORE_COLUMNS``, in billing order."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    rows = []
+    for i in range(count):
+        lead_type = rng.choice(list(LeadTypes))
+        rows.append(
+            (
+                f"{rng.randrange(leads):08d}-lead-0000-0000-000000000000",
+                "customer-0000-0000-0000-000000000000",
+                f"{rng.randrange(products):08d}-product-0000-0000-00000000",
+                lead_type,
+                ActionTypes(rng.choice(list(LEAD_ACTION_COSTS[lead_type]))),
+                rng.choice(list(EngagementLevelTypes)),
+                start + timedelta(seconds=30 * i),
+            )
+        )
+    return rows
+
+
+def orm_actions(rows):
+    return [
+        Action(
+            id=f"{i:036d}",
+            lead_id=lead_id,
+            customer_id=customer_id,
+            product_id=product_id,
+            lead_type=lead_type,
+            action_type=action_type,
+            engagement_level=engagement_level,
+            created_at=created_at,
+        )
+        for i, (
+            lead_id,
+            customer_id,
+            product_id,
+            lead_type,
+            action_type,
+            engagement_level,
+            created_at,
+        ) in enumerate(rows)
+    ]
+
+
+def columnar_store(rows):
+    store = ActionStore.from_rows(rows)
+    return store, bill_actions(store)
+
+
+def item_dicts(rows):
+    store, billed = columnar_store(rows)
+    names = {product_id: product_id[:8] for product_id in store.products}
+    return store_report_items(store, billed, "user@example.com", names)
+
+
+def item_models(rows):
+    return [BillingReportItem(**item) for item in item_dicts(rows)]
+
+
+def measured(label: str, count: int, func, *args):
+    # timed untraced; tracemalloc slows allocation-heavy paths down a lot
+    gc.collect()
+    started = time.perf_counter()
+    kept = func(*args)
+    seconds = time.perf_counter() - started
+    del kept
+    gc.collect()
+    tracemalloc.start()
+    kept = func(*args)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"  {label:<34} {allocated / count:8.1f} bytes/action"
+        f"  {seconds * 1000:10.1f} ms"
+    )
+    del kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--actions", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.actions)
+
+    print(f"Memory per action ({args.actions:,} actions)")
+    measured("ORM Action instances", args.actions, orm_actions, rows)
+    measured("report item dicts", args.actions, item_dicts, rows)
+    measured("BillingReportItem models", args.actions, item_models, rows)
+    measured("ActionStore + BilledActions", args.actions, columnar_store, rows)
+    store, billed = columnar_store(rows)
+    print(
+        f"  {'(structured array alone)':<34}"
+        f" {store.nbytes / args.actions:8.1f} bytes/action"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-lead billing cap with billing_cap vs a per-row Python loop
+
+Both bill the same priced, time-ordered actions and must agree on every
+billed amount.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cap [--actions 1000000] [--leads 200000] [--batch 10000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.crud.billing_report_service import billing_cap
+from app.shared import BILLING_CAP
+
+
+def synthetic_priced_actions(count: int, leads: int, seed=7):
+    """Lead codes and amounts in billing order; about a third are duplicates."""
+    rng = np.random.default_rng(seed)
+    lead_codes = rng.integers(0, leads, count)
+    amounts = rng.choice([2.5, 4.5, 6.5, 16.5, 31.5, 46.5], count)
+    amounts[rng.random(count) < 0.3] = 0.0
+    return lead_codes, amounts
+
+
+def loop_cap(lead_codes, amounts, cap=BILLING_CAP):
+    """The per-row running total the vectorized cap replaces."""
+    spent = {}
+    billed = []
+    for lead, amount in zip(lead_codes.tolist(), amounts.tolist()):
+        before = spent.get(lead, 0.0)
+        running = before + amount
+        spent[lead] = running
+        billed.append(min(running, cap) - min(before, cap))
+    return np.array(billed)
+
+
+def vectorized_cap(lead_codes, amounts, cap=BILLING_CAP):
+    return billing_cap(lead_codes, amounts, cap).billed
+
+
+def batched_cap(lead_codes, amounts, batch: int, cap=BILLING_CAP):
+    spent = np.zeros(int(lead_codes.max()) + 1)
+    return np.concatenate(
+        [
+            billing_cap(
+                lead_codes[start : start + batch],
+                amounts[start : start + batch],
+                cap,
+                spent,
+            ).billed
+            for start in range(0, len(amounts), batch)
+        ]
+    )
+
+
+def timed(label: str, count: int, func, *args):
+    started = time.perf_counter()
+    billed = func(*args)
+    seconds = time.perf_counter() - started
+    print(
+        f"  {label:<34} {count:>10,} actions {seconds * 1000:10.1f} ms"
+        f"  {count / seconds / 1e6:7.2f} M actions/s  (${billed.sum():,.2f} billed)"
+    )
+    return billed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--actions", type=int, default=1_000_000)
+    parser.add_argument("--leads", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    args = parser.parse_args()
+
+    lead_codes, amounts = synthetic_priced_actions(args.actions, args.leads)
+
+    print("Billing cap")
+    expected = timed("per-row loop", args.actions, loop_cap, lead_codes, amounts)
+    results = [
+        timed("billing_cap (one pass)", args.actions, vectorized_cap, lead_codes, amounts),
+        timed(
+            f"billing_cap (batches of {args.batch:,})",
+            args.actions,
+            batched_cap,
+            lead_codes,
+            amounts,
+            args.batch,
+        ),
+    ]
+    for billed in results:
+        np.testing.assert_allclose(billed, expected)
+
+
+if __name__ == "__main__":
+    main()
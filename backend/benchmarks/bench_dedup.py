@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Benchmark: duplicate detection with the hash index vs the old linear scan
+
+The linear scan is O(n^2) per product, so it runs on a smaller sample and its
+rate is reported for that sample size only.
+
+Usage (from backend/):
+    python -m benchmarks.bench_dedup [--actions 1000000] [--scan-actions 20000]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.crud.billing_report_service import duplicate_mask
+from app.shared import (
+    ActionTypes,
+    DedupWindows,
+    EngagementLevelTypes,
+    LeadTypes,
+    LEAD_ACTION_COSTS,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+)
+
+
+def duplicate_key(action, window: DedupWindows = DedupWindows.REPORT) -> tuple:
+    """Actions with equal keys are duplicates; only the first one is billed."""
+    key = (
+        action.customer_id,
+        action.product_id,
+        action.lead_type,
+        action.action_type,
+        action.engagement_level,
+    )
+    if window == DedupWindows.MONTH:
+        key += (action.created_at.year, action.created_at.month)
+    return key
+
+
+class DedupIndex:
+    """Hash index of the duplicate keys already billed.
+
+    Keys include the customer, so one index can serve a single report or a
+    batch run over many customers. Actions must be offered in billing order.
+    """
+
+    def __init__(self, window: DedupWindows = DedupWindows.REPORT):
+        self.window = window
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def __contains__(self, action) -> bool:
+        return duplicate_key(action, self.window) in self._seen
+
+    def check_and_add(self, action) -> bool:
+        """Record the action and return True if its key was already billed."""
+        key = duplicate_key(action, self.window)
+        if key in self._seen:
+            return True
+        self._seen.add(key)
+        return False
+
+
+def synthetic_actions(count: int, customers: int = 50, products: int = 200, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    actions = []
+    for i in range(count):
+        lead_type = rng.choice(list(LeadTypes))
+        actions.append(
+            SimpleNamespace(
+                customer_id=f"customer-{rng.randrange(customers)}",
+                product_id=f"product-{rng.randrange(products)}",
+                lead_type=lead_type,
+                action_type=ActionTypes(rng.choice(list(LEAD_ACTION_COSTS[lead_type]))),
+                engagement_level=rng.choice(list(EngagementLevelTypes)),
+                created_at=start + timedelta(seconds=30 * i),
+            )
+        )
+    return actions
+
+
+def linear_scan_duplicates(actions) -> int:
+    """The per-product list scan the index replaced."""
+    processed = {}
+    duplicates = 0
+    for action in actions:
+        product_actions = processed.setdefault(action.product_id, [])
+        for seen in product_actions:
+            if (
+                action.customer_id == seen.customer_id
+                and action.lead_type == seen.lead_type
+                and action.action_type == seen.action_type
+                and action.engagement_level == seen.engagement_level
+            ):
+                duplicates += 1
+                break
+        product_actions.append(action)
+    return duplicates
+
+
+def index_duplicates(actions, window: DedupWindows) -> int:
+    index = DedupIndex(window)
+    return sum(index.check_and_add(action) for action in actions)
+
+
+def mask_duplicates(columns: tuple) -> int:
+    return int(duplicate_mask(*columns).sum())
+
+
+def intern(values) -> np.ndarray:
+    codes = {}
+    return np.fromiter((codes.setdefault(v, len(codes)) for v in values), np.int64)
+
+
+def timed(label: str, count: int, func, *args):
+    started = time.perf_counter()
+    duplicates = func(*args)
+    seconds = time.perf_counter() - started
+    print(
+        f"  {label:<34} {count:>10,} actions {seconds * 1000:10.1f} ms"
+        f"  {count / seconds / 1e6:7.2f} M actions/s  ({duplicates:,} duplicates)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--actions", type=int, default=1_000_000)
+    parser.add_argument("--scan-actions", type=int, default=20_000)
+    args = parser.parse_args()
+
+    actions = synthetic_actions(args.actions)
+    columns = (
+        intern(a.customer_id for a in actions),
+        intern(a.product_id for a in actions),
+        np.fromiter((LEAD_TYPE_CODES[a.lead_type] for a in actions), np.int64),
+        np.fromiter((ACTION_TYPE_CODES[a.action_type] for a in actions), np.int64),
+        np.fromiter(
+            (ENGAGEMENT_LEVEL_CODES[a.engagement_level] for a in actions), np.int64
+        ),
+    )
+    months = np.fromiter(
+        (a.created_at.year * 12 + a.created_at.month for a in actions), np.int64
+    )
+
+    print("Duplicate detection")
+    sample = actions[: args.scan_actions]
+    timed("linear scan", len(sample), linear_scan_duplicates, sample)
+    timed(
+        "hash index (per report)",
+        len(sample),
+        index_duplicates,
+        sample,
+        DedupWindows.REPORT,
+    )
+    timed(
+        "hash index (per report)",
+        len(actions),
+        index_duplicates,
+        actions,
+        DedupWindows.REPORT,
+    )
+    timed(
+        "hash index (per month)",
+        len(actions),
+        index_duplicates,
+        actions,
+        DedupWindows.MONTH,
+    )
+    timed("duplicate_mask (per report)", len(actions), mask_duplicates, columns)
+    timed(
+        "duplicate_mask (per month)", len(actions), mask_duplicates, columns + (months,)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: pricing actions with the precompiled table vs nested dict lookups
+
+Usage (from backend/):
+    python -m benchmarks.bench_pricing [--actions 1000000]
+"""
+
+import argparse
+import random
+import timeit
+
+from app.shared import (
+    ActionTypes,
+    EngagementLevelTypes,
+    LeadTypes,
+    LEAD_ACTION_COSTS,
+    LEAD_TYPE_BASE_VALUES,
+    ENGAGEMENT_MULTIPLIERS,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    calculate_action_value,
+    encode,
+    price_actions,
+)
+
+
+def dict_calculate_action_value(lead_type, action_type, engagement_level) -> float:
+    """The nested dict implementation the pricing table replaced."""
+    base_value = LEAD_TYPE_BASE_VALUES.get(lead_type, 0)
+    action_value = LEAD_ACTION_COSTS.get(lead_type, {}).get(action_type, 0)
+    engagement_multiplier = ENGAGEMENT_MULTIPLIERS.get(engagement_level, 1)
+    return base_value + (action_value * engagement_multiplier)
+
+
+def synthetic_actions(count: int, seed: int = 42) -> list[tuple]:
+    rng = random.Random(seed)
+    lead_types = list(LeadTypes)
+    actions = []
+    for _ in range(count):
+        lead_type = rng.choice(lead_types)
+        action_type = ActionTypes(rng.choice(list(LEAD_ACTION_COSTS[lead_type])))
+        actions.append((lead_type, action_type, rng.choice(list(EngagementLevelTypes))))
+    return actions
+
+
+def best_of(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--actions", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    actions = synthetic_actions(args.actions)
+    lead_codes = encode((a[0] for a in actions), LEAD_TYPE_CODES)
+    action_codes = encode((a[1] for a in actions), ACTION_TYPE_CODES)
+    engagement_codes = encode((a[2] for a in actions), ENGAGEMENT_LEVEL_CODES)
+
+    timings = {
+        "dict lookups (per action)": best_of(
+            lambda: [dict_calculate_action_value(*a) for a in actions], args.repeat
+        ),
+        "pricing table (per action)": best_of(
+            lambda: [calculate_action_value(*a) for a in actions], args.repeat
+        ),
+        "pricing table (batch, codes)": best_of(
+            lambda: price_actions(lead_codes, action_codes, engagement_codes),
+            args.repeat,
+        ),
+    }
+
+    baseline = timings["dict lookups (per action)"]
+    print(f"Pricing {args.actions:,} actions (best of {args.repeat})")
+    for name, seconds in timings.items():
+        print(
+            f"  {name:<30} {seconds * 1000:10.1f} ms"
+            f"  {args.actions / seconds / 1e6:8.1f} M actions/s"
+            f"  x{baseline / seconds:6.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
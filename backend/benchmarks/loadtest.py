@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Load test: replay a stream of requests against the API, latency per route
+
+Streams are JSON lines, one request each:
+
+    {"method": "GET", "path": "/leads", "params": {"limit": 100}, "route": "/leads"}
+
+with an optional "json" body, "headers", and "at", the second of the
+stream the request was recorded at (honoured with --replay-timing).
+"route" groups the results and defaults to the path. --synthesize builds a
+stream over the benchmark's synthetic data instead, mixed per --mix, and
+--record writes it out for later replays.
+
+Requests go to the app in-process through the ASGI transport, against the
+benchmark database (see benchmarks.suite; loaded on first use), or with
+--url to a running server, e.g. a local ``uvicorn app.main:app``. That
+server's database must hold the same synthetic data for a synthesized
+stream: ``python -m benchmarks.suite --only api --database-url URL`` loads it.
+
+Without --rate, --concurrency clients send requests back to back. With
+--rate, requests start at that rate whatever the response times, at most
+--concurrency at a time, and latency counts from the intended start, so a
+saturated server shows up as latency rather than as a lower request rate.
+Errors are responses with 5xx status and requests that failed outright.
+
+Usage (from backend/):
+    python -m benchmarks.loadtest --synthesize 2000 --concurrency 20
+    python -m benchmarks.loadtest --synthesize 2000 --record stream.jsonl
+    python -m benchmarks.loadtest --replay stream.jsonl --rate 200 \\
+        --url http://localhost:8000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.suite import git_revision, prepare_environment
+
+DEFAULT_MIX = "get_leads=4,get_lead=4,billing_report=1,post_leads=1"
+POST_LEADS_BATCH = 10
+
+
+# --- request streams -----------------------------------------------------------
+
+
+def read_stream(path: str) -> list[dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def write_stream(path: str, requests: list[dict]):
+    with open(path, "w") as file:
+        for request in requests:
+            file.write(json.dumps(request) + "\n")
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = weights.keys() - SYNTHESIZERS.keys()
+    if unknown:
+        raise SystemExit(f"Unknown request kinds in --mix: {', '.join(unknown)}")
+    return weights
+
+
+def _get_leads(rng, data, customers, products, serial):
+    from benchmarks.synthetic import customer_id
+
+    params = {"limit": 100}
+    if rng.random() < 0.5:
+        params["customer_id"] = customer_id(rng.randrange(customers))
+    return {"method": "GET", "path": "/leads", "params": params, "route": "/leads"}
+
+
+def _get_lead(rng, data, customers, products, serial):
+    from benchmarks.synthetic import lead_id
+
+    return {
+        "method": "GET",
+        "path": f"/leads/{lead_id(rng.randrange(data.lead_count))}",
+        "route": "/leads/{lead_id}",
+    }
+
+
+def _billing_report(rng, data, customers, products, serial):
+    from benchmarks.synthetic import customer_id
+
+    month = rng.randrange(1, 7)
+    return {
+        "method": "GET",
+        "path": "/billingReports",
+        "params": {
+            "customer_id": customer_id(rng.randrange(customers)),
+            "start_date": f"2025-{month:02d}-01T00:00:00",
+            "end_date": f"2025-{month:02d}-28T23:59:59",
+        },
+        "route": "/billingReports",
+    }
+
+
+def _post_leads(rng, data, customers, products, serial):
+    from benchmarks.synthetic import lead_payloads
+
+    return {
+        "method": "POST",
+        "path": "/leads/",
+        "json": lead_payloads(
+            POST_LEADS_BATCH,
+            f"load-{os.getpid()}-{serial}",
+            customers,
+            products,
+            seed=serial,
+        ),
+        "route": "/leads/",
+    }
+
+
+SYNTHESIZERS = {
+    "get_leads": _get_leads,
+    "get_lead": _get_lead,
+    "billing_report": _billing_report,
+    "post_leads": _post_leads,
+}
+
+
+def synthesize(count: int, mix: dict, data, customers, products, seed=7) -> list:
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    return [
+        SYNTHESIZERS[kind](rng, data, customers, products, serial)
+        for serial, kind in enumerate(rng.choices(kinds, weights, k=count))
+    ]
+
+
+# --- load generation -----------------------------------------------------------
+
+
+class Outcome:
+    __slots__ = ("route", "status", "seconds")
+
+    def __init__(self, route, status, seconds):
+        self.route = route
+        self.status = status  # None when the request failed outright
+        self.seconds = seconds
+
+
+async def send(client, request: dict, started: float) -> Outcome:
+    import httpx
+
+    try:
+        response = await client.request(
+            request.get("method", "GET"),
+            request["path"],
+            params=request.get("params"),
+            json=request.get("json"),
+            headers=request.get("headers"),
+        )
+        status = response.status_code
+    except httpx.HTTPError:
+        status = None
+    return Outcome(
+        request.get("route", request["path"]), status, time.perf_counter() - started
+    )
+
+
+async def closed_loop(client, requests: list, concurrency: int) -> list[Outcome]:
+    """``concurrency`` clients, each sending its next request on a response."""
+    pending = iter(requests)
+    outcomes = []
+
+    async def client_loop():
+        for request in pending:
+            outcomes.append(await send(client, request, time.perf_counter()))
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return outcomes
+
+
+async def open_loop(
+    client, requests: list, concurrency: int, rate: float = None
+) -> list[Outcome]:
+    """Start requests on schedule: at ``rate`` per second, or at their "at"."""
+    slots = asyncio.Semaphore(concurrency)
+    began = time.perf_counter()
+    first_at = requests[0].get("at", 0) if requests else 0
+
+    async def scheduled(request, start_at):
+        async with slots:
+            return await send(client, request, start_at)
+
+    tasks = []
+    for position, request in enumerate(requests):
+        offset = position / rate if rate else request.get("at", 0) - first_at
+        start_at = began + offset
+        delay = start_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(scheduled(request, start_at)))
+    return list(await asyncio.gather(*tasks))
+
+
+# --- report --------------------------------------------------------------------
+
+
+def summarize(outcomes: list[Outcome], wall_seconds: float) -> list[dict]:
+    """Per route figures, then one line for all routes together."""
+    by_route = {}
+    for outcome in outcomes:
+        by_route.setdefault(outcome.route, []).append(outcome)
+    rows = []
+    for route, route_outcomes in sorted(by_route.items()) + [("all", outcomes)]:
+        if not route_outcomes:
+            continue
+        latencies = np.array([outcome.seconds for outcome in route_outcomes]) * 1000
+        statuses = [outcome.status for outcome in route_outcomes]
+        errors = sum(status is None or status >= 500 for status in statuses)
+        client_errors = sum(
+            status is not None and 400 <= status < 500 for status in statuses
+        )
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+        rows.append(
+            {
+                "route": route,
+                "requests": len(route_outcomes),
+                "errors": errors,
+                "error_rate": errors / len(route_outcomes),
+                "client_errors": client_errors,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "max_ms": float(latencies.max()),
+                "requests_per_second": len(route_outcomes) / wall_seconds,
+            }
+        )
+    return rows
+
+
+def print_summary(rows: list[dict], wall_seconds: float):
+    print(
+        f"{'route':<24} {'requests':>8} {'req/s':>8} {'errors':>7}"
+        f" {'4xx':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['route']:<24} {row['requests']:>8} "
+            f"{row['requests_per_second']:>8.1f} {row['error_rate']:>7.1%}"
+            f" {row['client_errors']:>5} {row['p50_ms']:>9.1f}"
+            f" {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}"
+        )
+    print(f"{wall_seconds:.1f} s")
+
+
+# --- main ----------------------------------------------------------------------
+
+
+async def run(args, requests: list, data) -> tuple[list[Outcome], float]:
+    import httpx
+
+    engine = None
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        )
+    else:
+        from app.core.database import async_engine
+        from app.main import app
+
+        engine = async_engine
+        await prepare_database(args, data)
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://loadtest",
+            timeout=args.timeout,
+        )
+
+    began = time.perf_counter()
+    try:
+        async with client:
+            if args.rate or args.replay_timing:
+                outcomes = await open_loop(
+                    client, requests, args.concurrency, args.rate
+                )
+            else:
+                outcomes = await closed_loop(client, requests, args.concurrency)
+    finally:
+        if engine is not None:
+            await engine.dispose()
+    return outcomes, time.perf_counter() - began
+
+
+async def prepare_database(args, data):
+    from app.core.database import async_engine, async_session
+    from benchmarks.suite import load_database, use_sqlite_functions
+
+    if async_engine.dialect.name == "sqlite":
+        use_sqlite_functions(async_engine)
+    await load_database(
+        async_engine, async_session, data, args.customers, args.products
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", metavar="JSONL", help="stream to replay")
+    source.add_argument("--synthesize", type=int, metavar="N", help="N requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"default: {DEFAULT_MIX}")
+    parser.add_argument("--record", metavar="JSONL", help="write the stream and exit")
+    parser.add_argument("--scale", choices=["10k", "1m", "10m"], default="10k")
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--url", help="a running server; default: in-process")
+    parser.add_argument("--database-url", help="in-process only; default: SQLite")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rate", type=float, help="requests per second")
+    parser.add_argument("--replay-timing", action="store_true")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", metavar="JSON", help="write the summary here")
+    args = parser.parse_args()
+
+    database_url = None
+    if not args.url:
+        database_url = prepare_environment(args.database_url, args.scale)
+
+    from benchmarks.synthetic import SCALES, synthetic_data
+
+    data = None
+    if args.synthesize:
+        data = synthetic_data(SCALES[args.scale], args.customers, args.products)
+        mix = parse_mix(args.mix)
+        on_sqlite = database_url and database_url.startswith("sqlite")
+        if on_sqlite and mix.pop("post_leads", None):
+            print("post_leads left out of the mix: ingestion needs PostgreSQL")
+        requests = synthesize(
+            args.synthesize, mix, data, args.customers, args.products
+        )
+    else:
+        requests = read_stream(args.replay)
+
+    if args.record:
+        write_stream(args.record, requests)
+        print(f"{len(requests)} requests written to {args.record}")
+        return
+
+    if not args.url and data is None:
+        data = synthetic_data(SCALES[args.scale], args.customers, args.products)
+
+    outcomes, wall_seconds = asyncio.run(run(args, requests, data))
+    rows = summarize(outcomes, wall_seconds)
+    print_summary(rows, wall_seconds)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    **git_revision(),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "target": args.url or database_url.split(":", 1)[0],
+                    "concurrency": args.concurrency,
+                    "rate": args.rate,
+                    "seconds": wall_seconds,
+                    "routes": rows,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
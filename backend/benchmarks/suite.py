@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: billing engine and API endpoints on synthetic data
+
+Runs every case at one scale of synthetic data (see benchmarks.synthetic)
+and writes the timings, with the commit they were taken at, to a JSON file
+under benchmarks/results/ for comparison across commits.
+
+In-memory cases time pricing, duplicate detection and billing over the whole
+data set. API cases send requests through the ASGI app to a database holding
+the same data: PostgreSQL with --database-url, or by default a SQLite file
+stand-in under benchmarks/.data/, kept between runs of the same scale.
+POST /leads/ needs PostgreSQL and is skipped on SQLite.
+
+Usage (from backend/):
+    python -m benchmarks.suite [--scale 10k|1m|10m] [--database-url URL]
+        [--repeat 5] [--only pricing,dedup,...] [--compare results/OLD.json]
+    python -m benchmarks.suite --compare OLD.json NEW.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+DATA_DIR = os.path.join(BENCHMARKS_DIR, ".data")
+
+INSERT_CHUNK = 20_000
+LEADS_PAGE = 1_000
+INGEST_BATCH = 500
+
+
+class Case:
+    def __init__(self, group, name, count: int, unit: str, run, setup=None):
+        self.group = group
+        self.name = name
+        self.count = count
+        self.unit = unit
+        self.run = run  # async callable, given the value of setup()
+        self.setup = setup  # called before every run, untimed
+
+
+async def measure(case: Case, repeat: int, warmup: int = 1) -> dict:
+    seconds = []
+    for iteration in range(warmup + repeat):
+        arg = case.setup() if case.setup else None
+        started = time.perf_counter()
+        await case.run(arg)
+        elapsed = time.perf_counter() - started
+        if iteration >= warmup:
+            seconds.append(elapsed)
+    median = statistics.median(seconds)
+    result = {
+        "name": f"{case.group}.{case.name}",
+        "count": case.count,
+        "unit": case.unit,
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": median,
+        "per_second": case.count / median if median else None,
+    }
+    print(
+        f"  {result['name']:<42} {median * 1000:10.1f} ms"
+        f"  {result['per_second']:14,.0f} {case.unit}/s"
+    )
+    return result
+
+
+# --- in-memory cases ---------------------------------------------------------
+
+
+def engine_cases(data) -> list[Case]:
+    import numpy as np
+
+    from app.crud.action_store import bill_actions
+    from app.crud.billing_report_service import duplicate_mask
+    from app.shared import DedupWindows, calculate_action_value, price_actions
+    from benchmarks.synthetic import ACTION_TYPES, ENGAGEMENT_LEVELS, LEAD_TYPES
+
+    store = data.store
+    actions = store.actions
+    count = len(store)
+    members = (
+        [LEAD_TYPES[code] for code in actions["lead_type"].tolist()],
+        [ACTION_TYPES[code] for code in actions["action_type"].tolist()],
+        [ENGAGEMENT_LEVELS[code] for code in actions["engagement_level"].tolist()],
+    )
+    keys = (
+        actions["customer"],
+        actions["product"],
+        actions["lead_type"],
+        actions["action_type"],
+        actions["engagement_level"],
+    )
+    months = store.month_codes()
+
+    async def per_row(_):
+        for lead_type, action_type, engagement_level in zip(*members):
+            calculate_action_value(lead_type, action_type, engagement_level)
+
+    async def vectorized(_):
+        price_actions(
+            actions["lead_type"], actions["action_type"], actions["engagement_level"]
+        )
+
+    async def dedup_report(_):
+        duplicate_mask(*keys)
+
+    async def dedup_month(_):
+        duplicate_mask(*keys, months)
+
+    async def bill(window):
+        bill_actions(store, window)
+
+    return [
+        Case("pricing", "calculate_action_value", count, "actions", per_row),
+        Case("pricing", "price_actions", count, "actions", vectorized),
+        Case("dedup", "duplicate_mask_report", count, "actions", dedup_report),
+        Case("dedup", "duplicate_mask_month", count, "actions", dedup_month),
+        Case(
+            "engine",
+            "bill_actions_report",
+            count,
+            "actions",
+            bill,
+            lambda: DedupWindows.REPORT,
+        ),
+        Case(
+            "engine",
+            "bill_actions_month",
+            count,
+            "actions",
+            bill,
+            lambda: DedupWindows.MONTH,
+        ),
+    ]
+
+
+# --- database ----------------------------------------------------------------
+
+
+def use_sqlite_functions(engine):
+    """Register the PostgreSQL functions the report queries use on SQLite."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def register(dbapi_connection, connection_record):
+        dbapi_connection.create_function("least", -1, lambda *values: min(values))
+
+
+async def load_database(engine, session_factory, data, customers, products):
+    """Create the schema and write ``data`` unless it is already there."""
+    from sqlalchemy import func, insert, select
+
+    from app.crud.billing_rollup_service import rebuild_billing_rollups
+    from app.models import Action, Customer, Lead, ModelBase, Product
+    from benchmarks.synthetic import action_rows, lead_rows, reference_rows
+
+    async with engine.begin() as connection:
+        await connection.run_sync(ModelBase.metadata.create_all)
+        stored = await connection.scalar(select(func.count()).select_from(Action))
+    if stored == data.action_count:
+        print(f"Reusing {stored:,} actions in the database")
+        return
+
+    print(f"Loading {data.action_count:,} actions into the database...")
+    started = time.perf_counter()
+    async with engine.begin() as connection:
+        await connection.run_sync(ModelBase.metadata.drop_all)
+        await connection.run_sync(ModelBase.metadata.create_all)
+    customer_rows, product_rows = reference_rows(customers, products)
+    async with engine.begin() as connection:
+        await connection.execute(insert(Customer), customer_rows)
+        await connection.execute(insert(Product), product_rows)
+    for rows, table, total in (
+        (lead_rows, Lead, data.lead_count),
+        (action_rows, Action, data.action_count),
+    ):
+        for start in range(0, total, INSERT_CHUNK):
+            async with engine.begin() as connection:
+                await connection.execute(
+                    insert(table), rows(data, start, start + INSERT_CHUNK)
+                )
+    if engine.dialect.name == "postgresql":
+        async with session_factory() as session:
+            await rebuild_billing_rollups(session)
+    print(f"Loaded in {time.perf_counter() - started:.1f} s")
+
+
+# --- API cases ---------------------------------------------------------------
+
+
+def api_cases(client, data, dialect: str, customers, products) -> list[Case]:
+    from benchmarks.synthetic import customer_id, lead_payloads
+
+    customer = customer_id(0)
+    customer_actions = int((data.store.actions["customer"] == 0).sum())
+    pages = max(1, min(20, data.lead_count // LEADS_PAGE))
+    report_runs = iter(range(1_000_000))
+
+    async def get(url: str, **params):
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+        return response
+
+    async def walk_leads(include):
+        cursor = None
+        for _ in range(pages):
+            params = {"limit": LEADS_PAGE, **include}
+            if cursor:
+                params["cursor"] = cursor
+            cursor = (await get("/leads", **params)).json()["next_cursor"]
+            if cursor is None:
+                break
+
+    def fresh_range():
+        # a new end date per run, so no stored report snapshot matches
+        end = datetime(2026, 1, 1) + timedelta(milliseconds=next(report_runs))
+        return {"start_date": "2025-01-01T00:00:00", "end_date": end.isoformat()}
+
+    async def billing_report(dates, **params):
+        await get("/billingReports", customer_id=customer, **dates, **params)
+
+    async def report_totals(dates):
+        await billing_report(dates)
+
+    async def report_items(dates):
+        await billing_report(dates, include_items="true")
+
+    async def ingest(payloads):
+        for start in range(0, len(payloads), INGEST_BATCH):
+            response = await client.post(
+                "/leads/", json=payloads[start : start + INGEST_BATCH]
+            )
+            response.raise_for_status()
+
+    ingest_runs = iter(range(1_000_000))
+    ingest_leads = min(10_000, data.lead_count)
+    snapshot_dates = fresh_range()
+
+    cases = [
+        Case("api", "get_leads", pages * LEADS_PAGE, "leads", walk_leads, dict),
+        Case(
+            "api",
+            "get_leads_with_actions",
+            pages * LEADS_PAGE,
+            "leads",
+            walk_leads,
+            lambda: {"include": "actions"},
+        ),
+        Case(
+            "api",
+            "billing_report",
+            customer_actions,
+            "actions",
+            report_totals,
+            fresh_range,
+        ),
+        Case(
+            "api",
+            "billing_report_items",
+            customer_actions,
+            "actions",
+            report_items,
+            fresh_range,
+        ),
+        Case(
+            "api",
+            "billing_report_snapshot",
+            customer_actions,
+            "actions",
+            report_totals,
+            lambda: snapshot_dates,
+        ),
+    ]
+    if dialect == "postgresql":
+        cases.append(
+            Case(
+                "api",
+                "post_leads",
+                ingest_leads,
+                "leads",
+                ingest,
+                lambda: lead_payloads(
+                    ingest_leads,
+                    f"bench-{os.getpid()}-{next(ingest_runs)}",
+                    customers,
+                    products,
+                ),
+            )
+        )
+    else:
+        print("  (api.post_leads skipped: ingestion needs PostgreSQL)")
+    return cases
+
+
+# --- results -----------------------------------------------------------------
+
+
+def git_revision() -> dict:
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, cwd=BENCHMARKS_DIR
+        ).stdout.strip()
+
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "-s"))}
+
+
+def save_results(results: list[dict], meta: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(
+        RESULTS_DIR, f"{stamp}-{meta['scale']}-{meta['commit'][:8] or 'nogit'}.json"
+    )
+    with open(path, "w") as file:
+        json.dump({**meta, "results": results}, file, indent=2)
+    return path
+
+
+def compare(old_path: str, new_path: str):
+    """Print the median time of each case in ``new_path`` relative to ``old_path``."""
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    old_medians = {result["name"]: result["median"] for result in old["results"]}
+    print(
+        f"{old['commit'][:8]} ({old['scale']}, {old['database']}) -> "
+        f"{new['commit'][:8]} ({new['scale']}, {new['database']})"
+    )
+    for result in new["results"]:
+        before = old_medians.get(result["name"])
+        change = f"{result['median'] / before:6.2f}x" if before else "   new"
+        print(f"  {result['name']:<42} {result['median'] * 1000:10.1f} ms  {change}")
+
+
+# --- main --------------------------------------------------------------------
+
+
+async def run(args) -> list[dict]:
+    import httpx
+    from sqlalchemy import exc
+
+    from app.core.database import async_engine, async_session
+    from app.main import app
+    from benchmarks.synthetic import synthetic_data
+
+    data = synthetic_data(args.actions, args.customers, args.products)
+    print(
+        f"Synthetic data: {data.action_count:,} actions, {data.lead_count:,} leads,"
+        f" {args.customers} customers, {args.products} products"
+    )
+    groups = set(args.only.split(",")) if args.only else None
+    results = []
+
+    cases = engine_cases(data)
+    dialect = async_engine.dialect.name
+    if groups is None or "api" in groups:
+        if dialect == "sqlite":
+            use_sqlite_functions(async_engine)
+        await load_database(
+            async_engine, async_session, data, args.customers, args.products
+        )
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://bench",
+            timeout=None,
+        )
+        cases += api_cases(client, data, dialect, args.customers, args.products)
+
+    try:
+        for case in cases:
+            if groups is not None and case.group not in groups:
+                continue
+            try:
+                results.append(await measure(case, args.repeat))
+            except (httpx.HTTPStatusError, exc.SQLAlchemyError) as e:
+                print(f"  {case.group}.{case.name} failed: {e}")
+    finally:
+        await async_engine.dispose()
+    return results
+
+
+def prepare_environment(database_url: str, scale: str) -> str:
+    """Point the app at the benchmark database; call before importing it.
+
+    Defaults to the SQLite stand-in for ``scale``; returns the URL used.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    database_url = database_url or (
+        f"sqlite+aiosqlite:///{os.path.join(DATA_DIR, f'bench-{scale}.db')}"
+    )
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["REPORT_STORAGE"] = "local"
+    os.environ["REPORT_STORAGE_PATH"] = tempfile.mkdtemp(prefix="bench-reports-")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    return database_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", choices=["10k", "1m", "10m"], default="10k")
+    parser.add_argument("--actions", type=int, help="overrides --scale")
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--database-url")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", help="comma-separated groups: pricing,dedup,engine,api"
+    )
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS_JSON")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        compare(*args.compare)
+        return
+
+    scale = str(args.actions) if args.actions else args.scale
+    database_url = prepare_environment(args.database_url, scale)
+    from benchmarks.synthetic import SCALES
+
+    args.actions = args.actions or SCALES[args.scale]
+
+    results = asyncio.run(run(args))
+
+    import numpy as np
+
+    meta = {
+        **git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "scale": scale,
+        "actions": args.actions,
+        "database": database_url.split(":", 1)[0],
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+    }
+    path = save_results(results, meta)
+    print(f"Results written to {os.path.relpath(path)}")
+    if args.compare:
+        compare(args.compare[0], path)
+
+
+if __name__ == "__main__":
+    main()
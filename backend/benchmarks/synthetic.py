@@ -0,0 +1,328 @@
+"""Synthetic leads and actions for the benchmark suite.
+
+Leads are scaled up from the shape of ``app/fixtures/sample_leads.json``:
+each synthetic lead copies a sample lead's type, number of actions and
+their spacing, and keeps each sample action's type and engagement level
+half of the time, drawing any other action valid for the lead type
+otherwise. Sample action types that are not priced for their lead type are
+replaced by one that is. Leads are spread at random over ``months`` whole
+months from January 2025, all closed, and over ``customers`` customers and
+``products`` products.
+
+Everything is generated as NumPy columns, so 10M actions fit in memory;
+rows, database inserts and request payloads are built chunk by chunk.
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from app.crud.action_store import ACTION_DTYPE, ActionStore
+from app.shared import (
+    ActionTypes,
+    EngagementLevelTypes,
+    LeadTypes,
+    LEAD_ACTION_COSTS,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    LEAD_TYPE_CODES,
+    price_actions,
+)
+
+SAMPLE_LEADS = os.path.join(
+    os.path.dirname(__file__), "..", "app", "fixtures", "sample_leads.json"
+)
+SCALES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+START = datetime(2025, 1, 1)
+
+# code -> member; codes are enum positions, see app.shared.pricing
+LEAD_TYPES = list(LeadTypes)
+ACTION_TYPES = list(ActionTypes)
+ENGAGEMENT_LEVELS = list(EngagementLevelTypes)
+
+# valid action codes per lead type code, padded; and how many are valid
+_VALID_ACTIONS = np.zeros((len(LEAD_TYPES), len(ACTION_TYPES)), dtype=np.uint8)
+_VALID_ACTION_COUNTS = np.zeros(len(LEAD_TYPES), dtype=np.int64)
+for _lead_type, _costs in LEAD_ACTION_COSTS.items():
+    _codes = [ACTION_TYPE_CODES[ActionTypes(action)] for action in _costs]
+    _VALID_ACTIONS[LEAD_TYPE_CODES[_lead_type], : len(_codes)] = _codes
+    _VALID_ACTION_COUNTS[LEAD_TYPE_CODES[_lead_type]] = len(_codes)
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def load_templates(path: str = SAMPLE_LEADS) -> list[dict]:
+    """Sample leads as codes and action offsets in seconds from the lead."""
+    with open(path) as file:
+        sample = json.load(file)
+    templates = []
+    for lead in sample:
+        lead_type = LeadTypes(lead["lead_type"])
+        valid = list(LEAD_ACTION_COSTS[lead_type])
+        created_at = _parse_time(lead["created_at"])
+        actions = []
+        for position, action in enumerate(lead["actions"]):
+            action_type = action["action_type"]
+            if action_type not in valid:
+                action_type = valid[position % len(valid)]
+            actions.append(
+                (
+                    (_parse_time(action["timestamp"]) - created_at).total_seconds(),
+                    ACTION_TYPE_CODES[ActionTypes(action_type)],
+                    ENGAGEMENT_LEVEL_CODES[
+                        EngagementLevelTypes(action["engagement_level"])
+                    ],
+                )
+            )
+        templates.append(
+            {"lead_type": LEAD_TYPE_CODES[lead_type], "actions": actions}
+        )
+    return templates
+
+
+class SyntheticData:
+    """Leads and their actions as columns, actions in billing order."""
+
+    def __init__(self, leads: np.ndarray, store: ActionStore):
+        # lead columns: customer, product, lead_type codes and created_at
+        self.leads = leads
+        self.store = store
+
+    @property
+    def lead_count(self) -> int:
+        return len(self.leads)
+
+    @property
+    def action_count(self) -> int:
+        return len(self.store)
+
+
+def lead_id(code: int) -> str:
+    return f"lead-{code:012d}"
+
+
+def customer_id(code: int) -> str:
+    return f"customer-{code:06d}"
+
+
+def product_id(code: int) -> str:
+    return f"product-{code:06d}"
+
+
+def action_id(position: int) -> str:
+    return f"action-{position:012d}"
+
+
+LEAD_DTYPE = np.dtype(
+    [
+        ("customer", np.int32),
+        ("product", np.int32),
+        ("lead_type", np.uint8),
+        ("created_at", "datetime64[us]"),
+    ]
+)
+
+
+def synthetic_data(
+    actions: int,
+    customers: int = 10,
+    products: int = 50,
+    months: int = 6,
+    seed: int = 7,
+    templates: list[dict] = None,
+) -> SyntheticData:
+    """About ``actions`` actions, in whole leads."""
+    rng = np.random.default_rng(seed)
+    templates = templates or load_templates()
+    per_template = np.array([len(t["actions"]) for t in templates])
+    lead_count = max(1, round(actions / per_template.mean()))
+
+    # flattened template actions, and where each template's actions start
+    flat = np.array(
+        [action for template in templates for action in template["actions"]]
+    )
+    first_action = np.concatenate([[0], np.cumsum(per_template)[:-1]])
+
+    leads = np.zeros(lead_count, dtype=LEAD_DTYPE)
+    template = rng.integers(0, len(templates), lead_count)
+    leads["customer"] = rng.integers(0, customers, lead_count)
+    leads["product"] = rng.integers(0, products, lead_count)
+    leads["lead_type"] = np.array([t["lead_type"] for t in templates])[template]
+    span_us = int((months * 30.4 * 24 * 3600) * 1e6)
+    created_us = np.sort(rng.integers(0, span_us, lead_count))
+    leads["created_at"] = np.datetime64(START, "us") + created_us.astype(
+        "timedelta64[us]"
+    )
+
+    counts = per_template[template]
+    action_lead = np.repeat(np.arange(lead_count), counts)
+    first_of_lead = np.repeat(np.cumsum(counts) - counts, counts)
+    position = np.arange(len(action_lead)) - first_of_lead
+    source = flat[first_action[template][action_lead] + position]
+    lead_type = leads["lead_type"][action_lead]
+
+    # keep the sample action half of the time, else any valid one
+    choice = rng.random(len(action_lead)) * _VALID_ACTION_COUNTS[lead_type]
+    drawn = _VALID_ACTIONS[lead_type, choice.astype(np.int64)]
+    keep = rng.random(len(action_lead)) < 0.5
+    action_type = np.where(keep, source[:, 1], drawn)
+    engagement = np.where(
+        keep, source[:, 2], rng.integers(0, len(ENGAGEMENT_LEVELS), len(action_lead))
+    )
+    created_at = leads["created_at"][action_lead] + (source[:, 0] * 1e6).astype(
+        "timedelta64[us]"
+    )
+
+    order = np.argsort(created_at, kind="stable")
+    store_actions = np.zeros(len(order), dtype=ACTION_DTYPE)
+    store_actions["lead"] = action_lead[order]
+    store_actions["customer"] = leads["customer"][action_lead][order]
+    store_actions["product"] = leads["product"][action_lead][order]
+    store_actions["lead_type"] = lead_type[order]
+    store_actions["action_type"] = action_type[order]
+    store_actions["engagement_level"] = engagement[order]
+    store_actions["created_at"] = created_at[order]
+    store = ActionStore(
+        store_actions,
+        _LazyIds(lead_id, lead_count),
+        [customer_id(code) for code in range(customers)],
+        [product_id(code) for code in range(products)],
+    )
+    return SyntheticData(leads, store)
+
+
+class _LazyIds:
+    """Id strings of dense codes, made on access rather than all up front."""
+
+    def __init__(self, make, count: int):
+        self.make = make
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, code: int) -> str:
+        return self.make(code)
+
+
+def _datetimes(values: np.ndarray) -> list[datetime]:
+    return values.astype("datetime64[us]").astype(datetime).tolist()
+
+
+def lead_rows(data: SyntheticData, start: int, stop: int) -> list[dict]:
+    leads = data.leads[start:stop]
+    return [
+        {
+            "id": lead_id(code),
+            "customer_id": customer_id(customer),
+            "product_id": product_id(product),
+            "lead_type": LEAD_TYPES[lead_type],
+            "created_at": created_at,
+        }
+        for code, customer, product, lead_type, created_at in zip(
+            range(start, stop),
+            leads["customer"].tolist(),
+            leads["product"].tolist(),
+            leads["lead_type"].tolist(),
+            _datetimes(leads["created_at"]),
+        )
+    ]
+
+
+def action_rows(data: SyntheticData, start: int, stop: int) -> list[dict]:
+    actions = data.store.actions[start:stop]
+    amounts = price_actions(
+        actions["lead_type"], actions["action_type"], actions["engagement_level"]
+    )
+    return [
+        {
+            "id": action_id(position),
+            "lead_id": lead_id(lead),
+            "customer_id": customer_id(customer),
+            "product_id": product_id(product),
+            "lead_type": LEAD_TYPES[lead_type],
+            "action_type": ACTION_TYPES[action_type],
+            "engagement_level": ENGAGEMENT_LEVELS[engagement_level],
+            "created_at": created_at,
+            "cost_amount": amount,
+        }
+        for (
+            position,
+            lead,
+            customer,
+            product,
+            lead_type,
+            action_type,
+            engagement_level,
+            created_at,
+            amount,
+        ) in zip(
+            range(start, stop),
+            actions["lead"].tolist(),
+            actions["customer"].tolist(),
+            actions["product"].tolist(),
+            actions["lead_type"].tolist(),
+            actions["action_type"].tolist(),
+            actions["engagement_level"].tolist(),
+            _datetimes(actions["created_at"]),
+            amounts.tolist(),
+        )
+    ]
+
+
+def lead_payloads(
+    count: int, prefix: str, customers: int = 10, products: int = 50, seed: int = 11
+) -> list[dict]:
+    """``POST /leads/`` bodies for ``count`` new leads with ids under ``prefix``."""
+    templates = load_templates()
+    per_lead = sum(len(t["actions"]) for t in templates) / len(templates)
+    data = synthetic_data(
+        round(count * per_lead), customers, products, 1, seed, templates
+    )
+    actions_by_lead = {}
+    actions = data.store.actions
+    for lead, action_type, engagement_level, created_at in zip(
+        actions["lead"].tolist(),
+        actions["action_type"].tolist(),
+        actions["engagement_level"].tolist(),
+        actions["created_at"].astype("datetime64[us]").astype(str).tolist(),
+    ):
+        actions_by_lead.setdefault(lead, []).append(
+            {
+                "action_type": ACTION_TYPES[action_type].value,
+                "engagement_level": ENGAGEMENT_LEVELS[engagement_level].value,
+                "created_at": created_at,
+            }
+        )
+    return [
+        {
+            "id": f"{prefix}-{code:012d}",
+            "customer_id": row["customer_id"],
+            "product_id": row["product_id"],
+            "lead_type": row["lead_type"].value,
+            "created_at": row["created_at"].isoformat(),
+            "actions": actions_by_lead.get(code, []),
+        }
+        for code, row in enumerate(lead_rows(data, 0, min(count, data.lead_count)))
+    ]
+
+
+def reference_rows(customers: int = 10, products: int = 50):
+    return (
+        [
+            {
+                "id": customer_id(code),
+                "name": f"Customer {code}",
+                "email": f"billing+{code}@example.com",
+            }
+            for code in range(customers)
+        ],
+        [
+            {"id": product_id(code), "name": f"Product {code}"}
+            for code in range(products)
+        ],
+    )
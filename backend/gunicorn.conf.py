@@ -1,12 +1,34 @@
 import multiprocessing
+import os
+import shutil
 
 # Bind to the specified host and port
 bind = "0.0.0.0:8080"
 
-# Automatically determine the number of workers based on CPU count
-workers = multiprocessing.cpu_count() * 2 + 1
+# Automatically determine the number of workers based on CPU count, unless
+# WEB_CONCURRENCY is set. Each worker has its own connection pool, so a host
+# can open up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
 
 # Log level
 loglevel = "info"
 
+# Workers write their Prometheus metrics here, so that GET /metrics can
+# aggregate all of them; must be set before the app is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def on_starting(server):
+    # files of a previous run would be counted again
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
 # Other gunicorn settings can be added here as needed
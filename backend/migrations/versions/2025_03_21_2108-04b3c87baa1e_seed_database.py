@@ -144,9 +144,6 @@ def upgrade():
                         ).name,
                         created_at=fake.date_time_this_decade(),
                     )
-                    lead.actions.append(action)
-                    customer.actions.append(action)
-                    product.actions.append(action)
                     session.add(action)
                     session.commit()
 
@@ -0,0 +1,111 @@
+"""Partition actions by created_at month
+
+Revision ID: e2f6b81c09d4
+Revises: a4d93e17c5b8
+Create Date: 2026-10-18 10:00:41.337290
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = 'e2f6b81c09d4'
+down_revision = 'a4d93e17c5b8'
+branch_labels = None
+depends_on = None
+
+ACTION_COLUMNS = "id, lead_id, customer_id, product_id, billing_report_id, lead_type, action_type, engagement_level, created_at, cost_amount, is_duplicate, status"
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "a4d93e17c5b8":
+            raise Exception(f"Expected version a4d93e17c5b8 but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def create_actions_table(name, primary_key, **kw):
+    op.create_table(name,
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('lead_id', sa.String(), nullable=False),
+    sa.Column('customer_id', sa.String(), nullable=False),
+    sa.Column('product_id', sa.String(), nullable=False),
+    sa.Column('billing_report_id', sa.String(), nullable=True),
+    sa.Column('lead_type', postgresql.ENUM(name='leadtypes', create_type=False), nullable=False),
+    sa.Column('action_type', postgresql.ENUM(name='actiontypes', create_type=False), nullable=False),
+    sa.Column('engagement_level', postgresql.ENUM(name='engagementleveltypes', create_type=False), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('cost_amount', sa.Numeric(), nullable=True),
+    sa.Column('is_duplicate', sa.Boolean(), nullable=True),
+    sa.Column('status', postgresql.ENUM(name='billablestatus', create_type=False), nullable=True),
+    sa.ForeignKeyConstraint(['billing_report_id'], ['billing_reports.id'], ),
+    sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+    sa.ForeignKeyConstraint(['lead_id'], ['leads.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint(*primary_key, name='actions_pkey'),
+    **kw
+    )
+
+def create_actions_indexes():
+    op.create_index(op.f('ix_actions_billing_report_id'), 'actions', ['billing_report_id'], unique=False)
+    op.create_index(op.f('ix_actions_id'), 'actions', ['id'], unique=False)
+    op.create_index(op.f('ix_actions_lead_id'), 'actions', ['lead_id'], unique=False)
+    op.create_index(op.f('ix_actions_product_id'), 'actions', ['product_id'], unique=False)
+    op.create_index('ix_actions_customer_id_created_at', 'actions', ['customer_id', 'created_at'], unique=False, postgresql_include=['id', 'product_id', 'lead_type', 'action_type', 'engagement_level'])
+    op.create_index('ix_actions_created_at_brin', 'actions', ['created_at'], unique=False, postgresql_using='brin')
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to e2f6b81c09d4")
+    try:
+        check_version(connection)
+        # Postgres cannot partition a table in place: rebuild it as a
+        # partitioned table and copy the rows over.
+        op.rename_table('actions', 'actions_unpartitioned')
+        op.execute("ALTER TABLE actions_unpartitioned RENAME CONSTRAINT actions_pkey TO actions_unpartitioned_pkey")
+        for index in ['ix_actions_billing_report_id', 'ix_actions_id', 'ix_actions_lead_id', 'ix_actions_product_id', 'ix_actions_customer_id_created_at', 'ix_actions_created_at_brin']:
+            op.drop_index(index, table_name='actions_unpartitioned')
+
+        # created_at is the partition key, so it has to be part of the primary key
+        create_actions_table('actions', ['id', 'created_at'], postgresql_partition_by='RANGE (created_at)')
+        op.execute("CREATE TABLE actions_default PARTITION OF actions DEFAULT")
+        months = connection.execute(text("SELECT DISTINCT date_trunc('month', created_at)::date FROM actions_unpartitioned")).scalars()
+        for month in months:
+            upper = month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+            op.execute(f"CREATE TABLE actions_{month:%Y_%m} PARTITION OF actions FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')")
+        op.execute(f"INSERT INTO actions ({ACTION_COLUMNS}) SELECT {ACTION_COLUMNS} FROM actions_unpartitioned")
+        op.drop_table('actions_unpartitioned')
+        create_actions_indexes()
+        logger.info("Successfully applied upgrade to e2f6b81c09d4")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to e2f6b81c09d4: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to e2f6b81c09d4")
+    try:
+        op.rename_table('actions', 'actions_partitioned')
+        op.execute("ALTER TABLE actions_partitioned RENAME CONSTRAINT actions_pkey TO actions_partitioned_pkey")
+        for index in ['ix_actions_billing_report_id', 'ix_actions_id', 'ix_actions_lead_id', 'ix_actions_product_id', 'ix_actions_customer_id_created_at', 'ix_actions_created_at_brin']:
+            op.drop_index(index, table_name='actions_partitioned')
+
+        create_actions_table('actions', ['id'])
+        op.execute(f"INSERT INTO actions ({ACTION_COLUMNS}) SELECT {ACTION_COLUMNS} FROM actions_partitioned")
+        # drops every partition with it
+        op.drop_table('actions_partitioned')
+        create_actions_indexes()
+        logger.info("Successfully reverted upgrade to e2f6b81c09d4")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to e2f6b81c09d4: {e}")
+        raise e
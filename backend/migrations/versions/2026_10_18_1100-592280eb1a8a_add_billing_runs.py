@@ -0,0 +1,91 @@
+"""Add billing runs
+
+Revision ID: 592280eb1a8a
+Revises: e2f6b81c09d4
+Create Date: 2026-10-18 11:00:12.804127
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = '592280eb1a8a'
+down_revision = 'e2f6b81c09d4'
+branch_labels = None
+depends_on = None
+
+billingrunstatus_enum = postgresql.ENUM('QUEUED', 'RUNNING', 'COMPLETED', 'FAILED', name='billingrunstatus')
+billingruncustomerstatus_enum = postgresql.ENUM('PENDING', 'DONE', 'FAILED', name='billingruncustomerstatus')
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "e2f6b81c09d4":
+            raise Exception(f"Expected version e2f6b81c09d4 but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to 592280eb1a8a")
+    try:
+        check_version(connection)
+        op.add_column('billing_reports', sa.Column('period_start', sa.DateTime(), nullable=True))
+        op.add_column('billing_reports', sa.Column('period_end', sa.DateTime(), nullable=True))
+        op.alter_column('billing_reports', 'file_path', existing_type=sa.String(length=255), nullable=True)
+        op.create_table('billing_runs',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('status', billingrunstatus_enum, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_billing_runs_month'), 'billing_runs', ['month'], unique=True)
+        op.create_table('billing_run_customers',
+        sa.Column('run_id', sa.String(length=36), nullable=False),
+        sa.Column('customer_id', sa.String(), nullable=False),
+        sa.Column('status', billingruncustomerstatus_enum, nullable=False),
+        sa.Column('billing_report_id', sa.String(), nullable=True),
+        sa.Column('action_count', sa.Integer(), nullable=False),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['billing_report_id'], ['billing_reports.id'], ),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.ForeignKeyConstraint(['run_id'], ['billing_runs.id'], ),
+        sa.PrimaryKeyConstraint('run_id', 'customer_id')
+        )
+        op.create_index('ix_billing_run_customers_run_id_status', 'billing_run_customers', ['run_id', 'status'], unique=False)
+        logger.info("Successfully applied upgrade to 592280eb1a8a")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to 592280eb1a8a: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to 592280eb1a8a")
+    try:
+        op.drop_index('ix_billing_run_customers_run_id_status', table_name='billing_run_customers')
+        op.drop_table('billing_run_customers')
+        op.drop_index(op.f('ix_billing_runs_month'), table_name='billing_runs')
+        op.drop_table('billing_runs')
+        billingruncustomerstatus_enum.drop(connection)
+        billingrunstatus_enum.drop(connection)
+        op.alter_column('billing_reports', 'file_path', existing_type=sa.String(length=255), nullable=False)
+        op.drop_column('billing_reports', 'period_end')
+        op.drop_column('billing_reports', 'period_start')
+        logger.info("Successfully reverted upgrade to 592280eb1a8a")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to 592280eb1a8a: {e}")
+        raise e
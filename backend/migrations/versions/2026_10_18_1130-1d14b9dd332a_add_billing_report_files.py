@@ -0,0 +1,77 @@
+"""Add billing report files
+
+Revision ID: 1d14b9dd332a
+Revises: 592280eb1a8a
+Create Date: 2026-10-18 11:30:27.519034
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = '1d14b9dd332a'
+down_revision = '592280eb1a8a'
+branch_labels = None
+depends_on = None
+
+dedupwindows_enum = postgresql.ENUM('REPORT', 'MONTH', name='dedupwindows')
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "592280eb1a8a":
+            raise Exception(f"Expected version 592280eb1a8a but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to 1d14b9dd332a")
+    try:
+        check_version(connection)
+        op.create_table('billing_report_files',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('customer_id', sa.String(length=36), nullable=False),
+        sa.Column('file_path', sa.String(length=255), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=True),
+        sa.Column('period_end', sa.DateTime(), nullable=True),
+        sa.Column('dedup_window', dedupwindows_enum, nullable=False),
+        sa.Column('include_items', sa.Boolean(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('action_count', sa.Integer(), nullable=False),
+        sa.Column('rollup_action_count', sa.Integer(), nullable=False),
+        sa.Column('engine_version', sa.Integer(), nullable=False),
+        sa.Column('latest_billing_report_id', sa.String(length=36), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_billing_report_files_id'), 'billing_report_files', ['id'], unique=False)
+        op.create_index(op.f('ix_billing_report_files_customer_id'), 'billing_report_files', ['customer_id'], unique=False)
+        op.create_index(op.f('ix_billing_report_files_created_at'), 'billing_report_files', ['created_at'], unique=False)
+        op.create_index('ix_billing_report_files_snapshot_key', 'billing_report_files', ['customer_id', 'period_start', 'period_end', 'dedup_window', 'include_items'], unique=False)
+        logger.info("Successfully applied upgrade to 1d14b9dd332a")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to 1d14b9dd332a: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to 1d14b9dd332a")
+    try:
+        op.drop_table('billing_report_files')
+        dedupwindows_enum.drop(connection)
+        logger.info("Successfully reverted upgrade to 1d14b9dd332a")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to 1d14b9dd332a: {e}")
+        raise e
@@ -0,0 +1,130 @@
+"""Cap billing per lead
+
+Revision ID: d25f4eb8a40d
+Revises: 1d14b9dd332a
+Create Date: 2026-10-18 12:00:03.681552
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = 'd25f4eb8a40d'
+down_revision = '1d14b9dd332a'
+branch_labels = None
+depends_on = None
+
+BILLING_CAP = 100
+
+# Prices, duplicates and capped rollups as billed at this revision; frozen
+# here so the migration does not change with the application code.
+PRICED_ACTIONS = """
+SELECT a.lead_id, a.customer_id, a.product_id,
+       date_trunc('month', a.created_at)::date AS month,
+       base.value + coalesce(cost.value, 0) * multiplier.value AS amount,
+       row_number() OVER (
+           PARTITION BY a.customer_id, a.product_id, a.lead_type, a.action_type,
+                        a.engagement_level, date_trunc('month', a.created_at)
+           ORDER BY a.created_at, a.id
+       ) > 1 AS is_duplicate
+FROM actions a
+JOIN (VALUES ('WEBSITE_VISIT', 1::numeric), ('SOCIAL_MEDIA', 2), ('EMAIL_CAMPAIGN', 1.5),
+             ('REFERRAL', 3), ('EVENT', 2), ('WEBINAR', 2.5), ('DEMO_REQUEST', 2),
+             ('TRADE_SHOW', 2.5), ('CONFERENCE', 3), ('NEWSLETTER', 1), ('FEEDBACK', 2)
+     ) AS base (lead_type, value) ON base.lead_type = a.lead_type::text
+JOIN (VALUES ('LOW', 1::numeric), ('MEDIUM', 2), ('HIGH', 3)
+     ) AS multiplier (engagement_level, value) ON multiplier.engagement_level = a.engagement_level::text
+LEFT JOIN (VALUES ('WEBSITE_VISIT', 'VISIT', 1::numeric), ('WEBSITE_VISIT', 'CLICK', 2),
+                  ('WEBSITE_VISIT', 'DOWNLOAD', 3), ('WEBSITE_VISIT', 'FORM_SUBMIT', 5),
+                  ('WEBSITE_VISIT', 'PURCHASE', 10), ('SOCIAL_MEDIA', 'LIKE', 2),
+                  ('SOCIAL_MEDIA', 'FOLLOW', 3), ('SOCIAL_MEDIA', 'SHARE', 5),
+                  ('SOCIAL_MEDIA', 'COMMENT', 7), ('SOCIAL_MEDIA', 'REPOST', 10),
+                  ('EMAIL_CAMPAIGN', 'OPEN', 1), ('EMAIL_CAMPAIGN', 'CLICK', 15),
+                  ('EMAIL_CAMPAIGN', 'UNSUBSCRIBE', 5), ('REFERRAL', 'SIGNUP', 20),
+                  ('REFERRAL', 'PURCHASE', 50), ('EVENT', 'ATTEND', 2),
+                  ('WEBINAR', 'REGISTER', 5), ('WEBINAR', 'ATTEND', 10),
+                  ('WEBINAR', 'FOLLOW_UP', 5), ('DEMO_REQUEST', 'SUBMISSION', 10),
+                  ('DEMO_REQUEST', 'FOLLOW_UP', 5), ('TRADE_SHOW', 'VISIT', 5),
+                  ('TRADE_SHOW', 'FOLLOW_UP', 10), ('CONFERENCE', 'ATTENDANCE', 15),
+                  ('CONFERENCE', 'FOLLOW_UP', 5), ('NEWSLETTER', 'OPEN', 1),
+                  ('NEWSLETTER', 'CLICK', 5), ('FEEDBACK', 'SUBMISSION', 10)
+     ) AS cost (lead_type, action_type, value)
+     ON cost.lead_type = a.lead_type::text AND cost.action_type = a.action_type::text
+"""
+
+# each lead is billed at most BILLING_CAP per month; the rest is savings
+LEAD_TOTALS = f"""
+SELECT customer_id, product_id, month,
+       count(*) AS action_count,
+       count(*) FILTER (WHERE is_duplicate) AS duplicate_count,
+       coalesce(sum(amount) FILTER (WHERE NOT is_duplicate), 0) AS uncapped,
+       coalesce(sum(amount) FILTER (WHERE is_duplicate), 0) AS duplicate_savings
+FROM ({PRICED_ACTIONS}) AS priced
+GROUP BY lead_id, customer_id, product_id, month
+"""
+
+RECOMPUTE_ROLLUPS = f"""
+INSERT INTO billing_rollups (customer_id, product_id, month, action_count, duplicate_count, billed, savings, stale, updated_at)
+SELECT customer_id, product_id, month,
+       sum(action_count),
+       sum(duplicate_count),
+       sum(least(uncapped, {BILLING_CAP})),
+       sum(duplicate_savings + uncapped - least(uncapped, {BILLING_CAP})),
+       false,
+       now()
+FROM ({LEAD_TOTALS}) AS leads
+GROUP BY customer_id, product_id, month
+ON CONFLICT (customer_id, product_id, month) DO UPDATE SET
+    action_count = excluded.action_count,
+    duplicate_count = excluded.duplicate_count,
+    billed = excluded.billed,
+    savings = excluded.savings,
+    stale = false,
+    updated_at = now()
+"""
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "1d14b9dd332a":
+            raise Exception(f"Expected version 1d14b9dd332a but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to d25f4eb8a40d")
+    try:
+        check_version(connection)
+        op.execute("ALTER TYPE billablestatus ADD VALUE IF NOT EXISTS 'CAPPED'")
+        # the report query now reads lead_id as well
+        op.drop_index('ix_actions_customer_id_created_at', table_name='actions')
+        op.create_index('ix_actions_customer_id_created_at', 'actions', ['customer_id', 'created_at'], unique=False, postgresql_include=['id', 'lead_id', 'product_id', 'lead_type', 'action_type', 'engagement_level'])
+        # rollups and stored reports were computed without the cap
+        op.execute(RECOMPUTE_ROLLUPS)
+        op.execute("DELETE FROM billing_report_files")
+        logger.info("Successfully applied upgrade to d25f4eb8a40d")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to d25f4eb8a40d: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to d25f4eb8a40d")
+    try:
+        # Postgres cannot drop an enum value; CAPPED stays unused in billablestatus
+        op.drop_index('ix_actions_customer_id_created_at', table_name='actions')
+        op.create_index('ix_actions_customer_id_created_at', 'actions', ['customer_id', 'created_at'], unique=False, postgresql_include=['id', 'product_id', 'lead_type', 'action_type', 'engagement_level'])
+        logger.info("Successfully reverted upgrade to d25f4eb8a40d")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to d25f4eb8a40d: {e}")
+        raise e
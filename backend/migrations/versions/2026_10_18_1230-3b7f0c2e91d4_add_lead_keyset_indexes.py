@@ -0,0 +1,59 @@
+"""Add keyset pagination indexes on leads
+
+Revision ID: 3b7f0c2e91d4
+Revises: d25f4eb8a40d
+Create Date: 2026-10-18 12:30:41.209873
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = '3b7f0c2e91d4'
+down_revision = 'd25f4eb8a40d'
+branch_labels = None
+depends_on = None
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "d25f4eb8a40d":
+            raise Exception(f"Expected version d25f4eb8a40d but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to 3b7f0c2e91d4")
+    try:
+        check_version(connection)
+        # GET /leads pages in (created_at, id) order; the customer_id prefixed
+        # index makes ix_leads_customer_id redundant.
+        op.create_index('ix_leads_created_at_id', 'leads', ['created_at', 'id'], unique=False)
+        op.create_index('ix_leads_customer_id_created_at_id', 'leads', ['customer_id', 'created_at', 'id'], unique=False)
+        op.drop_index(op.f('ix_leads_customer_id'), table_name='leads')
+        logger.info("Successfully applied upgrade to 3b7f0c2e91d4")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to 3b7f0c2e91d4: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to 3b7f0c2e91d4")
+    try:
+        op.create_index(op.f('ix_leads_customer_id'), 'leads', ['customer_id'], unique=False)
+        op.drop_index('ix_leads_customer_id_created_at_id', table_name='leads')
+        op.drop_index('ix_leads_created_at_id', table_name='leads')
+        logger.info("Successfully reverted upgrade to 3b7f0c2e91d4")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to 3b7f0c2e91d4: {e}")
+        raise e
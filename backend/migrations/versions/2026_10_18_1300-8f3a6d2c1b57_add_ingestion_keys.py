@@ -0,0 +1,62 @@
+"""Add ingestion keys
+
+Revision ID: 8f3a6d2c1b57
+Revises: 3b7f0c2e91d4
+Create Date: 2026-10-18 13:00:41.306218
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = '8f3a6d2c1b57'
+down_revision = '3b7f0c2e91d4'
+branch_labels = None
+depends_on = None
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "3b7f0c2e91d4":
+            raise Exception(f"Expected version 3b7f0c2e91d4 but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to 8f3a6d2c1b57")
+    try:
+        check_version(connection)
+        op.create_table('ingestion_keys',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('lead_id', sa.String(length=36), nullable=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+        )
+        op.create_index(op.f('ix_ingestion_keys_expires_at'), 'ingestion_keys', ['expires_at'], unique=False)
+        logger.info("Successfully applied upgrade to 8f3a6d2c1b57")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to 8f3a6d2c1b57: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to 8f3a6d2c1b57")
+    try:
+        op.drop_index(op.f('ix_ingestion_keys_expires_at'), table_name='ingestion_keys')
+        op.drop_table('ingestion_keys')
+        logger.info("Successfully reverted upgrade to 8f3a6d2c1b57")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to 8f3a6d2c1b57: {e}")
+        raise e
@@ -0,0 +1,84 @@
+"""Add billing dedup states and incremental billing runs
+
+Revision ID: c6e0d9a4f812
+Revises: 8f3a6d2c1b57
+Create Date: 2026-10-18 13:30:12.804517
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+revision = 'c6e0d9a4f812'
+down_revision = '8f3a6d2c1b57'
+branch_labels = None
+depends_on = None
+
+def check_version(connection):
+    # Example check, customize as needed
+    result = connection.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+    if result:
+        current_version = result[0]
+        logger.info(f"Current DB version: {current_version}")
+        if current_version != "8f3a6d2c1b57":
+            raise Exception(f"Expected version 8f3a6d2c1b57 but found {current_version}")
+    else:
+        logger.info("No version found in alembic_version table.")
+
+def upgrade():
+    connection = op.get_bind()
+    logger.info("Applying upgrade to c6e0d9a4f812")
+    try:
+        check_version(connection)
+        op.create_table('billing_dedup_states',
+        sa.Column('customer_id', sa.String(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.PrimaryKeyConstraint('customer_id', 'month')
+        )
+        op.create_table('billing_dedup_keys',
+        sa.Column('customer_id', sa.String(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.String(), nullable=False),
+        sa.Column('lead_type', postgresql.ENUM(name='leadtypes', create_type=False), nullable=False),
+        sa.Column('action_type', postgresql.ENUM(name='actiontypes', create_type=False), nullable=False),
+        sa.Column('engagement_level', postgresql.ENUM(name='engagementleveltypes', create_type=False), nullable=False),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+        sa.PrimaryKeyConstraint('customer_id', 'month', 'product_id', 'lead_type', 'action_type', 'engagement_level')
+        )
+        op.create_table('billing_lead_totals',
+        sa.Column('customer_id', sa.String(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('lead_id', sa.String(), nullable=False),
+        sa.Column('billed', sa.Numeric(), nullable=False),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.ForeignKeyConstraint(['lead_id'], ['leads.id'], ),
+        sa.PrimaryKeyConstraint('customer_id', 'month', 'lead_id')
+        )
+        op.add_column('billing_runs', sa.Column('incremental', sa.Boolean(), server_default='false', nullable=False))
+        logger.info("Successfully applied upgrade to c6e0d9a4f812")
+    except Exception as e:
+        logger.error(f"Failed to apply upgrade to c6e0d9a4f812: {e}")
+        raise e
+
+def downgrade():
+    connection = op.get_bind()
+    logger.info("Reverting upgrade to c6e0d9a4f812")
+    try:
+        op.drop_column('billing_runs', 'incremental')
+        op.drop_table('billing_lead_totals')
+        op.drop_table('billing_dedup_keys')
+        op.drop_table('billing_dedup_states')
+        logger.info("Successfully reverted upgrade to c6e0d9a4f812")
+    except Exception as e:
+        logger.error(f"Failed to revert upgrade to c6e0d9a4f812: {e}")
+        raise e
@@ -0,0 +1,58 @@
+"""Count the SQL statements and ORM rows behind a block of code.
+
+Endpoint tests wrap a request in ``QueryCounter`` and assert upper bounds, so
+a relationship that slips back into lazy loading (one extra query per row) or
+an eager join that drags in whole collections fails the test.
+"""
+
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import ModelBase
+
+
+class QueryCounter:
+    """Records statements run through any ``Session`` and instances it loads.
+
+    Relationship loads (selectin, lazy) are counted as statements too, since
+    they go through ``Session.execute`` as well.
+    """
+
+    def __init__(self):
+        self.statements: list[str] = []
+        self.loaded: Counter = Counter()
+
+    def _on_execute(self, orm_execute_state):
+        self.statements.append(str(orm_execute_state.statement))
+
+    def _on_load(self, target, context):
+        self.loaded[type(target).__name__] += 1
+
+    def __enter__(self):
+        event.listen(Session, "do_orm_execute", self._on_execute)
+        event.listen(ModelBase, "load", self._on_load, propagate=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Session, "do_orm_execute", self._on_execute)
+        event.remove(ModelBase, "load", self._on_load)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def assert_at_most(self, statements: int, **loaded: int):
+        """Fail if more statements ran, or more instances of a model loaded.
+
+        ``loaded`` maps model names to limits, e.g. ``Action=0``.
+        """
+        assert self.count <= statements, (
+            f"{self.count} statements, expected at most {statements}:\n"
+            + "\n".join(self.statements)
+        )
+        for model, limit in loaded.items():
+            assert self.loaded[model] <= limit, (
+                f"{self.loaded[model]} {model} rows loaded, expected at most {limit}"
+            )
@@ -1,5 +1,27 @@
+import asyncio
+import gzip
+import json
+import logging
 import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
 from app.core.database import get_async_session, check_database_status
+from app.core.ingestion_buffer import BufferFull, IngestionBuffer
+from app.core.instrumentation import MetricsMiddleware, render_metrics, span
+from app.core.message_queue import MemoryQueue
+from app.core.log_config import (
+    JsonFormatter,
+    LogContextMiddleware,
+    RequestContextFilter,
+)
+from app.core.pool_metrics import MeasuredQueuePool, pool_status
+from app.core.reference_cache import LocalCache, ReferenceCache
+from app.core.report_storage import LocalReportStorage, read_report_file
+from app.crud import lead_event_service
+from app.crud.lead_event_service import LeadEventConsumer, parse_lead_event
+from app.crud.report_snapshot_service import compress_report
 
 
 async def test_database_connection(test_session):
@@ -10,3 +32,301 @@ async def test_database_connection(test_session):
 async def test_get_session():
     session = await anext(get_async_session())
     assert session is not None
+
+
+async def test_local_report_storage_round_trip(tmp_path):
+    content_hash, data = compress_report(b'{"id": "report-1"}')
+    storage = LocalReportStorage(str(tmp_path))
+
+    path = await storage.write(f"customer-1/{content_hash}.json.gz", data)
+
+    assert path.endswith(f"{content_hash}.json.gz")
+    assert gzip.decompress(await read_report_file(path)) == b'{"id": "report-1"}'
+    # content addressed: the same document compresses to the same file
+    assert compress_report(b'{"id": "report-1"}') == (content_hash, data)
+
+
+class _FakeConnection:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+async def test_measured_pool_counts_checkouts_overflow_and_timeouts():
+    pool = MeasuredQueuePool(
+        _FakeConnection, pool_size=1, max_overflow=1, timeout=0.01
+    )
+    first = await greenlet_spawn(pool.connect)
+    second = await greenlet_spawn(pool.connect)
+    with pytest.raises(exc.TimeoutError):
+        await greenlet_spawn(pool.connect)
+    second.close()
+
+    status = pool_status(pool)
+
+    assert status["checked_out"] == 1 and status["checked_in"] == 1
+    assert status["checkouts"] == 2 and status["timeouts"] == 1
+    assert status["overflow_max"] == 1
+    assert status["wait_seconds_max"] <= status["wait_seconds_total"]
+    # counters survive engine.dispose(), which recreates the pool
+    assert pool.recreate().metrics is pool.metrics
+    first.close()
+
+
+async def test_metrics_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: str):
+        with span("test_span"):
+            return {"id": item_id}
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        await client.get("/missing")
+
+    content, content_type = render_metrics()
+    text = content.decode()
+    assert content_type.startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/items/{item_id}",'
+        'status="200"} 2.0'
+    ) in text
+    assert 'route="unmatched",status="404"' in text
+    assert 'billing_engine_span_seconds_count{span="test_span"} 2.0' in text
+
+
+async def test_request_log_levels_sampling_and_json_format():
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(json.loads(self.format(record)))
+
+    handler = Capture()
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RequestContextFilter(logging.INFO))
+    logger = logging.getLogger("test_request_logs")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    app = FastAPI()
+    app.add_middleware(
+        LogContextMiddleware,
+        route_levels={"/quiet": "WARNING", "/quiet/debug": "DEBUG"},
+        default_level="INFO",
+    )
+
+    @app.get("/{path:path}")
+    async def log_something(path: str):
+        logger.debug("debug %s", path)
+        logger.info("info %s", path, extra={"lead_id": "L1"})
+        logger.warning("warning %s", path)
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        await client.get("/loud")
+        await client.get("/quiet/1")
+        await client.get("/quiet/debug")
+
+    assert [record["message"] for record in records] == [
+        "info loud",
+        "warning loud",
+        "warning quiet/1",
+        "debug quiet/debug",
+        "info quiet/debug",
+        "warning quiet/debug",
+    ]
+    assert records[0]["level"] == "INFO"
+    assert records[0]["logger"] == "test_request_logs"
+    assert records[0]["lead_id"] == "L1"
+    assert (records[0]["method"], records[0]["path"]) == ("GET", "/loud")
+
+    # sampling drops DEBUG and INFO records, never warnings
+    records.clear()
+    handler.filters[0].sample_rate = 0.0
+    logger.info("sampled out")
+    logger.error("kept")
+    assert [record["message"] for record in records] == ["kept"]
+    logger.removeHandler(handler)
+
+
+async def test_reference_cache_reads_through_bounded_lru(monkeypatch):
+    loads = []
+
+    async def load(ids):
+        loads.append(ids)
+        return {id: (id, f"name-{id}") for id in ids if id != "unknown"}
+
+    cache = ReferenceCache(LocalCache(maxsize=2, ttl=60))
+    assert await cache.get_many("product", ["a", "b", "unknown"], load) == {
+        "a": ("a", "name-a"),
+        "b": ("b", "name-b"),
+    }
+    # unknown ids are not cached, so they are looked up again
+    await cache.get_many("product", ["a", "unknown"], load)
+    assert loads == [["a", "b", "unknown"], ["unknown"]]
+    assert cache.stats() == {"product": {"hits": 1, "misses": 4}}
+
+    # the least recently used entry is evicted beyond maxsize
+    await cache.get_many("product", ["c"], load)
+    assert len(cache.backend) == 2
+    await cache.get_many("product", ["a", "b"], load)
+    assert loads[-1] == ["b"]
+
+    await cache.invalidate("product", ["a"])
+    await cache.get_many("product", ["a"], load)
+    assert loads[-1] == ["a"]
+
+    # and every entry expires after ttl seconds
+    clock = [0.0]
+    monkeypatch.setattr("app.core.reference_cache.time.monotonic", lambda: clock[0])
+    await cache.get_many("product", ["d"], load)
+    clock[0] += 59
+    await cache.get_many("product", ["d"], load)
+    clock[0] += 2
+    await cache.get_many("product", ["d"], load)
+    assert loads[-2:] == [["d"], ["d"]]
+
+
+async def test_ingestion_buffer_batches_and_recovers_its_spill_log(tmp_path):
+    batches = []
+    failing = True
+
+    async def flush(records):
+        if failing:
+            raise RuntimeError("database is down")
+        batches.append(records)
+
+    def buffer(**options):
+        return IngestionBuffer(
+            flush, str(tmp_path), fsync=False, retry_delay=0.01, **options
+        )
+
+    # nothing gets written: the records stay in the spill log
+    first = buffer(max_rows=100, max_delay=0.01)
+    await first.start()
+    await first.submit([{"id": 1}, {"id": 2}])
+    await first.submit([{"id": 3}])
+    await asyncio.sleep(0.05)
+    assert first.depth == 3
+    await first.stop()
+    spill = tmp_path / "worker-0"
+    assert len(list(spill.glob("segment-*.jsonl"))) == 1
+
+    # the next worker takes over the spill log and flushes it
+    failing = False
+    second = buffer(max_rows=4, max_delay=60, max_pending_rows=10)
+    await second.start()
+    assert second.stats()["spill_directory"] == str(spill)
+    await second.submit([{"id": 4}])
+    await asyncio.sleep(0.05)
+    # a full batch is flushed without waiting for max_delay
+    assert batches == [[{"id": 1}, {"id": 2}, {"id": 3}, {"id": 4}]]
+    assert second.depth == 0
+    assert list(spill.glob("segment-*.jsonl")) == []
+
+    await second.submit([{"id": 5}])
+    with pytest.raises(BufferFull):
+        await second.submit([{"id": n} for n in range(10)])
+    # what is left is flushed on the way out
+    await second.stop()
+    assert batches[-1] == [{"id": 5}]
+    assert list(spill.glob("segment-*.jsonl")) == []
+
+
+async def test_lead_event_consumer_settles_each_message(monkeypatch):
+    lead = {
+        "id": "lead-1",
+        "lead_type": "Website Visit",
+        "customer_id": "customer-1",
+        "product_id": "product-1",
+        "created_at": "2026-10-01T12:00:00Z",
+    }
+    action = {
+        "lead_id": "lead-1",
+        "lead_type": "Website Visit",
+        "action_type": "Visit",
+        "engagement_level": "High",
+        "customer_id": "customer-1",
+        "product_id": "product-1",
+        "created_at": "2026-10-01T12:05:00Z",
+    }
+    assert parse_lead_event(json.dumps({"type": "lead", "data": lead})).id == "lead-1"
+    for body in ("{", '{"type": "sale"}', '{"type": "lead", "data": {}}'):
+        with pytest.raises(ValueError):
+            parse_lead_event(body)
+
+    written = []
+    down = True
+
+    async def save_leads(leads, session):
+        if down:
+            raise RuntimeError("database is down")
+        written.extend(lead.id for lead in leads)
+        return [
+            {"id": lead.id, "accepted": lead.id == "lead-1", "reason": reason}
+            for lead, reason in zip(leads, [None, "Lead already exists", "Bad"])
+        ]
+
+    async def save_actions(actions, session):
+        written.extend(action.lead_id for action in actions)
+        return [
+            {"lead_id": action.lead_id, "accepted": False, "reason": "Unknown lead"}
+            for action in actions
+        ]
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+    monkeypatch.setattr(lead_event_service, "bulk_save_leads", save_leads)
+    monkeypatch.setattr(lead_event_service, "bulk_save_actions", save_actions)
+    queue = MemoryQueue()
+    consumer = LeadEventConsumer(
+        queue, Session, batch_size=10, wait_seconds=0, visibility_timeout=1
+    )
+    for lead_id in ("lead-1", "lead-0", "lead-2"):
+        await queue.send(json.dumps({"type": "lead", "data": lead | {"id": lead_id}}))
+    await queue.send(json.dumps({"type": "action", "data": action}))
+    await queue.send("not json")
+
+    # a failed write leaves the events to be delivered again
+    messages = await consumer._receive_batch()
+    await consumer.process(messages)
+    assert len(queue) == 4 and written == []
+    assert queue.dead_letters[0][0] == "not json"
+    assert await queue.receive(10, 0, 1) == []
+    # as if their visibility timeout had run out
+    await queue.extend(messages, 0)
+
+    down = False
+    messages = await consumer._receive_batch()
+    assert [message.receive_count for message in messages] == [2] * 4
+    await consumer.process(messages)
+    assert written == ["lead-1", "lead-0", "lead-2", "lead-1"]
+    # ingested and duplicate leads are deleted, a rejected one dead-lettered,
+    # and an action waits for its lead
+    assert queue.dead_letters[1:] == [(messages[2].body, "Bad")]
+    assert len(queue) == 1
+
+    # a stale receipt handle no longer applies
+    await queue.extend(messages[3:], 0)
+    redelivered = await consumer._receive_batch()
+    await queue.delete(messages[3:])
+    await queue.extend(redelivered, 0)
+    assert len(queue) == 1
+    consumer.max_receives = 2
+    await consumer.process(await consumer._receive_batch())
+    assert queue.dead_letters[-1] == (redelivered[0].body, "Delivered 4 times")
+    assert len(queue) == 0
@@ -1,6 +1,88 @@
+import asyncio
+import csv
+import io
 import pytest
-from app.crud.leads_service import save_lead_in_database, save_action_in_database
+import numpy as np
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+from app.crud.leads_service import (
+    bulk_save_leads,
+    decode_lead_cursor,
+    encode_lead_cursor,
+    leads_page_query,
+    save_lead_in_database,
+    save_action_in_database,
+    validate_action,
+    validate_lead,
+)
 from app.crud import calculate_action_value
+from app.crud.action_store import ActionStore, bill_actions, store_totals
+from app.crud.billing_engine import (
+    aggregate_billing_report,
+    add_item_to_totals,
+    billing_report_with_items,
+    empty_report_totals,
+    priced_actions_query,
+    product_totals_query,
+)
+from app.crud.billing_rollup_service import (
+    REFRESH_LOCK,
+    closed_month_range,
+    refresh_stale_billing_rollups,
+    rollup_billing_report,
+)
+from app.crud.action_partition_service import (
+    create_action_partition,
+    ensure_action_partitions,
+)
+from app.crud.billing_run_service import (
+    create_billing_run,
+    month_period,
+    process_billing_run,
+)
+from app.crud.billing_report_service import (
+    BillingCapLedger,
+    billing_cap,
+    duplicate_mask,
+    is_duplicate_action,
+)
+from app.crud.ingestion_key_service import (
+    IdempotencyKeyReused,
+    action_content_key,
+    ingestion_keys_query,
+    lead_content_key,
+    replayed_results,
+    request_key,
+    request_key_row,
+)
+from app.crud.incremental_billing_service import (
+    DedupState,
+    bill_against_states,
+    billed_actions_update,
+)
+from app.crud.report_render_service import (
+    CsvRenderer,
+    HtmlRenderer,
+    MarkdownRenderer,
+    RenderContext,
+)
+from app.models import (
+    Lead,
+    Customer,
+    Action,
+    BillingDedupKey,
+    BillingLeadTotal,
+    BillingReport,
+    BillingRollup,
+    BillingRunCustomer,
+)
+from app.schemas import ActionCreate, LeadCreate
+from app.shared import LeadTypes, ActionTypes, EngagementLevelTypes, DedupWindows
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.dialects import postgresql
 
 
 async def test_save_lead(test_session, test_customer, test_product):
@@ -15,6 +97,833 @@ async def test_save_lead(test_session, test_customer, test_product):
     assert lead.lead_type == "STANDARD"
 
 
+def test_lead_cursor_round_trips_and_rejects_garbage():
+    created_at = datetime(2025, 3, 1, 10, 30, tzinfo=timezone.utc)
+
+    cursor = encode_lead_cursor(created_at, "lead-1")
+
+    assert decode_lead_cursor(cursor) == (created_at, "lead-1")
+    with pytest.raises(ValueError):
+        decode_lead_cursor("not-a-cursor")
+
+
+def test_leads_page_query_seeks_past_the_cursor():
+    query = leads_page_query(
+        customer_id="customer-1", after=(datetime(2025, 3, 1), "lead-1"), limit=50
+    )
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert "(leads.created_at, leads.id) >" in sql
+    assert "ORDER BY leads.created_at, leads.id" in sql
+    assert "LIMIT" in sql
+
+
 def test_calculate_action_value():
     value = calculate_action_value("STANDARD", "EMAIL", "HIGH")
     assert value == 5.0
+
+
+async def test_aggregate_billing_report_prices_and_dedupes(
+    test_session, test_customer, test_product
+):
+    lead = Lead(
+        id=str(uuid4()),
+        customer_id=test_customer.id,
+        product_id=test_product.id,
+        lead_type=LeadTypes.EMAIL_CAMPAIGN,
+        created_at=datetime(2025, 3, 1),
+    )
+    test_session.add(lead)
+    for minute in range(2):
+        test_session.add(
+            Action(
+                id=str(uuid4()),
+                lead_id=lead.id,
+                customer_id=test_customer.id,
+                product_id=test_product.id,
+                lead_type=LeadTypes.EMAIL_CAMPAIGN,
+                action_type=ActionTypes.CLICK,
+                engagement_level=EngagementLevelTypes.HIGH,
+                created_at=datetime(2025, 3, 1, 10, minute),
+            )
+        )
+    await test_session.commit()
+
+    totals = await aggregate_billing_report(test_session, test_customer.id)
+
+    # Email Campaign base 1.5 + Click 15 * High 3
+    assert totals["action_count"] == 2
+    assert totals["duplicate_count"] == 1
+    assert totals["total_billed_amount"] == 46.5
+    assert totals["total_savings"] == 46.5
+    assert totals["product_subtotals"] == {test_product.name: 46.5}
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def test_report_query_is_an_index_only_scan(
+    test_engine, test_session, test_lead
+):
+    customer_id = test_lead.customer_id
+    for month in range(1, 13):
+        await create_action_partition(test_session, date(2025, month, 1))
+    # A year of actions over 50 customers, so that one customer's month is a
+    # small slice of its partition, as in production.
+    for n in range(1, 50):
+        test_session.add(
+            Customer(id=f"customer-{n}", name="Customer", email=f"{n}@example.com")
+        )
+        test_session.add(
+            Lead(
+                id=f"lead-{n}",
+                customer_id=f"customer-{n}",
+                product_id=test_lead.product_id,
+                lead_type=LeadTypes.REFERRAL,
+                created_at=datetime(2025, 1, 1),
+            )
+        )
+    await test_session.flush()
+    await test_session.execute(
+        text(
+            "INSERT INTO actions (id, lead_id, customer_id, product_id, lead_type, "
+            "action_type, engagement_level, created_at) "
+            "SELECT md5(n::text), "
+            "CASE WHEN n % 50 = 0 THEN :lead_id ELSE 'lead-' || n % 50 END, "
+            "CASE WHEN n % 50 = 0 THEN :customer_id ELSE 'customer-' || n % 50 END, "
+            ":product_id, 'REFERRAL', "
+            "(ARRAY['SIGNUP', 'PURCHASE']::actiontypes[])[n % 2 + 1], 'LOW', "
+            "'2025-01-01'::timestamp + n * interval '8 minutes' "
+            "FROM generate_series(1, 60000) AS n"
+        ),
+        {
+            "lead_id": test_lead.id,
+            "customer_id": customer_id,
+            "product_id": test_lead.product_id,
+        },
+    )
+    await test_session.commit()
+    # index-only scans rely on the visibility map that VACUUM sets
+    async with test_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE actions"))
+
+    query = product_totals_query(
+        priced_actions_query(
+            customer_id, datetime(2025, 3, 1), datetime(2025, 3, 31)
+        ).subquery()
+    )
+    sql = query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+
+    plan = (
+        await test_session.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"))
+    ).scalar()
+
+    scans = [
+        node
+        for node in _plan_nodes(plan[0]["Plan"])
+        if node.get("Relation Name", "").startswith("actions")
+    ]
+    # Partitions name their copy of ix_actions_customer_id_created_at after
+    # its columns.
+    assert scans
+    for node in scans:
+        assert node["Node Type"] == "Index Only Scan"
+        assert "customer_id_created_at" in node["Index Name"]
+        assert node["Actual Rows"] and not node["Heap Fetches"]
+
+
+async def test_report_query_only_scans_partitions_of_its_range(
+    test_session, test_customer
+):
+    for month in (date(2025, 2, 1), date(2025, 3, 1), date(2025, 4, 1)):
+        await create_action_partition(test_session, month)
+    query = product_totals_query(
+        priced_actions_query(
+            test_customer.id, datetime(2025, 3, 1), datetime(2025, 3, 31, 23, 59, 59)
+        ).subquery()
+    )
+    sql = query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+
+    plan = (await test_session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()
+
+    relations = {
+        node["Relation Name"]
+        for node in _plan_nodes(plan[0]["Plan"])
+        if node.get("Relation Name", "").startswith("actions")
+    }
+    assert relations == {"actions_2025_03"}
+
+
+async def test_concurrent_partition_runs_create_each_partition_once(
+    test_session_factory,
+):
+    async def ensure():
+        async with test_session_factory() as session:
+            return await ensure_action_partitions(
+                session, today=datetime(2031, 1, 15)
+            )
+
+    # as every worker does at startup
+    created = await asyncio.gather(ensure(), ensure(), ensure())
+
+    assert sorted(name for names in created for name in names) == [
+        "actions_2031_01",
+        "actions_2031_02",
+        "actions_2031_03",
+        "actions_2031_04",
+    ]
+
+
+async def test_partition_run_moves_back_dated_actions_out_of_default(
+    test_session, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2019, 6, 3, 9))
+    await test_session.commit()
+
+    created = await ensure_action_partitions(
+        test_session, months_ahead=0, today=datetime(2032, 1, 15)
+    )
+
+    assert created == ["actions_2019_06", "actions_2032_01"]
+    moved = await test_session.scalar(text("SELECT count(*) FROM actions_2019_06"))
+    left = await test_session.scalar(text("SELECT count(*) FROM actions_default"))
+    assert (moved, left) == (1, 0)
+
+
+def test_validate_lead_rejects_unbillable_action():
+    lead = LeadCreate(
+        id="lead-1",
+        customer_id="customer-1",
+        product_id="product-1",
+        lead_type=LeadTypes.WEBSITE_VISIT,
+        created_at=datetime(2025, 3, 1),
+        actions=[
+            {
+                "action_type": ActionTypes.LIKE,
+                "engagement_level": EngagementLevelTypes.LOW,
+                "created_at": datetime(2025, 3, 1),
+            }
+        ],
+    )
+
+    assert "not billable" in validate_lead(lead, {"customer-1"}, {"product-1"}, set())
+    assert validate_lead(lead, {"customer-1"}, {"product-1"}, {"lead-1"}) == (
+        "Duplicate lead id in payload"
+    )
+
+
+def test_ingestion_keys_match_retried_leads_and_requests():
+    lead = LeadCreate(
+        id="lead-1",
+        customer_id="customer-1",
+        product_id="product-1",
+        lead_type=LeadTypes.WEBSITE_VISIT,
+        created_at=datetime(2025, 3, 1),
+        actions=[
+            {
+                "action_type": ActionTypes.CLICK,
+                "engagement_level": EngagementLevelTypes.LOW,
+                "created_at": datetime(2025, 3, 1),
+            }
+        ],
+    )
+    resent = lead.model_copy()
+    other = lead.model_copy(update={"id": "lead-2"})
+
+    # a distinct lead with equal fields has its own id
+    assert lead_content_key(resent) == lead_content_key(lead)
+    assert lead_content_key(other) != lead_content_key(lead)
+    assert request_key("lead-1") != lead_content_key(lead)
+
+    row = request_key_row("retry-1", [lead], [{"id": "lead-1", "accepted": True}])
+    stored = SimpleNamespace(**row)
+    assert replayed_results(stored, [lead]) == [{"id": "lead-1", "accepted": True}]
+    with pytest.raises(IdempotencyKeyReused):
+        replayed_results(stored, [other])
+
+    # every key of a request is bound as one array
+    query = ingestion_keys_query(["a", "b", "c"], datetime(2025, 3, 1))
+    compiled = query.compile(dialect=postgresql.dialect())
+    assert "key = ANY (%(keys)s" in str(compiled)
+    assert compiled.params["keys"] == ["a", "b", "c"]
+
+
+
+def test_action_events_are_checked_against_their_lead():
+    action = ActionCreate(
+        lead_id="lead-1",
+        customer_id="customer-1",
+        product_id="product-1",
+        lead_type=LeadTypes.WEBSITE_VISIT,
+        action_type=ActionTypes.CLICK,
+        engagement_level=EngagementLevelTypes.LOW,
+        created_at=datetime(2025, 3, 1),
+    )
+    lead = SimpleNamespace(
+        customer_id="customer-1",
+        product_id="product-1",
+        lead_type=LeadTypes.WEBSITE_VISIT,
+    )
+    assert validate_action(action, lead) is None
+    assert validate_action(action, None) == "Unknown lead lead-1"
+    moved = SimpleNamespace(**{**vars(lead), "product_id": "product-2"})
+    assert validate_action(action, moved) == "Action does not match lead lead-1"
+    liked = action.model_copy(update={"action_type": ActionTypes.LIKE})
+    assert "is not billable" in validate_action(liked, lead)
+
+    # an action sent twice has one key
+    assert action_content_key(action.model_copy()) == action_content_key(action)
+    assert action_content_key(liked) != action_content_key(action)
+
+def _action(product_id="product-1", created_at=datetime(2025, 3, 1), **fields):
+    return SimpleNamespace(
+        customer_id="customer-1",
+        product_id=product_id,
+        lead_type=LeadTypes.WEBSITE_VISIT,
+        action_type=ActionTypes.CLICK,
+        engagement_level=EngagementLevelTypes.HIGH,
+        created_at=created_at,
+        **fields,
+    )
+
+
+def test_is_duplicate_action_matches_processed_product_actions():
+    processed = [_action()]
+
+    assert is_duplicate_action(_action(), processed)
+    assert is_duplicate_action(_action(created_at=datetime(2025, 4, 1)), processed)
+    assert not is_duplicate_action(_action(product_id="product-2"), processed)
+    visit = _action()
+    visit.action_type = ActionTypes.VISIT
+    assert not is_duplicate_action(visit, processed)
+
+
+def test_duplicate_mask_flags_repeats_after_first_occurrence():
+    products = np.array([0, 0, 1, 0, 1])
+    action_types = np.array([3, 3, 3, 4, 3])
+
+    np.testing.assert_array_equal(
+        duplicate_mask(products, action_types), [False, True, False, False, True]
+    )
+
+
+def test_billing_cap_bills_each_group_up_to_the_cap():
+    leads = np.array([0, 1, 0, 0, 1, 0])
+    amounts = np.array([60.0, 30.0, 30.0, 20.0, 80.0, 5.0])
+
+    capped = billing_cap(leads, amounts, cap=100)
+
+    np.testing.assert_array_equal(capped.running, [60, 30, 90, 110, 110, 115])
+    np.testing.assert_array_equal(capped.billed, [60, 30, 30, 10, 70, 0])
+    np.testing.assert_array_equal(capped.savings, [0, 0, 0, 10, 10, 5])
+    np.testing.assert_array_equal(
+        capped.crossed, [False, False, False, True, True, False]
+    )
+
+
+def test_billing_cap_ledger_carries_totals_across_batches():
+    one_batch = BillingCapLedger(DedupWindows.REPORT, cap=100)
+    two_batches = BillingCapLedger(DedupWindows.REPORT, cap=100)
+    lead_ids = ["a", "b", "a", "a", "b"]
+    created_ats = [datetime(2025, 3, 1)] * 5
+    amounts = np.array([45.0, 45.0, 45.0, 45.0, 45.0])
+
+    billed = one_batch.apply(lead_ids, created_ats, amounts).billed
+    first = two_batches.apply(lead_ids[:3], created_ats[:3], amounts[:3]).billed
+    second = two_batches.apply(lead_ids[3:], created_ats[3:], amounts[3:]).billed
+
+    np.testing.assert_array_equal(billed, [45, 45, 45, 10, 45])
+    np.testing.assert_array_equal(np.concatenate([first, second]), billed)
+
+
+def test_billing_cap_ledger_restarts_each_month_in_the_month_window():
+    ledger = BillingCapLedger(DedupWindows.MONTH, cap=100)
+    created_ats = [datetime(2025, 3, 1), datetime(2025, 3, 2), datetime(2025, 4, 1)]
+
+    capped = ledger.apply(["a"] * 3, created_ats, np.array([90.0, 90.0, 90.0]))
+
+    np.testing.assert_array_equal(capped.billed, [90, 10, 90])
+
+
+async def test_aggregate_billing_report_caps_each_lead(
+    test_session, test_customer, test_product
+):
+    leads = [
+        Lead(
+            id=str(uuid4()),
+            customer_id=test_customer.id,
+            product_id=test_product.id,
+            lead_type=LeadTypes.EMAIL_CAMPAIGN,
+            created_at=datetime(2025, 3, 1),
+        )
+        for _ in range(2)
+    ]
+    test_session.add_all(leads)
+    # 46.5 + 31.5 + 16.5 + 11.5 = 106 for the first lead, 2.5 for the second
+    actions = [
+        (leads[0], ActionTypes.CLICK, EngagementLevelTypes.HIGH),
+        (leads[0], ActionTypes.CLICK, EngagementLevelTypes.MEDIUM),
+        (leads[0], ActionTypes.CLICK, EngagementLevelTypes.LOW),
+        (leads[0], ActionTypes.UNSUBSCRIBE, EngagementLevelTypes.MEDIUM),
+        (leads[1], ActionTypes.OPEN, EngagementLevelTypes.LOW),
+    ]
+    for minute, (lead, action_type, level) in enumerate(actions):
+        test_session.add(
+            Action(
+                id=str(uuid4()),
+                lead_id=lead.id,
+                customer_id=test_customer.id,
+                product_id=test_product.id,
+                lead_type=LeadTypes.EMAIL_CAMPAIGN,
+                action_type=action_type,
+                engagement_level=level,
+                created_at=datetime(2025, 3, 1, 10, minute),
+            )
+        )
+    await test_session.commit()
+
+    totals = await aggregate_billing_report(test_session, test_customer.id)
+
+    assert totals["duplicate_count"] == 0
+    assert totals["total_billed_amount"] == 102.5
+    assert totals["total_savings"] == 6
+    assert totals["product_subtotals"] == {test_product.name: 102.5}
+
+    # the columnar engine behind reports with items agrees with SQL
+    columnar_totals, items = await billing_report_with_items(
+        test_session, test_customer.id, test_customer.email
+    )
+    assert columnar_totals == totals
+    assert [item["billed_amount"] for item in items] == [46.5, 31.5, 16.5, 5.5, 2.5]
+
+
+def test_action_store_prices_dedupes_and_caps_actions():
+    def row(action_type, level, created_at):
+        return (
+            "lead-1",
+            "customer-1",
+            "product-1",
+            LeadTypes.EMAIL_CAMPAIGN,
+            action_type,
+            level,
+            created_at,
+        )
+
+    store = ActionStore.from_rows(
+        [
+            row(ActionTypes.CLICK, EngagementLevelTypes.HIGH, datetime(2025, 3, 1)),
+            row(ActionTypes.CLICK, EngagementLevelTypes.HIGH, datetime(2025, 3, 2)),
+            row(ActionTypes.CLICK, EngagementLevelTypes.MEDIUM, datetime(2025, 3, 3)),
+            row(ActionTypes.CLICK, EngagementLevelTypes.LOW, datetime(2025, 3, 4)),
+            row(
+                ActionTypes.UNSUBSCRIBE,
+                EngagementLevelTypes.MEDIUM,
+                datetime(2025, 3, 5),
+            ),
+            row(ActionTypes.CLICK, EngagementLevelTypes.HIGH, datetime(2025, 4, 1)),
+        ]
+    )
+
+    by_report = bill_actions(store, DedupWindows.REPORT)
+    by_month = bill_actions(store, DedupWindows.MONTH)
+
+    assert store.nbytes == 23 * len(store)
+    np.testing.assert_array_equal(
+        by_report.amount, [46.5, 46.5, 31.5, 16.5, 11.5, 46.5]
+    )
+    np.testing.assert_array_equal(
+        by_report.duplicate, [False, True, False, False, False, True]
+    )
+    # the lead reaches the cap of 100 on its fifth action
+    np.testing.assert_array_equal(by_report.billed, [46.5, 0, 31.5, 16.5, 5.5, 0])
+    np.testing.assert_array_equal(
+        by_month.billed, [46.5, 0, 31.5, 16.5, 5.5, 46.5]
+    )
+    assert store_totals(store, by_month, {"product-1": "Product"}) == {
+        "action_count": 6,
+        "duplicate_count": 1,
+        "total_billed_amount": 146.5,
+        "total_savings": 52.5,
+        "product_subtotals": {"Product": 146.5},
+    }
+
+
+def test_incremental_billing_agrees_with_billing_everything_at_once():
+    def row(lead_id, action_type, level, created_at):
+        return (
+            lead_id,
+            "customer-1",
+            "product-1",
+            LeadTypes.EMAIL_CAMPAIGN,
+            action_type,
+            level,
+            created_at,
+        )
+
+    click, unsubscribe = ActionTypes.CLICK, ActionTypes.UNSUBSCRIBE
+    high, medium, low = (
+        EngagementLevelTypes.HIGH,
+        EngagementLevelTypes.MEDIUM,
+        EngagementLevelTypes.LOW,
+    )
+    rows = [
+        row("lead-1", click, high, datetime(2025, 3, 1)),
+        row("lead-2", click, medium, datetime(2025, 3, 2)),
+        row("lead-1", click, low, datetime(2025, 3, 3)),
+        row("lead-1", click, high, datetime(2025, 3, 4)),
+        row("lead-2", click, high, datetime(2025, 4, 1)),
+        row("lead-1", click, medium, datetime(2025, 3, 5)),
+        row("lead-1", unsubscribe, medium, datetime(2025, 3, 6)),
+    ]
+    everything = bill_actions(ActionStore.from_rows(rows), DedupWindows.MONTH)
+
+    # the first run bills March so far; the second what arrived since,
+    # including an action that arrived late for March
+    states = {date(2025, 3, 1): DedupState(set(), {})}
+    first = bill_against_states(ActionStore.from_rows(rows[:4]), states)
+    states[date(2025, 4, 1)] = DedupState(set(), {})
+    second = bill_against_states(ActionStore.from_rows(rows[4:]), states)
+
+    np.testing.assert_array_equal(
+        np.concatenate([first.duplicate, second.duplicate]), everything.duplicate
+    )
+    np.testing.assert_array_equal(
+        np.concatenate([first.billed, second.billed]), everything.billed
+    )
+    assert states[date(2025, 3, 1)].lead_billed == {"lead-1": 74.5, "lead-2": 31.5}
+    assert (
+        "product-1",
+        LeadTypes.EMAIL_CAMPAIGN,
+        ActionTypes.CLICK,
+        EngagementLevelTypes.HIGH,
+    ) in states[date(2025, 3, 1)].duplicate_keys
+    assert len(states[date(2025, 3, 1)].duplicate_keys) == 4
+
+    update = billed_actions_update(
+        [("action-1", datetime(2025, 3, 1), 46.5, False, "BILLED")], "report-1"
+    )
+    sql = str(update.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("UPDATE actions SET ")
+    assert "status=CAST(billed.status AS billablestatus)" in sql
+    assert "FROM (VALUES (" in sql
+    assert "actions.billing_report_id IS NULL" in sql
+
+
+def test_closed_month_range_only_accepts_whole_closed_months():
+    now = datetime(2025, 5, 15)
+
+    assert closed_month_range(
+        datetime(2025, 3, 1), datetime(2025, 4, 30, 23, 59, 59), now=now
+    ) == (date(2025, 3, 1), date(2025, 4, 1))
+    # partial month
+    assert (
+        closed_month_range(
+            datetime(2025, 3, 2), datetime(2025, 3, 31, 23, 59, 59), now=now
+        )
+        is None
+    )
+    # the current month is still open
+    assert (
+        closed_month_range(
+            datetime(2025, 5, 1), datetime(2025, 5, 31, 23, 59, 59), now=now
+        )
+        is None
+    )
+    assert closed_month_range(None, datetime(2025, 3, 31), now=now) is None
+
+
+def test_report_renderers_write_rows_subtotals_and_totals():
+    context = RenderContext(
+        "report-1",
+        "customer-1",
+        "Acme <Leads>",
+        "billing@acme.example",
+        datetime(2025, 1, 1),
+        None,
+        DedupWindows.MONTH,
+    )
+    item = {
+        "customer_email": "billing@acme.example",
+        "associated_product": "Widgets | Pro",
+        "lead_type": "STANDARD",
+        "action_type": "EMAIL",
+        "engagement_level": "HIGH",
+        "amount": 2.5,
+        "billed_amount": 2.5,
+        "duplicate": False,
+        "status": "Billed",
+    }
+    items = [item, {**item, "billed_amount": 0.0, "duplicate": True}]
+    totals = empty_report_totals()
+    for each in items:
+        add_item_to_totals(totals, each)
+
+    def render(renderer):
+        return (
+            renderer.header(context)
+            + renderer.rows(items)
+            + renderer.footer(context, totals)
+        )
+
+    markdown = render(MarkdownRenderer())
+    assert "`Widgets \\| Pro`" in markdown
+    assert "**Subtotal for `Widgets \\| Pro`:** $2.50" in markdown
+    assert "**Total Billed Amount:** $2.50" in markdown
+    assert "**Total Savings from Duplicates and Caps:** $2.50" in markdown
+    assert "Subtotal for" not in render(MarkdownRenderer(subtotals=False))
+
+    rows = list(csv.reader(io.StringIO(render(CsvRenderer()))))
+    assert rows[0][:2] == ["customer_email", "associated_product"]
+    assert rows[1][1] == "Widgets | Pro" and rows[2][7] == "True"
+    assert rows[3][1] == "Widgets | Pro" and rows[3][-1] == "Subtotal"
+    assert rows[4][5:7] == ["5.0", "2.5"] and rows[4][-1] == "Total"
+
+    page = render(HtmlRenderer())
+    assert "Acme &lt;Leads&gt;" in page and "<Leads>" not in page
+    assert page.count("<tr><td>billing@acme.example</td>") == 2
+    assert page.endswith("</body></html>\n")
+
+
+def test_month_period_covers_the_whole_month():
+    start, end = month_period(date(2024, 12, 17))
+
+    assert start == datetime(2024, 12, 1)
+    assert end == datetime(2024, 12, 31, 23, 59, 59, 999999)
+    assert closed_month_range(start, end, now=datetime(2025, 1, 2)) == (
+        date(2024, 12, 1),
+        date(2024, 12, 1),
+    )
+
+
+async def test_billing_run_resumes_without_rebilling(
+    test_engine, test_session, test_customer, test_lead, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 3, 9))
+    await test_session.commit()
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    run = await create_billing_run(test_session, date(2025, 2, 1))
+
+    await process_billing_run(session_factory, run.id, workers=2)
+    # a second pass, as after a crash, finds nothing left to bill
+    await process_billing_run(session_factory, run.id, workers=2)
+
+    reports = await test_session.scalar(
+        select(func.count())
+        .select_from(BillingReport)
+        .where(BillingReport.customer_id == test_customer.id)
+    )
+    progress = await test_session.get(
+        BillingRunCustomer, (run.id, test_customer.id), populate_existing=True
+    )
+    assert reports == 1
+    assert progress.action_count == 1
+    linked = await test_session.scalar(
+        select(Action.billing_report_id).where(Action.lead_id == test_lead.id)
+    )
+    assert linked == progress.billing_report_id
+
+
+async def test_month_is_billed_by_one_run(test_session, test_customer):
+    await create_billing_run(test_session, date(2025, 2, 1))
+
+    with pytest.raises(IntegrityError):
+        await create_billing_run(test_session, date(2025, 2, 15), incremental=True)
+
+
+async def test_full_run_after_incremental_run_bills_only_what_is_left(
+    test_engine, test_session, test_customer, test_lead, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 3, 9))
+    await test_session.commit()
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    # March's incremental run bills February's actions not on a report yet
+    run = await create_billing_run(test_session, date(2025, 3, 1), incremental=True)
+    await process_billing_run(session_factory, run.id)
+    # a repeat of the billed action and a new one arrive late
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 10, 9))
+    add_action(ActionTypes.PURCHASE, datetime(2025, 2, 11, 9))
+    await test_session.commit()
+
+    run = await create_billing_run(test_session, date(2025, 2, 1))
+    await process_billing_run(session_factory, run.id)
+
+    progress = await test_session.get(
+        BillingRunCustomer, (run.id, test_customer.id), populate_existing=True
+    )
+    assert progress.action_count == 2
+    reports = (
+        await test_session.scalars(
+            select(BillingReport).where(BillingReport.customer_id == test_customer.id)
+        )
+    ).all()
+    start, end = month_period(date(2025, 2, 1))
+    at_once = await aggregate_billing_report(
+        test_session, test_customer.id, start, end, DedupWindows.MONTH
+    )
+    assert len(reports) == 2
+    assert sum(float(report.total_billed_amount) for report in reports) == (
+        pytest.approx(at_once["total_billed_amount"])
+    )
+    unlinked = await test_session.scalar(
+        select(func.count())
+        .select_from(Action)
+        .where(Action.lead_id == test_lead.id, Action.billing_report_id.is_(None))
+    )
+    assert unlinked == 0
+
+
+async def test_incremental_run_dedupes_against_a_month_billed_by_a_full_run(
+    test_engine, test_session, test_customer, test_lead, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 3, 9))
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 4, 9))
+    await test_session.commit()
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    run = await create_billing_run(test_session, date(2025, 2, 1))
+    await process_billing_run(session_factory, run.id)
+    # late for February: a repeat of the billed key and a new one
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 10, 9))
+    add_action(ActionTypes.PURCHASE, datetime(2025, 2, 11, 9))
+    await test_session.commit()
+
+    run = await create_billing_run(test_session, date(2025, 3, 1), incremental=True)
+    await process_billing_run(session_factory, run.id)
+
+    statuses = (
+        await test_session.execute(
+            select(Action.action_type, Action.is_duplicate)
+            .where(
+                Action.lead_id == test_lead.id,
+                Action.created_at >= datetime(2025, 2, 10),
+            )
+            .order_by(Action.created_at)
+        )
+    ).all()
+    assert statuses == [(ActionTypes.SIGNUP, True), (ActionTypes.PURCHASE, False)]
+    keys = await test_session.scalars(
+        select(BillingDedupKey.action_type).where(
+            BillingDedupKey.customer_id == test_customer.id
+        )
+    )
+    assert set(keys) == {ActionTypes.SIGNUP, ActionTypes.PURCHASE}
+    start, end = month_period(date(2025, 2, 1))
+    at_once = await aggregate_billing_report(
+        test_session, test_customer.id, start, end, DedupWindows.MONTH
+    )
+    lead_billed = await test_session.scalar(
+        select(BillingLeadTotal.billed).where(BillingLeadTotal.lead_id == test_lead.id)
+    )
+    assert float(lead_billed) == pytest.approx(at_once["total_billed_amount"])
+
+
+async def test_ingestion_counts_into_rollups_refreshed_later(
+    test_session, test_customer, test_product
+):
+    leads = [
+        LeadCreate(
+            id=str(uuid4()),
+            customer_id=test_customer.id,
+            product_id=test_product.id,
+            lead_type=LeadTypes.WEBSITE_VISIT,
+            created_at=datetime(2025, 2, day),
+            actions=[
+                {
+                    "action_type": action_type,
+                    "engagement_level": EngagementLevelTypes.LOW,
+                    "created_at": datetime(2025, 2, day, hour),
+                }
+                for hour, action_type in enumerate(
+                    [ActionTypes.CLICK, ActionTypes.DOWNLOAD]
+                )
+            ],
+        )
+        for day in (3, 4)
+    ]
+    await bulk_save_leads(leads, test_session)
+
+    rollup = (
+        await test_session.scalars(
+            select(BillingRollup).where(BillingRollup.customer_id == test_customer.id)
+        )
+    ).one()
+    assert rollup.action_count == 4
+    assert rollup.stale
+    # stale rollups are not read; reports fall back to the actions
+    month = date(2025, 2, 1)
+    stale = await rollup_billing_report(test_session, test_customer.id, month, month)
+    assert stale is None
+
+    assert await refresh_stale_billing_rollups(test_session) == 1
+
+    start, end = month_period(month)
+    assert await rollup_billing_report(
+        test_session, test_customer.id, month, month
+    ) == await aggregate_billing_report(
+        test_session, test_customer.id, start, end, DedupWindows.MONTH
+    )
+    await test_session.refresh(rollup)
+    assert rollup.duplicate_count == 2
+    assert not rollup.stale
+
+
+async def test_refresh_clears_rollups_counted_outside_ingestion(
+    test_session, test_lead, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 3, 9))
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 4, 9))
+    # a count that no longer matches the actions, as left by a manual fix-up
+    rollup = BillingRollup(
+        customer_id=test_lead.customer_id,
+        product_id=test_lead.product_id,
+        month=date(2025, 2, 1),
+        action_count=5,
+        duplicate_count=0,
+        billed=0,
+        savings=0,
+        stale=True,
+    )
+    test_session.add(rollup)
+    await test_session.commit()
+
+    assert await refresh_stale_billing_rollups(test_session) == 1
+    await test_session.refresh(rollup)
+    assert (rollup.action_count, rollup.duplicate_count) == (2, 1)
+    assert not rollup.stale
+    assert await refresh_stale_billing_rollups(test_session) == 0
+
+
+async def test_refresh_skips_while_another_worker_refreshes(
+    test_session, test_session_factory, test_lead, add_action
+):
+    add_action(ActionTypes.SIGNUP, datetime(2025, 2, 3, 9))
+    rollup = BillingRollup(
+        customer_id=test_lead.customer_id,
+        product_id=test_lead.product_id,
+        month=date(2025, 2, 1),
+        action_count=1,
+        duplicate_count=0,
+        billed=0,
+        savings=0,
+        stale=True,
+    )
+    test_session.add(rollup)
+    await test_session.commit()
+
+    async with test_session_factory() as other_worker:
+        await other_worker.execute(
+            select(func.pg_advisory_xact_lock(func.hashtext(REFRESH_LOCK)))
+        )
+        assert await refresh_stale_billing_rollups(test_session) == 0
+        await other_worker.rollback()
+
+    await test_session.refresh(rollup)
+    assert rollup.stale
+    assert await refresh_stale_billing_rollups(test_session) == 1
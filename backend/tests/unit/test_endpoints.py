@@ -1,22 +1,314 @@
+import json
+from uuid import uuid4
 import pytest
 from httpx import AsyncClient
 from fastapi import status
+from sqlalchemy import func, select
+from app.api.endpoints.billing_reports import etag_matches
+from app.crud import report_snapshot_service
+from app.models import BillingReport, BillingReportFile, BillingRun
+from app.shared import BillingRunStatus
 
 
 async def test_create_lead(test_client, test_customer, test_product):
-    lead_data = {
-        "lead_type": "STANDARD",
+    lead_data = _lead_payload(test_customer.id, test_product.id)
+
+    response = await test_client.post("/leads/", json=[lead_data])
+    assert response.status_code == status.HTTP_201_CREATED
+    [result] = response.json()
+    assert result["id"] == lead_data["id"]
+    assert result["accepted"] and result["action_count"] == 2
+
+
+async def test_get_billing_report(test_client, test_customer, test_product):
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+    response = await test_client.get(f"/billingReports?customer_id={test_customer.id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert "items" in response.json()
+    assert response.json()["total_billed_amount"] > 0
+
+
+async def test_get_billing_report_items_are_opt_in(
+    test_client, test_customer, test_product
+):
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+    response = await test_client.get(
+        f"/billingReports?customer_id={test_customer.id}&include_items=true"
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert isinstance(response.json()["items"], list)
+
+
+async def test_get_billing_report_ndjson_ends_with_trailer(
+    test_client, test_customer, test_product
+):
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+    response = await test_client.get(
+        f"/billingReports?customer_id={test_customer.id}&format=ndjson"
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    trailer = lines[-1]["trailer"]
+    assert trailer["action_count"] == len(lines) - 1
+    assert "total_billed_amount" in trailer
+
+
+@pytest.mark.parametrize("report_format", ["json", "ndjson", "json-stream"])
+async def test_get_billing_report_without_actions_is_not_found(
+    test_client, test_customer, report_format
+):
+    response = await test_client.get(
+        f"/billingReports?customer_id={test_customer.id}&format={report_format}"
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_create_leads_reports_per_record_results(
+    test_client, test_customer, test_product
+):
+    lead = {
+        "id": str(uuid4()),
+        "lead_type": "Website Visit",
         "customer_id": test_customer.id,
         "product_id": test_product.id,
+        "created_at": "2025-03-01T10:00:00Z",
+        "actions": [
+            {
+                "action_type": "Click",
+                "engagement_level": "High",
+                "created_at": "2025-03-01T10:05:00Z",
+            }
+        ],
     }
+    unknown_customer = {**lead, "id": str(uuid4()), "customer_id": "missing"}
 
-    response = await test_client.post("/leads", json=lead_data)
+    response = await test_client.post("/leads/", json=[lead, unknown_customer, lead])
     assert response.status_code == status.HTTP_201_CREATED
-    assert response.json()["customer_id"] == test_customer.id
 
+    accepted, rejected, replayed = response.json()
+    assert accepted["accepted"] and accepted["action_count"] == 1
+    assert not rejected["accepted"] and "Unknown customer" in rejected["reason"]
+    assert not replayed["accepted"]
 
-async def test_get_billing_report(test_client, test_customer):
-    response = await test_client.get(f"/billingReports?customer_id={test_customer.id}")
+
+async def test_leads_with_equal_fields_are_distinct_leads(
+    test_client, test_customer, test_product
+):
+    lead = _lead_payload(test_customer.id, test_product.id)
+    twin = {**lead, "id": str(uuid4())}
+
+    response = await test_client.post("/leads/", json=[lead, twin])
+    assert [result["accepted"] for result in response.json()] == [True, True]
+
+    response = await test_client.post("/leads/", json=[lead])
+    [resent] = response.json()
+    assert resent["reason"] == f"Duplicate of lead {lead['id']}"
+
+
+def _lead_payload(customer_id, product_id, actions=2):
+    return {
+        "id": str(uuid4()),
+        "lead_type": "Website Visit",
+        "customer_id": customer_id,
+        "product_id": product_id,
+        "created_at": "2025-03-01T10:00:00Z",
+        "actions": [
+            {
+                "action_type": "Click",
+                "engagement_level": "High",
+                "created_at": f"2025-03-01T10:{minute:02d}:00Z",
+            }
+            for minute in range(actions)
+        ],
+    }
+
+
+async def test_get_leads_query_count_does_not_grow_with_leads(
+    test_client, test_customer, test_product, query_counter
+):
+    leads = [_lead_payload(test_customer.id, test_product.id) for _ in range(20)]
+    await test_client.post("/leads/", json=leads)
+    query_counter.statements.clear()
+    query_counter.loaded.clear()
+
+    response = await test_client.get(
+        f"/leads?customer_id={test_customer.id}&include=actions"
+    )
     assert response.status_code == status.HTTP_200_OK
-    assert "items" in response.json()
-    assert "total_billed_amount" in response.json()
+
+    # the page of leads, then one query for all of their actions; both are
+    # column selects
+    query_counter.assert_at_most(2)
+    assert not query_counter.loaded
+
+
+async def test_get_leads_pages_with_a_cursor(test_client, test_customer, test_product):
+    leads = [_lead_payload(test_customer.id, test_product.id) for _ in range(5)]
+    await test_client.post("/leads/", json=leads)
+    url = f"/leads?customer_id={test_customer.id}&limit=2"
+
+    seen = []
+    page = (await test_client.get(url)).json()
+    while True:
+        assert len(page["items"]) <= 2
+        assert all(lead["actions"] is None for lead in page["items"])
+        seen += [lead["id"] for lead in page["items"]]
+        if page["next_cursor"] is None:
+            break
+        page = (await test_client.get(f"{url}&cursor={page['next_cursor']}")).json()
+
+    assert len(seen) == len(set(seen))
+    assert {lead["id"] for lead in leads} <= set(seen)
+
+
+async def test_get_leads_rejects_a_bad_cursor(test_client):
+    response = await test_client.get("/leads?cursor=not-a-cursor")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_get_leads_streams_every_page(test_client, test_customer, test_product):
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+
+    response = await test_client.get(
+        f"/leads?customer_id={test_customer.id}&include=actions&format=json-stream"
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    document = json.loads(response.text)
+    assert document["next_cursor"] is None
+    assert document["items"] and len(document["items"][-1]["actions"]) == 2
+
+
+async def test_get_billing_report_loads_no_orm_rows(
+    test_client, test_customer, test_product, query_counter
+):
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id, 10)]
+    )
+    query_counter.statements.clear()
+
+    response = await test_client.get(
+        f"/billingReports?customer_id={test_customer.id}&include_items=true"
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # customer, snapshot lookup, rollup fingerprint, the actions and their
+    # product names, all of them column selects; then removing the key's
+    # previous snapshot
+    query_counter.assert_at_most(6)
+    assert not query_counter.loaded
+
+
+async def test_billing_run_reports_progress(test_client, test_customer):
+    response = await test_client.post("/billingRuns", json={"month": "2025-03-01"})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    run = response.json()
+    assert run["customer_count"] >= 1
+
+    response = await test_client.get(f"/billingRuns/{run['id']}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] in {"queued", "running", "completed"}
+
+    response = await test_client.post("/billingRuns", json={"month": "2025-03-15"})
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+async def test_failed_billing_run_is_resumed_only_as_it_ran(
+    test_client, test_session, test_customer
+):
+    response = await test_client.post("/billingRuns", json={"month": "2025-04-01"})
+    run_id = response.json()["id"]
+    run = await test_session.get(BillingRun, run_id)
+    run.status = BillingRunStatus.FAILED
+    await test_session.commit()
+
+    response = await test_client.post(
+        "/billingRuns", json={"month": "2025-04-01", "incremental": True}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.headers["location"] == f"/billingRuns/{run_id}"
+
+    response = await test_client.post("/billingRuns", json={"month": "2025-04-01"})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["id"] == run_id
+
+
+def test_etag_matches_if_none_match_lists():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches(None, '"abc"')
+    assert not etag_matches('"x"', '"abc"')
+
+
+async def test_billing_report_is_served_from_its_snapshot(
+    test_client,
+    test_session,
+    test_customer,
+    test_product,
+    monkeypatch,
+    report_storage_path,
+):
+    url = f"/billingReports?customer_id={test_customer.id}"
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+
+    first = await test_client.get(url)
+    second = await test_client.get(url)
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.json() == second.json()
+
+    not_modified = await test_client.get(
+        url, headers={"If-None-Match": first.headers["etag"]}
+    )
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # a new action in the range invalidates the snapshot
+    await test_client.post(
+        "/leads/", json=[_lead_payload(test_customer.id, test_product.id)]
+    )
+    third = await test_client.get(url)
+    assert third.headers["etag"] != first.headers["etag"]
+
+    # so do new billing rules, and billing the customer
+    monkeypatch.setattr(report_snapshot_service, "BILLING_ENGINE_VERSION", 2)
+    fourth = await test_client.get(url)
+    assert fourth.headers["etag"] != third.headers["etag"]
+    test_session.add(
+        BillingReport(
+            id=str(uuid4()), customer_id=test_customer.id, total_billed_amount=0
+        )
+    )
+    await test_session.commit()
+    fifth = await test_client.get(url)
+    assert fifth.headers["etag"] != fourth.headers["etag"]
+
+    # each one replaced the previous snapshot of the key, and its file
+    snapshots = (await test_session.scalars(select(BillingReportFile))).all()
+    assert [snapshot.id for snapshot in snapshots] == [fifth.json()["id"]]
+    assert [path.name for path in report_storage_path.rglob("*.json.gz")] == [
+        f"{snapshots[0].content_hash}.json.gz"
+    ]
+
+    # snapshots are not billing reports, but render like them
+    reports = await test_session.scalar(
+        select(func.count())
+        .select_from(BillingReport)
+        .where(BillingReport.customer_id == test_customer.id)
+    )
+    assert reports == 1
+    rendered = await test_client.get(
+        f"/billingReports/{fifth.json()['id']}/render?format=csv"
+    )
+    assert rendered.status_code == status.HTTP_200_OK
@@ -1,6 +1,10 @@
 import pytest
+from datetime import datetime
+from uuid import uuid4
 from app.models import Lead, Customer, Product, Action
-from sqlalchemy.exc import IntegrityError
+from app.shared import LeadTypes
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy.orm import selectinload
 
 
 async def test_customer_model(test_session):
@@ -15,13 +19,39 @@ async def test_customer_model(test_session):
 async def test_lead_model_relationships(test_session, test_customer, test_product):
     lead = Lead(
         id=str(uuid4()),
-        lead_type="STANDARD",
+        lead_type=LeadTypes.WEBSITE_VISIT,
         customer_id=test_customer.id,
         product_id=test_product.id,
+        created_at=datetime(2025, 3, 1),
     )
     test_session.add(lead)
     await test_session.commit()
 
-    result = await test_session.get(Lead, lead.id)
+    result = await test_session.get(
+        Lead,
+        lead.id,
+        options=[selectinload(Lead.customer), selectinload(Lead.product)],
+    )
     assert result.customer.name == "Test Customer"
     assert result.product.name == "Test Product"
+
+
+async def test_relationships_are_not_loaded_implicitly(
+    test_session, test_customer, test_product
+):
+    lead = Lead(
+        id=str(uuid4()),
+        lead_type=LeadTypes.WEBSITE_VISIT,
+        customer_id=test_customer.id,
+        product_id=test_product.id,
+        created_at=datetime(2025, 3, 1),
+    )
+    test_session.add(lead)
+    await test_session.commit()
+    test_session.expunge_all()
+
+    result = await test_session.get(Lead, lead.id)
+    with pytest.raises(InvalidRequestError):
+        result.customer
+    customer = await test_session.get(Customer, test_customer.id)
+    assert customer.leads == []
@@ -1,6 +1,7 @@
 import pytest
+from uuid import uuid4
 from pydantic import ValidationError
-from app.schemas import LeadCreate, BillingReportSchema
+from app.schemas import LeadCreate, BillingReport as BillingReportSchema
 
 
 def test_lead_create_schema():
@@ -0,0 +1,46 @@
+import itertools
+import numpy as np
+from app.shared import (
+    LeadTypes,
+    ActionTypes,
+    EngagementLevelTypes,
+    LEAD_TYPE_BASE_VALUES,
+    LEAD_ACTION_COSTS,
+    ENGAGEMENT_MULTIPLIERS,
+    LEAD_TYPE_CODES,
+    ACTION_TYPE_CODES,
+    ENGAGEMENT_LEVEL_CODES,
+    calculate_action_value,
+    encode,
+    price_actions,
+)
+
+
+def test_pricing_table_matches_pricing_dicts():
+    for lead_type, action_type, level in itertools.product(
+        LeadTypes, ActionTypes, EngagementLevelTypes
+    ):
+        expected = (
+            LEAD_TYPE_BASE_VALUES[lead_type]
+            + LEAD_ACTION_COSTS[lead_type].get(action_type, 0)
+            * ENGAGEMENT_MULTIPLIERS[level]
+        )
+        assert calculate_action_value(lead_type, action_type, level) == expected
+
+
+def test_calculate_action_value_accepts_plain_strings():
+    assert calculate_action_value("Email Campaign", "Click", "High") == 46.5
+    assert calculate_action_value("Unknown", "Click", "High") == 0
+
+
+def test_price_actions_prices_arrays_of_codes():
+    actions = [
+        (LeadTypes.WEBSITE_VISIT, ActionTypes.CLICK, EngagementLevelTypes.HIGH),
+        (LeadTypes.REFERRAL, ActionTypes.SIGNUP, EngagementLevelTypes.LOW),
+    ]
+    prices = price_actions(
+        encode((a[0] for a in actions), LEAD_TYPE_CODES),
+        encode((a[1] for a in actions), ACTION_TYPE_CODES),
+        encode((a[2] for a in actions), ENGAGEMENT_LEVEL_CODES),
+    )
+    np.testing.assert_array_equal(prices, [7.0, 23.0])
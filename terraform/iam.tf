@@ -55,6 +55,20 @@ resource "aws_iam_policy" "ecs_task_custom_policy" {
         ]
         Effect   = "Allow"
         Resource = "*"
+      },
+      {
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes",
+          "sqs:SendMessage"
+        ]
+        Effect = "Allow"
+        Resource = [
+          aws_sqs_queue.lead_events.arn,
+          aws_sqs_queue.lead_events_dead_letter.arn
+        ]
       }
     ]
   })
@@ -39,3 +39,13 @@ output "ecs_service_name" {
   description = "Name of the ECS service"
   value       = aws_ecs_service.app.name
 }
+
+output "lead_events_queue_url" {
+  description = "URL of the lead events queue (LEAD_EVENTS_QUEUE_URL)"
+  value       = aws_sqs_queue.lead_events.url
+}
+
+output "lead_events_dead_letter_queue_url" {
+  description = "URL of the lead events dead-letter queue (LEAD_EVENTS_DEAD_LETTER_URL)"
+  value       = aws_sqs_queue.lead_events_dead_letter.url
+}
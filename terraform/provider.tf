@@ -18,6 +18,7 @@ provider "aws" {
     cloudformation = "http://localstack:4566"
     cloudwatch     = "http://localstack:4566"
     secretsmanager = "http://localstack:4566"
+    sqs            = "http://localstack:4566"
   }
 
   default_tags {
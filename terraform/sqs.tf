@@ -0,0 +1,27 @@
+# SQS - lead events, consumed by the app.worker process
+
+resource "aws_sqs_queue" "lead_events_dead_letter" {
+  name                      = "${var.project_name}-lead-events-dlq"
+  message_retention_seconds = 1209600 # 14 days, the maximum
+
+  tags = {
+    Name = "${var.project_name}-lead-events-dlq"
+  }
+}
+
+resource "aws_sqs_queue" "lead_events" {
+  name = "${var.project_name}-lead-events"
+  # the worker extends it while a batch is being written
+  visibility_timeout_seconds = 30
+  receive_wait_time_seconds  = 20
+
+  # backstop for the worker's own dead-lettering after LEAD_EVENTS_MAX_RECEIVES
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.lead_events_dead_letter.arn
+    maxReceiveCount     = 10
+  })
+
+  tags = {
+    Name = "${var.project_name}-lead-events"
+  }
+}